@@ -0,0 +1,55 @@
+"""
+Short-lived signed access tokens.
+
+An access token embeds a user id and an expiry, signed with `settings.SECRET_KEY`,
+so it can be checked without any database lookup. Access tokens cannot be
+revoked: they are issued alongside an `AuthToken`, which acts as the refresh
+token and is checked in the database each time a new access token is minted.
+"""
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+
+MINUTE = 60
+# Max expiry time for access tokens
+DEFAULT_AUTH_ACCESS_TOKEN_MAX_AGE = 5 * MINUTE
+SALT = 'user_management.api.access_tokens'
+
+
+class ExpiredAccessToken(Exception):
+    """The access token has a valid signature but has expired."""
+
+
+def get_max_age():
+    max_age = getattr(
+        settings,
+        'AUTH_ACCESS_TOKEN_MAX_AGE',
+        DEFAULT_AUTH_ACCESS_TOKEN_MAX_AGE,
+    )
+    return datetime.timedelta(seconds=max_age)
+
+
+def make_access_token(user):
+    """Return a new access token for `user`, and its expiry datetime."""
+    expires = timezone.now() + get_max_age()
+    payload = {
+        'user': user.pk,
+        'expires': int(expires.timestamp()),
+    }
+    return signing.dumps(payload, salt=SALT), expires
+
+
+def load_access_token(token):
+    """
+    Return the id of the user `token` was issued to.
+
+    Raise `signing.BadSignature` if the token was tampered with, and
+    `ExpiredAccessToken` if it has expired.
+    """
+    payload = signing.loads(token, salt=SALT)
+    if payload['expires'] <= timezone.now().timestamp():
+        raise ExpiredAccessToken()
+    return payload['user']
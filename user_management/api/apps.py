@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_in
+
+
+class APIConfig(AppConfig):
+    name = 'user_management.api'
+
+    def ready(self):
+        from .models import update_last_login
+
+        # Replace django's receiver (connected by `django.contrib.auth`, which must
+        # come first in `INSTALLED_APPS`) if the user model has a `last_login`.
+        if user_logged_in.disconnect(dispatch_uid='update_last_login'):
+            user_logged_in.connect(update_last_login, dispatch_uid='update_last_login')
@@ -1,9 +1,38 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import authentication, exceptions
 from rest_framework.authentication import TokenAuthentication as DRFTokenAuthentication
 
-from .models import AuthToken
+from . import access_tokens, cache as token_cache, routers
+from .models import AuthToken, expiry_buffer
+
+
+class LazyUser(SimpleLazyObject):
+    """
+    Proxy to the user with primary key `pk`, loaded from `users` when first used.
+
+    Reading `pk` and `is_authenticated`, or checking the proxy is truthy, doesn't
+    load the user. Using a user deleted meanwhile raises `AuthenticationFailed`.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, pk, users):
+        def load():
+            try:
+                return users.get(pk=pk)
+            except users.model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        super(LazyUser, self).__init__(load)
+        self.__dict__['pk'] = pk
+
+    def __bool__(self):
+        return True
 
 
 class FormTokenAuthentication(authentication.BaseAuthentication):
@@ -11,6 +40,8 @@ class FormTokenAuthentication(authentication.BaseAuthentication):
         """
         Authenticate a user from a token form field
 
+        The token is checked like by `TokenAuthentication`, including its expiry.
+
         Errors thrown here will be swallowed by django-rest-framework, and it
         expects us to return None if authentication fails.
         """
@@ -18,22 +49,116 @@ class FormTokenAuthentication(authentication.BaseAuthentication):
             key = request.data['token']
         except KeyError:
             return
+        if not isinstance(key, str):
+            # E.g. a number in a JSON body.
+            return
 
         try:
-            token = AuthToken.objects.get(key=key)
-        except AuthToken.DoesNotExist:
+            with routers.primary_for_unsafe(request):
+                return TokenAuthentication().authenticate_credentials(key)
+        except exceptions.AuthenticationFailed:
             return
 
-        return (token.user, token)
-
 
 class TokenAuthentication(DRFTokenAuthentication):
     model = AuthToken
+    # User fields that are only loaded when accessed.
+    deferred_user_fields = ('password',)
+
+    def authenticate(self, request):
+        """Look tokens up on the primary database for requests that may write."""
+        with routers.primary_for_unsafe(request):
+            return super(TokenAuthentication, self).authenticate(request)
 
     def authenticate_credentials(self, key):
-        """Custom authentication to check if auth token has expired."""
-        user, token = super(TokenAuthentication, self).authenticate_credentials(key)
+        """
+        Custom authentication to check if auth token has expired.
+
+        Tokens found in `settings.AUTH_TOKEN_CACHE` are not looked up in the
+        database.
+        """
+        token = self.model.objects.get_cached(key)
+        if token is not None:
+            return self.cached_credentials(token)
+
+        if getattr(settings, 'AUTH_TOKEN_SINGLE_QUERY', False):
+            user, token = self.refresh_credentials(key)
+        else:
+            user, token = self.fetch_credentials(key)
+
+        token_cache.set_token(token)
+        token.record_use()
+        return (user, token)
+
+    async def aauthenticate_credentials(self, key):
+        """
+        Async `authenticate_credentials`, e.g. for consumers served over ASGI.
+
+        Django has no async ORM yet, so the lookup runs in the thread kept for
+        synchronous database access, off the event loop. Requires `asgiref`,
+        installed with Django 3.0+.
+        """
+        from asgiref.sync import sync_to_async
+        authenticate = sync_to_async(self.authenticate_credentials, thread_sensitive=True)
+        return await authenticate(key)
+
+    @property
+    def lazy_user(self):
+        """
+        Whether to authenticate a `LazyUser` instead of loading the user.
+
+        Tokens of inactive users are then treated as invalid. Not supported when
+        tokens are sharded, as it filters tokens by joining the user table.
+        """
+        if routers.get_shards():
+            return False
+        return getattr(settings, 'AUTH_TOKEN_LAZY_USER', False)
+
+    def fetch_credentials(self, key):
+        if self.lazy_user:
+            tokens = self.model.objects.filter(user__is_active=True)
+        elif routers.get_shards():
+            # Users aren't on the token's shard: load the user separately.
+            tokens = self.model.objects.all()
+        else:
+            tokens = self.model.objects.select_related('user')
+
+        try:
+            with routers.read_token_from_replicas(key):
+                token = tokens.get_by_key(key)
+        except self.model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if self.lazy_user:
+            user = self.get_lazy_user(token.user_id)
+        elif token.user.is_active:
+            user = token.user
+        else:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        self.check_expiry(token)
+        return (user, token)
+
+    def cached_credentials(self, token):
+        if self.lazy_user:
+            # Tokens of deactivated users are evicted from the caches.
+            user = self.get_lazy_user(token.user_id)
+        else:
+            with routers.read_token_from_replicas(token.key):
+                user = token.user = self.get_user(token.user_id)
+
+        cached_expires = token.expires
+        self.check_expiry(token)
+        if token.expires != cached_expires:
+            token_cache.set_token(token)
+
+        token.record_use()
+        return (user, token)
 
+    def check_expiry(self, token):
+        """Check the token hasn't expired and extend its expiry."""
+        # Take into account any refresh not yet written to the database
+        expiry_buffer.apply(token)
         if token.expires < timezone.now():
             msg = _('Token has expired.')
             raise exceptions.AuthenticationFailed(msg)
@@ -41,4 +166,67 @@ class TokenAuthentication(DRFTokenAuthentication):
         # Update the token's expiration date
         token.update_expiry()
 
-        return (user, token)
+    def refresh_credentials(self, key):
+        """
+        Check and extend the token's expiry in the database.
+
+        See `AuthTokenManager.refresh`. The user is then loaded without
+        `deferred_user_fields`.
+        """
+        token = self.model.objects.refresh(key, active_users_only=self.lazy_user)
+        if token is None:
+            tokens = self.model.objects.filter_key(key)
+            if self.lazy_user:
+                tokens = tokens.filter(user__is_active=True)
+            if tokens.exists():
+                msg = _('Token has expired.')
+            else:
+                msg = _('Invalid token.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        if self.lazy_user:
+            return (self.get_lazy_user(token.user_id), token)
+
+        token.user = self.get_user(token.user_id)
+        return (token.user, token)
+
+    def get_user(self, user_id):
+        User = get_user_model()
+        users = User._default_manager.defer(*self.deferred_user_fields)
+        try:
+            user = users.get(pk=user_id)
+        except User.DoesNotExist:
+            user = None
+
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user
+
+    def get_lazy_user(self, user_id):
+        User = get_user_model()
+        users = User._default_manager.defer(*self.deferred_user_fields)
+        return LazyUser(user_id, users)
+
+
+class AccessTokenAuthentication(TokenAuthentication):
+    """
+    Authenticate a user from a signed access token.
+
+    Clients pass the access token in the "Authorization" HTTP header, prepended
+    with "Bearer ". The token is checked without a database query (see
+    `user_management.api.access_tokens`), and authenticates a `LazyUser`.
+
+    Refreshing an access token requires an active user, so a user deactivated
+    meanwhile keeps access for at most `settings.AUTH_ACCESS_TOKEN_MAX_AGE`.
+    """
+    keyword = 'Bearer'
+
+    def authenticate_credentials(self, key):
+        try:
+            user_id = access_tokens.load_access_token(key)
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        except access_tokens.ExpiredAccessToken:
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        return (self.get_lazy_user(user_id), key)
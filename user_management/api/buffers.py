@@ -0,0 +1,93 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
+
+
+def bulk_update(queryset, instances, fields):
+    """
+    Save `fields` of `instances` with a single `UPDATE` statement, and return the
+    number of rows updated.
+
+    Like `QuerySet.bulk_update`, which only exists from Django 2.2.
+    """
+    opts = queryset.model._meta
+    features = connections[queryset.db].features
+    values = {}
+    for name in fields:
+        field = opts.get_field(name)
+        whens = [
+            When(pk=instance.pk, then=Value(getattr(instance, name), output_field=field))
+            for instance in instances
+        ]
+        value = Case(*whens, output_field=field)
+        if getattr(features, 'requires_casted_case_in_updates', False):
+            value = Cast(value, output_field=field)
+        values[name] = value
+    pks = [instance.pk for instance in instances]
+    return queryset.filter(pk__in=pks).update(**values)
+
+
+class WriteBuffer(object):
+    """
+    Collect pending field values for model rows and write them in batches.
+
+    Values are held in memory per process and written with a single `UPDATE`
+    statement (per database) once `interval` seconds have passed since the last flush.
+    The interval is read from the django setting named by `interval_setting`;
+    when it is not set the buffer is disabled and callers should write directly.
+
+    Rows deleted before a flush are not recreated.
+    """
+    def __init__(self, model, fields, interval_setting):
+        self.model = model
+        self.fields = fields
+        self.interval_setting = interval_setting
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def interval(self):
+        return getattr(settings, self.interval_setting, None)
+
+    @property
+    def enabled(self):
+        return bool(self.interval)
+
+    def add(self, instance):
+        """Queue the buffered fields of `instance`, flushing if an interval has passed."""
+        values = {field: getattr(instance, field) for field in self.fields}
+        with self.lock:
+            self.pending[instance.pk] = values
+
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def apply(self, instance):
+        """Copy any pending (not yet written) values onto `instance`."""
+        values = self.pending.get(instance.pk, {})
+        for field, value in values.items():
+            setattr(instance, field, value)
+
+    def flush(self):
+        """Write all pending values with one `bulk_update` per database."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+
+        if not pending:
+            return
+
+        by_db = {}
+        for pk, values in pending.items():
+            instance = self.model(pk=pk, **values)
+            db = router.db_for_write(self.model, instance=instance)
+            by_db.setdefault(db, []).append(instance)
+
+        # One write per database (rows may be sharded).
+        for db, instances in by_db.items():
+            bulk_update(self.model.objects.using(db), instances, self.fields)
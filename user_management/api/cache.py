@@ -0,0 +1,186 @@
+"""
+Optional caches of auth token lookups.
+
+Set `settings.AUTH_TOKEN_CACHE` to the alias of a cache in `settings.CACHES` to
+map token keys to `(key, user_id, created, expires, digest)`, as stored in the
+database. Entries never outlive the token's current expiry. Only a hash of the
+key's lookup prefix (see `user_management.api.keys`) is used as cache key, so
+entries can be removed knowing the stored key only, and the key given to the
+client isn't stored in the cache.
+
+Set `settings.AUTH_TOKEN_LOCAL_CACHE_SIZE` to also keep recently used tokens in
+memory, in front of the shared cache. Entries are kept for at most
+`settings.AUTH_TOKEN_LOCAL_CACHE_TTL` seconds, which bounds how long a token
+deleted by another process keeps working in this one.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from . import keys
+
+
+KEY_PREFIX = 'user_management:authtoken:'
+DEFAULT_AUTH_TOKEN_LOCAL_CACHE_TTL = 5
+
+
+class LocalCache(object):
+    """
+    A size-bounded, thread-safe, in-memory LRU cache with per-entry timeouts.
+
+    Counts `hits`, `misses` (including expired entries) and `evictions` of
+    least recently used entries to make room for new ones.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_SIZE', None)
+
+    @property
+    def ttl(self):
+        return getattr(
+            settings,
+            'AUTH_TOKEN_LOCAL_CACHE_TTL',
+            DEFAULT_AUTH_TOKEN_LOCAL_CACHE_TTL,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.maxsize)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                deadline, value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return
+
+            if deadline <= time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout):
+        """
+        Store `value` for at most `timeout` seconds and `ttl` seconds.
+
+        Updating an entry doesn't extend how long it is kept.
+        """
+        deadline = time.monotonic() + min(timeout, self.ttl)
+        with self.lock:
+            if key in self.entries:
+                deadline = min(deadline, self.entries[key][0])
+            self.entries[key] = (deadline, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, cache_keys):
+        with self.lock:
+            for key in cache_keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+local_cache = LocalCache()
+
+
+def get_cache():
+    alias = getattr(settings, 'AUTH_TOKEN_CACHE', None)
+    if alias is not None:
+        return caches[alias]
+
+
+def is_enabled():
+    return local_cache.enabled or get_cache() is not None
+
+
+def make_key(key):
+    prefix = keys.get_prefix(key)
+    return KEY_PREFIX + hashlib.sha256(prefix.encode()).hexdigest()
+
+
+def get_token(key):
+    """
+    Return the cached `(key, user_id, created, expires, digest)` for token `key`.
+
+    Return `None` if there is no such entry. The entry may belong to another key
+    with the same prefix: check it before use.
+    """
+    cache_key = make_key(key)
+    if local_cache.enabled:
+        value = local_cache.get(cache_key)
+        if value is not None:
+            return value
+
+    cache = get_cache()
+    if cache is None:
+        return
+
+    value = cache.get(cache_key)
+    if value is not None and local_cache.enabled:
+        expires = value[3]
+        timeout = (expires - timezone.now()).total_seconds()
+        local_cache.set(cache_key, value, timeout)
+    return value
+
+
+def set_token(token):
+    """Cache `token` until it expires."""
+    if not is_enabled():
+        return
+
+    timeout = int((token.expires - timezone.now()).total_seconds())
+    if timeout <= 0:
+        return
+
+    cache_key = make_key(token.key)
+    digest = None if token.digest is None else bytes(token.digest)
+    value = (token.key, token.user_id, token.created, token.expires, digest)
+    if local_cache.enabled:
+        local_cache.set(cache_key, value, timeout)
+
+    cache = get_cache()
+    if cache is not None:
+        cache.set(cache_key, value, timeout)
+
+
+def delete_tokens(token_keys):
+    """Remove the tokens with `token_keys` (as stored) from the caches."""
+    if not token_keys:
+        return
+
+    cache_keys = [make_key(key) for key in token_keys]
+    local_cache.delete_many(cache_keys)
+
+    cache = get_cache()
+    if cache is not None:
+        cache.delete_many(cache_keys)
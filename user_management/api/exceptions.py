@@ -7,3 +7,17 @@ class InvalidExpiredToken(APIException):
     """Exception to confirm an account."""
     status_code = status.HTTP_400_BAD_REQUEST
     default_detail = _('Invalid or expired token.')
+
+
+class AmbiguousFingerprint(APIException):
+    """Exception when several of a user's tokens share a fingerprint."""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = _('More than one session matches this fingerprint.')
+
+
+class PasswordHashingUnavailable(APIException):
+    """Response to `utils.hashing.HashingUnavailable`: too many passwords to hash."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('The service is busy, please try again later.')
+    # Sent as `Retry-After` by rest framework's exception handler.
+    wait = 1
@@ -0,0 +1,26 @@
+"""
+Helpers for auth token keys stored as a lookup prefix and a digest.
+
+When `settings.AUTH_TOKEN_HASH_KEYS` is `True`, new `AuthToken`s store the first
+`PREFIX_LENGTH` characters of their key in the `key` column, and the SHA-256
+digest of the whole key in the `digest` column. The prefix is not secret; it
+is only used to find the token.
+"""
+import hashlib
+import hmac
+
+
+PREFIX_LENGTH = 16
+
+
+def get_prefix(key):
+    return key[:PREFIX_LENGTH]
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).digest()
+
+
+def check_digest(digest, key):
+    """Check in constant time that `digest` is the digest of `key`."""
+    return hmac.compare_digest(bytes(digest), hash_key(key))
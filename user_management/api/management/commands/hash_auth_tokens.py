@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from user_management.api import cache as token_cache, keys, routers
+from user_management.api.models import AuthToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Store auth tokens saved with their whole key as a lookup prefix and a "
+        "digest instead. Clients keep using the same keys."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of tokens to convert in each transaction.",
+        )
+
+    def handle(self, *args, **options):
+        converted = 0
+        for db in routers.get_databases():
+            converted = self.convert_database(db, options['batch_size'], converted)
+
+    def convert_database(self, db, batch_size, converted):
+        """
+        Convert the tokens stored on database `db`, and return the running count.
+
+        A token's prefix and whole key are on the same shard.
+        """
+        tokens = AuthToken.objects.using(db).filter(digest__isnull=True).order_by('pk')
+        last_key = ''
+
+        while True:
+            batch = list(tokens.filter(pk__gt=last_key)[:batch_size])
+            if not batch:
+                break
+            last_key = batch[-1].pk
+
+            # Keys not longer than a prefix can't be split.
+            batch = [token for token in batch if len(token.key) > keys.PREFIX_LENGTH]
+            converted += self.convert(db, batch)
+            self.stdout.write('Converted {} tokens.'.format(converted))
+        return converted
+
+    def convert(self, db, batch):
+        """Convert the tokens of `batch` still stored, and return how many."""
+        old_keys = [token.key for token in batch]
+        tokens = AuthToken.objects.using(db)
+        with transaction.atomic(using=db):
+            # Read the tokens again: those revoked since must not come back, and
+            # those refreshed keep their new expiry.
+            current = tokens.select_for_update().filter(
+                pk__in=old_keys,
+                digest__isnull=True,
+            )
+            current = list(current)
+            hashed = [
+                AuthToken(
+                    key=keys.get_prefix(token.key),
+                    digest=keys.hash_key(token.key),
+                    user_id=token.user_id,
+                    created=token.created,
+                    expires=token.expires,
+                    last_used=token.last_used,
+                )
+                for token in current
+            ]
+            tokens.bulk_create(hashed)
+            tokens.filter(pk__in=[token.key for token in current]).delete()
+
+        token_cache.delete_tokens(old_keys)
+        return len(current)
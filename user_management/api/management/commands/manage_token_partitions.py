@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from user_management.api import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly partitions of the auth token table that new tokens "
+        "need, and drop the partitions of months that have passed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=1,
+            help="Extra months to create beyond `AUTH_TOKEN_MAX_AGE`.",
+        )
+        parser.add_argument(
+            '--detach',
+            action='store_true',
+            help="Detach expired partitions instead of dropping them.",
+        )
+
+    def handle(self, *args, **options):
+        connections = partitions.get_connections()
+        if any(connection.vendor != 'postgresql' for connection in connections):
+            raise CommandError('Partitioned auth tokens require PostgreSQL.')
+
+        now = timezone.now()
+        for connection in connections:
+            self.manage_partitions(connection, now, options)
+
+    def manage_partitions(self, connection, now, options):
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            created = partitions.create_partitions(cursor, now, options['months_ahead'])
+            removed = partitions.remove_expired_partitions(
+                cursor,
+                now,
+                detach=options['detach'],
+            )
+
+        for name in created:
+            self.stdout.write('Created {}.'.format(name))
+        action = 'Detached' if options['detach'] else 'Dropped'
+        for name in removed:
+            self.stdout.write('{} {}.'.format(action, name))
@@ -0,0 +1,85 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from user_management.api import buffers
+
+
+class Command(BaseCommand):
+    help = (
+        "Set the normalized email of users saved before it was added (see "
+        "`NormalizedEmailUserMixin`), in batches of consecutive users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of users to update in each transaction.",
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help="Seconds to wait between batches.",
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        normalized_fields = getattr(User, 'NORMALIZED_FIELDS', {})
+        if 'email' not in normalized_fields:
+            raise CommandError('{} has no normalized email.'.format(User.__name__))
+        self.field = normalized_fields['email']
+
+        users = User._default_manager.filter(**{self.field + '__isnull': True})
+        users = users.order_by('pk').only('pk', 'email')
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = None
+
+        while True:
+            batch = users if last_pk is None else users.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            for user in batch:
+                setattr(user, self.field, user.email.lower())
+            updated += self.update(batch)
+            self.stdout.write('Normalized {} emails.'.format(updated))
+
+            if len(batch) < batch_size:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+    def update(self, batch):
+        """Save the normalized emails of `batch`, and return how many were saved."""
+        manager = type(batch[0])._default_manager
+        try:
+            with transaction.atomic():
+                buffers.bulk_update(manager.all(), batch, [self.field])
+            return len(batch)
+        except IntegrityError:
+            pass
+
+        # Emails differing only by case can't both be normalized: skip them.
+        updated = 0
+        for user in batch:
+            try:
+                with transaction.atomic():
+                    manager.filter(pk=user.pk).update(
+                        **{self.field: getattr(user, self.field)}
+                    )
+            except IntegrityError:
+                self.stderr.write('Duplicate email for user {}: {}'.format(
+                    user.pk,
+                    user.email,
+                ))
+            else:
+                updated += 1
+        return updated
@@ -0,0 +1,69 @@
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from user_management.api import routers
+from user_management.utils import hashing
+
+
+class Command(BaseCommand):
+    help = (
+        "Count users by password hasher, and those to rehash with the current "
+        "hasher settings, reading the users in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of users to read with each query.",
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help="Seconds to wait between batches.",
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User._default_manager.order_by('pk')
+        batch_size = options['batch_size']
+        algorithms = Counter()
+        outdated = Counter()
+        last_pk = None
+
+        while True:
+            batch = users if last_pk is None else users.filter(pk__gt=last_pk)
+            # Reads from replicas when they're set up.
+            with routers.read_from_replicas():
+                rows = list(batch.values_list('pk', 'password')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            for pk, encoded in rows:
+                algorithm, is_outdated = hashing.password_status(encoded)
+                algorithm = algorithm or 'unusable'
+                algorithms[algorithm] += 1
+                outdated[algorithm] += is_outdated
+            self.stdout.write('Read {} users.'.format(sum(algorithms.values())))
+
+            if len(rows) < batch_size:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        for algorithm, count in algorithms.most_common():
+            self.stdout.write('{}: {} users, {} to rehash.'.format(
+                algorithm,
+                count,
+                outdated[algorithm],
+            ))
+        self.stdout.write('Total: {} users, {} to rehash.'.format(
+            sum(algorithms.values()),
+            sum(outdated.values()),
+        ))
@@ -1,12 +1,113 @@
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import connections
 from django.utils import timezone
 
+from user_management.api import cache as token_cache, partitions, routers
 from user_management.api.models import AuthToken
 
 
 class Command(BaseCommand):
-    help = "Remove expired auth tokens from the database."
+    help = (
+        "Remove expired auth tokens from the database, in batches of consecutive "
+        "keys."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of tokens to remove with each query.",
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help="Seconds to wait between batches.",
+        )
+        parser.add_argument(
+            '--max-runtime',
+            type=float,
+            default=None,
+            help="Stop starting new batches after this many seconds.",
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only count the expired tokens.",
+        )
 
     def handle(self, *args, **options):
         now = timezone.now()
-        AuthToken.objects.filter(expires__lte=now).delete()
+        databases = routers.get_databases()
+
+        if options['dry_run']:
+            count = sum(
+                AuthToken.objects.using(db).filter(expires__lte=now).count()
+                for db in databases
+            )
+            self.stdout.write('Would remove {} expired tokens.'.format(count))
+            return
+
+        if partitions.is_enabled():
+            # Cached tokens expire from caches by themselves.
+            for db in databases:
+                with connections[db].cursor() as cursor:
+                    dropped = partitions.remove_expired_partitions(cursor, now)
+                for name in dropped:
+                    self.stdout.write('Dropped {}.'.format(name))
+
+        self.start = time.monotonic()
+        self.batches = 0
+        self.removed = 0
+        for db in databases:
+            if not self.remove_expired(db, now, options):
+                self.stdout.write('Stopped after reaching --max-runtime.')
+                break
+
+        self.stdout.write('Done: removed {} expired tokens.'.format(self.removed))
+
+    def remove_expired(self, db, now, options):
+        """
+        Remove the tokens expired by `now` from database `db`.
+
+        Return `False` if stopped by `--max-runtime`.
+        """
+        tokens = AuthToken.objects.using(db).filter(expires__lte=now).order_by('pk')
+        batch_size = options['batch_size']
+        max_runtime = options['max_runtime']
+        last_key = None
+
+        while True:
+            if self.batches:
+                runtime = time.monotonic() - self.start
+                if max_runtime is not None and runtime >= max_runtime:
+                    return False
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+
+            batch = tokens if last_key is None else tokens.filter(pk__gt=last_key)
+            keys = list(batch.values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                return True
+
+            self.removed += self.delete(tokens.filter(pk__gte=keys[0], pk__lte=keys[-1]))
+            if token_cache.is_enabled():
+                token_cache.delete_tokens(keys)
+            last_key = keys[-1]
+            self.batches += 1
+            self.stdout.write('Removed {} expired tokens.'.format(self.removed))
+
+            if len(keys) < batch_size:
+                return True
+
+    def delete(self, tokens):
+        """
+        Delete `tokens` with a single `DELETE` statement.
+
+        Nothing references `AuthToken`, so this skips the deletion collector
+        (which would load the tokens) and `pre_delete`/`post_delete` signals.
+        """
+        return tokens._raw_delete(tokens.db)
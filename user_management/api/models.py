@@ -1,11 +1,20 @@
 import binascii
 import datetime
+import hmac
+import itertools
 import os
 
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Least
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
 from django.utils import timezone
 
+from . import cache as token_cache, keys, routers
+from .buffers import WriteBuffer
+
 
 MINUTE = 60
 HOUR = 60 * MINUTE
@@ -14,31 +23,250 @@ DAY = 24 * HOUR
 DEFAULT_AUTH_TOKEN_MAX_AGE = 200 * DAY
 # Max inactivity time
 DEFAULT_AUTH_TOKEN_MAX_INACTIVITY = 12 * HOUR
+# Don't write a new expiry closer than this to the stored one
+DEFAULT_AUTH_TOKEN_EXPIRY_GRANULARITY = 0
 
 
-def update_expiry(created=None):
-    now = timezone.now()
-
-    if created is None:
-        created = now
-
+def get_max_age():
     max_age = getattr(
         settings,
         'AUTH_TOKEN_MAX_AGE',
         DEFAULT_AUTH_TOKEN_MAX_AGE,
     )
-    max_age = created + datetime.timedelta(seconds=max_age)
+    return datetime.timedelta(seconds=max_age)
+
 
+def get_max_inactivity():
     max_inactivity = getattr(
         settings,
         'AUTH_TOKEN_MAX_INACTIVITY',
         DEFAULT_AUTH_TOKEN_MAX_INACTIVITY,
     )
-    max_inactivity = now + datetime.timedelta(seconds=max_inactivity)
+    return datetime.timedelta(seconds=max_inactivity)
+
+
+def update_expiry(created=None):
+    now = timezone.now()
+
+    if created is None:
+        created = now
+
+    max_age = created + get_max_age()
+    max_inactivity = now + get_max_inactivity()
 
     return min(max_inactivity, max_age)
 
 
+class AuthTokenQuerySet(models.QuerySet):
+    def for_key(self, key):
+        """
+        Query the shard storing token `key` (see `user_management.api.routers`).
+
+        Unless tokens are sharded or a database was chosen with `using()`, return
+        the queryset unchanged.
+        """
+        if self._db is None and routers.get_shards():
+            return self.using(routers.shard_for_key(key))
+        return self
+
+    def fan_out(self, func):
+        """
+        Return the list of results of `func` called with this queryset on each shard.
+
+        Shards are queried in turn. Unless tokens are sharded or a database was
+        chosen with `using()`, `func` is called once with the queryset.
+        """
+        if self._db is not None or not routers.get_shards():
+            return [func(self)]
+        return routers.for_each_shard(lambda alias: func(self.using(alias)))
+
+    def filter_key(self, key):
+        """
+        Filter the token with `key`, as given to the client.
+
+        Matches tokens stored with their whole key as well as tokens stored as a
+        prefix and digest (see `user_management.api.keys`).
+        """
+        return self.for_key(key).filter(
+            Q(key=key, digest__isnull=True) |
+            Q(key=keys.get_prefix(key), digest=keys.hash_key(key)),
+        )
+
+    def get_by_key(self, key):
+        """
+        Get the token with `key`, as given to the client.
+
+        The token is found by primary key, then checked with `AuthToken.check_key`.
+        """
+        try:
+            return self.get_by_keys([key])[key]
+        except KeyError:
+            raise self.model.DoesNotExist('AuthToken matching query does not exist.')
+
+    def get_by_keys(self, token_keys):
+        """
+        Get the tokens with `token_keys`, as given to clients, with a single query
+        (per shard).
+
+        Return a dict of the tokens found by key.
+        """
+        if self._db is None and routers.get_shards():
+            shard_keys = {}
+            for key in token_keys:
+                shard_keys.setdefault(routers.shard_for_key(key), []).append(key)
+
+            tokens = {}
+            for alias, keys_on_shard in shard_keys.items():
+                tokens.update(self.using(alias).get_by_keys(keys_on_shard))
+            return tokens
+
+        candidates = {}
+        for key in token_keys:
+            candidates.setdefault(key, set()).add(key)
+            candidates.setdefault(keys.get_prefix(key), set()).add(key)
+
+        tokens = {}
+        for token in self.filter(key__in=candidates):
+            for key in candidates[token.key]:
+                if token.check_key(key):
+                    tokens[key] = token
+        return tokens
+
+    def delete(self):
+        """
+        Delete the tokens (on every shard), also removing them from
+        `user_management.api.cache`.
+        """
+        if self._db is None and routers.get_shards():
+            deleted = 0
+            for count, _ in self.fan_out(lambda tokens: tokens.delete()):
+                deleted += count
+            return deleted, {self.model._meta.label: deleted}
+
+        if token_cache.is_enabled():
+            token_cache.delete_tokens(list(self.values_list('key', flat=True)))
+        return super(AuthTokenQuerySet, self).delete()
+
+    def trim_user_tokens(self, user_id, max_tokens):
+        """
+        Delete the expired tokens of user `user_id`, and all but the `max_tokens`
+        tokens expiring last (the most recently refreshed).
+        """
+        tokens = self.filter(user_id=user_id)
+
+        def latest(tokens):
+            tokens = tokens.filter(expires__gt=timezone.now()).order_by('-expires')
+            return list(tokens.values_list('expires', 'pk')[:max_tokens])
+
+        keep = sorted(itertools.chain(*tokens.fan_out(latest)), reverse=True)
+        keep = [pk for expires, pk in keep[:max_tokens]]
+        return tokens.exclude(pk__in=keep).delete()
+
+
+class AuthTokenManager(models.Manager.from_queryset(AuthTokenQuerySet)):
+    def from_values(self, key, user_id, created, expires, digest):
+        """Build a token from values that were not loaded through this manager."""
+        return self.model.from_db(
+            self.for_key(key).db,
+            ['key', 'user_id', 'created', 'expires', 'digest'],
+            [key, user_id, created, expires, digest],
+        )
+
+    def get_cached(self, key):
+        """Return token `key` from `settings.AUTH_TOKEN_CACHE`, or `None`."""
+        values = token_cache.get_token(key)
+        if values is not None:
+            token = self.from_values(*values)
+            if token.check_key(key):
+                return token
+
+    def refresh(self, key, active_users_only=False):
+        """
+        Extend the expiry of token `key` if it has not expired yet.
+
+        The expiry is checked and updated by the database, with the same rules
+        as `update_expiry`. On PostgreSQL this is a single
+        `UPDATE ... RETURNING` statement, elsewhere an `UPDATE` then a `SELECT`.
+
+        Return the refreshed token (without its user), or `None` if there is
+        no unexpired token for `key` (belonging to an active user, with
+        `active_users_only`).
+        """
+        now = timezone.now()
+        max_inactivity = now + get_max_inactivity()
+
+        # Not `.db`, which may be a read replica (see `routers.ReplicaRouter`).
+        db = self.for_key(key)._db or router.db_for_write(self.model)
+        if connections[db].vendor == 'postgresql':
+            return self._refresh_returning(
+                key,
+                db,
+                now,
+                max_inactivity,
+                active_users_only,
+            )
+        return self._refresh_update(key, db, now, max_inactivity, active_users_only)
+
+    def _refresh_update(self, key, db, now, max_inactivity, active_users_only):
+        expires = Least(
+            Value(max_inactivity),
+            ExpressionWrapper(
+                F('created') + Value(get_max_age(), output_field=models.DurationField()),
+                output_field=models.DateTimeField(),
+            ),
+        )
+        tokens = self.filter_key(key).filter(expires__gt=now)
+        if active_users_only:
+            tokens = tokens.filter(user__is_active=True)
+        updated = tokens.update(expires=expires)
+        if updated:
+            return self.db_manager(db).get_by_key(key)
+
+    def _refresh_returning(self, key, db, now, max_inactivity, active_users_only):
+        opts = self.model._meta
+        connection = connections[db]
+        quote = connection.ops.quote_name
+        columns = {
+            'table': quote(opts.db_table),
+            'key': quote(opts.get_field('key').column),
+            'user': quote(opts.get_field('user').column),
+            'created': quote(opts.get_field('created').column),
+            'expires': quote(opts.get_field('expires').column),
+            'digest': quote(opts.get_field('digest').column),
+        }
+        sql = (
+            'UPDATE {table} SET {expires} = LEAST(%s, {created} + %s) '
+            'WHERE (({key} = %s AND {digest} IS NULL) '
+            'OR ({key} = %s AND {digest} = %s)) '
+            'AND {expires} > %s '
+        )
+        if active_users_only:
+            user_opts = opts.get_field('user').related_model._meta
+            columns.update({
+                'user_table': quote(user_opts.db_table),
+                'user_pk': quote(user_opts.pk.column),
+                'is_active': quote(user_opts.get_field('is_active').column),
+            })
+            sql += 'AND {user} IN (SELECT {user_pk} FROM {user_table} WHERE {is_active}) '
+        sql += 'RETURNING {key}, {user}, {created}, {expires}, {digest}'
+        sql = sql.format(**columns)
+        params = [
+            max_inactivity,
+            get_max_age(),
+            key,
+            keys.get_prefix(key),
+            keys.hash_key(key),
+            now,
+        ]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+
+        if row is not None:
+            return self.from_values(*row)
+
+
 class AuthToken(models.Model):
     """
     Model for auth tokens with added functionality of controlling
@@ -48,6 +276,11 @@ class AuthToken(models.Model):
 
     It also has FK (not OneToOne relation) to user as the user can have
     many tokens (multiple devices) in order to token expiration to work.
+
+    If `settings.AUTH_TOKEN_HASH_KEYS` is `True`, new tokens are stored as a
+    prefix of their key and a digest (see `user_management.api.keys`), and the
+    key given to the client is only available as `plain_key` when it is created.
+    Look tokens up with `AuthToken.objects.get_by_key` or `filter_key`.
     """
     key = models.CharField(max_length=40, primary_key=True)
     user = models.ForeignKey(
@@ -57,20 +290,146 @@ class AuthToken(models.Model):
     )
     created = models.DateTimeField(default=timezone.now, editable=False)
     expires = models.DateTimeField(default=update_expiry, editable=False)
+    digest = models.BinaryField(max_length=32, null=True, editable=False)
+    last_used = models.DateTimeField(null=True, editable=False)
+
+    objects = AuthTokenManager()
+
+    class Meta:
+        indexes = [
+            # Finding expired tokens (`remove_expired_tokens`).
+            models.Index(fields=['expires'], name='api_authtoken_expires'),
+            # Finding a user's unexpired tokens.
+            models.Index(fields=['user', 'expires'], name='api_authtoken_user_expires'),
+        ]
+
+    # Key given to the client, only known when the token is created.
+    plain_key = None
+    FINGERPRINT_LENGTH = 8
 
     def __str__(self):
         return self.key
 
     def save(self, *args, **kwargs):
         if not self.key:
-            self.key = self.generate_key()
+            self.plain_key = self.generate_key()
+            if getattr(settings, 'AUTH_TOKEN_HASH_KEYS', False):
+                self.key = keys.get_prefix(self.plain_key)
+                self.digest = keys.hash_key(self.plain_key)
+            else:
+                self.key = self.plain_key
+        if routers.get_shards():
+            # Even when created through a manager, which doesn't know the key.
+            kwargs['using'] = routers.shard_for_key(self.key)
         return super(AuthToken, self).save(*args, **kwargs)
 
+    def check_key(self, key):
+        """Check in constant time that `key` is this token's key."""
+        if self.digest is None:
+            return hmac.compare_digest(self.key.encode(), key.encode())
+        return self.key == keys.get_prefix(key) and keys.check_digest(self.digest, key)
+
+    def delete(self, *args, **kwargs):
+        token_cache.delete_tokens([self.key])
+        return super(AuthToken, self).delete(*args, **kwargs)
+
+    @property
+    def fingerprint(self):
+        """Start of the key, enough to tell a user's tokens apart."""
+        return self.key[:self.FINGERPRINT_LENGTH]
+
+    def record_use(self):
+        """
+        Set `last_used` to now, to be written by `last_used_buffer`.
+
+        Does nothing unless `settings.AUTH_TOKEN_LAST_USED_INTERVAL` is set.
+        """
+        if last_used_buffer.enabled:
+            self.last_used = timezone.now()
+            last_used_buffer.add(self)
+
     def generate_key(self):
         return binascii.hexlify(os.urandom(20)).decode()
 
     def update_expiry(self, commit=True):
-        """Update token's expiration datetime on every auth action."""
+        """
+        Update token's expiration datetime on every auth action.
+
+        When committing, nothing is written if the new expiry is within
+        `settings.AUTH_TOKEN_EXPIRY_GRANULARITY` seconds of the current one, and
+        the write is left to `expiry_buffer` if buffering is enabled.
+        """
+        previous = self.expires
         self.expires = update_expiry(self.created)
-        if commit:
+        if not commit:
+            return
+
+        granularity = getattr(
+            settings,
+            'AUTH_TOKEN_EXPIRY_GRANULARITY',
+            DEFAULT_AUTH_TOKEN_EXPIRY_GRANULARITY,
+        )
+        if previous and abs(self.expires - previous).total_seconds() < granularity:
+            self.expires = previous
+            return
+
+        if expiry_buffer.enabled:
+            expiry_buffer.add(self)
+        elif self._state.adding:
             self.save()
+        else:
+            # Only write `expires`, and don't recreate a token deleted meanwhile.
+            tokens = type(self)._default_manager.for_key(self.key).filter(pk=self.pk)
+            tokens.update(expires=self.expires)
+
+
+# Coalesce expiry refreshes into one write per `AUTH_TOKEN_EXPIRY_FLUSH_INTERVAL`.
+expiry_buffer = WriteBuffer(AuthToken, ['expires'], 'AUTH_TOKEN_EXPIRY_FLUSH_INTERVAL')
+last_used_buffer = WriteBuffer(AuthToken, ['last_used'], 'AUTH_TOKEN_LAST_USED_INTERVAL')
+
+
+def user_token_keys(user):
+    """Return the keys (as stored) of `user`'s tokens, on every shard."""
+    tokens = AuthToken.objects.filter(user=user)
+    keys_by_shard = tokens.fan_out(
+        lambda tokens: list(tokens.values_list('key', flat=True)),
+    )
+    return list(itertools.chain(*keys_by_shard))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def evict_inactive_user_tokens(sender, instance, **kwargs):
+    """Stop cached tokens authenticating a deactivated user."""
+    if not instance.is_active and token_cache.is_enabled():
+        token_cache.delete_tokens(user_token_keys(instance))
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def evict_deleted_user_tokens(sender, instance, **kwargs):
+    """
+    Stop cached tokens authenticating a deleted user.
+
+    Sharded tokens aren't deleted by the user's cascade, as it only queries the
+    user's database: delete them from every shard.
+    """
+    if routers.get_shards():
+        AuthToken.objects.filter(user=instance).delete()
+    elif token_cache.is_enabled():
+        token_cache.delete_tokens(user_token_keys(instance))
+
+
+def update_last_login(sender, user, **kwargs):
+    """
+    Set the user's `last_login` to now, like `django.contrib.auth`'s receiver.
+
+    The write is skipped if the stored `last_login` is less than
+    `settings.AUTH_LAST_LOGIN_INTERVAL` seconds old.
+    """
+    now = timezone.now()
+    interval = getattr(settings, 'AUTH_LAST_LOGIN_INTERVAL', None)
+    if interval and user.last_login:
+        if now - user.last_login < datetime.timedelta(seconds=interval):
+            return
+
+    user.last_login = now
+    user.save(update_fields=['last_login'])
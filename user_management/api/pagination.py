@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class SessionPagination(CursorPagination):
+    """
+    Paginate a user's tokens by expiry, latest first.
+
+    Pages start after the last token of the previous page, so they are read from the
+    `(user, expires)` index whatever their position.
+    """
+    ordering = '-expires'
+    page_size = 20
@@ -0,0 +1,127 @@
+"""
+Monthly partitions of the `AuthToken` table on PostgreSQL.
+
+In this opt-in layout (see docs/installation.md) the table is range-partitioned
+by `expires`, one partition per (UTC) month, named after the table and the month
+it starts, e.g. `api_authtoken_p202610`. A partition whose month has passed only
+holds expired tokens, so it can be dropped instead of deleting its rows.
+
+Set `settings.AUTH_TOKEN_PARTITIONED` to `True` once the table is partitioned.
+"""
+import datetime
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from . import routers
+from .models import AuthToken, get_max_age
+
+
+def is_enabled():
+    return getattr(settings, 'AUTH_TOKEN_PARTITIONED', False)
+
+
+def get_connections():
+    """Return the connections to the databases storing tokens (see `routers`)."""
+    return [connections[alias] for alias in routers.get_databases()]
+
+
+def get_table():
+    return AuthToken._meta.db_table
+
+
+def month_start(when):
+    when = when.astimezone(timezone.utc)
+    return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    return month_start(month + datetime.timedelta(days=32))
+
+
+def partition_name(month):
+    return '{}_p{:%Y%m}'.format(get_table(), month)
+
+
+def months_to_cover(now, months_ahead=0):
+    """
+    Return the start of each month in which tokens created from `now` may expire.
+
+    `months_ahead` more months are added, so partitions exist before they're needed.
+    """
+    month = month_start(now)
+    last = month_start(now + get_max_age())
+    for _ in range(months_ahead):
+        last = next_month(last)
+
+    months = []
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def get_partitions(cursor):
+    """Return the existing partitions' names by month."""
+    table = get_table()
+    cursor.execute(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = %s::regclass',
+        [table],
+    )
+    pattern = re.compile(re.escape(table) + r'_p(\d{6})$')
+
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = pattern.match(name)
+        if match:
+            month = datetime.datetime.strptime(match.group(1), '%Y%m')
+            partitions[month.replace(tzinfo=timezone.utc)] = name
+    return partitions
+
+
+def create_partitions(cursor, now, months_ahead=0):
+    """Create the missing partitions of `months_to_cover` and return their names."""
+    quote_name = cursor.db.ops.quote_name
+    existing = get_partitions(cursor)
+
+    created = []
+    for month in months_to_cover(now, months_ahead):
+        if month in existing:
+            continue
+        name = partition_name(month)
+        cursor.execute(
+            'CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+                quote_name(name),
+                quote_name(get_table()),
+            ),
+            # Bounds must be plain literals.
+            [month.isoformat(), next_month(month).isoformat()],
+        )
+        created.append(name)
+    return created
+
+
+def remove_expired_partitions(cursor, now, detach=False):
+    """
+    Drop the partitions of months that ended before `now` and return their names.
+
+    With `detach`, keep them as standalone tables (e.g. to archive them).
+    """
+    quote_name = cursor.db.ops.quote_name
+    table = quote_name(get_table())
+
+    removed = []
+    for month, name in sorted(get_partitions(cursor).items()):
+        if next_month(month) > now:
+            continue
+        if detach:
+            sql = 'ALTER TABLE {} DETACH PARTITION {}'.format(table, quote_name(name))
+        else:
+            sql = 'DROP TABLE {}'.format(quote_name(name))
+        cursor.execute(sql)
+        removed.append(name)
+    return removed
@@ -0,0 +1,221 @@
+"""
+Database routers for auth tokens and users.
+
+Sharding: set `settings.AUTH_TOKEN_SHARDS` to a list of database aliases and add
+`AuthTokenShardRouter` to `settings.DATABASE_ROUTERS`. Each token is stored on
+the shard chosen by a hash of its key's lookup prefix (see
+`user_management.api.keys`), so it is found from its key alone. Queries by user
+are run on every shard.
+
+Read replicas: set `settings.AUTH_READ_REPLICAS` to a list of database aliases
+and add `ReplicaRouter` to `settings.DATABASE_ROUTERS`. Users and tokens are only
+read from replicas inside `read_from_replicas()`, e.g. in views using
+`ReplicaReadsMixin`. After a write, a client's token is pinned to the primary
+database for `settings.AUTH_REPLICA_PIN_SECONDS`, so it reads its own writes.
+Clients using access tokens are pinned by user instead. Unsafe requests always
+read from the primary database.
+"""
+import hashlib
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, router
+from rest_framework.permissions import SAFE_METHODS
+
+from . import keys
+
+
+PIN_KEY_PREFIX = 'user_management:replica_pin:'
+DEFAULT_AUTH_REPLICA_PIN_SECONDS = 10
+
+_state = threading.local()
+
+
+def get_shards():
+    return getattr(settings, 'AUTH_TOKEN_SHARDS', None)
+
+
+def get_databases():
+    """Return the aliases of the databases storing auth tokens."""
+    from .models import AuthToken
+    return get_shards() or [router.db_for_write(AuthToken)]
+
+
+def shard_for_key(key):
+    """Return the alias of the shard storing token `key` (as given or stored)."""
+    shards = get_shards()
+    digest = hashlib.sha256(keys.get_prefix(key).encode()).digest()
+    return shards[int.from_bytes(digest[:8], 'big') % len(shards)]
+
+
+def for_each_shard(func):
+    """
+    Call `func` with each shard's alias in turn, and return the results.
+
+    Shards are queried on this thread's connection to each of them, so a
+    `transaction.atomic()` only covers the queries on its own database.
+    """
+    return [func(alias) for alias in get_shards()]
+
+
+class AuthTokenShardRouter(object):
+    """
+    Route a token to its shard when django knows which token is queried (saving or
+    deleting it, following a relation from it), and only create the token table on
+    shards.
+    """
+    def db_for_read(self, model, **hints):
+        return self.db_for_instance(model, hints.get('instance'), router.db_for_read)
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_instance(model, hints.get('instance'), router.db_for_write)
+
+    def db_for_instance(self, model, instance, route):
+        from .models import AuthToken
+        if not get_shards() or not isinstance(instance, AuthToken):
+            return
+
+        if issubclass(model, AuthToken):
+            if instance.key:
+                return shard_for_key(instance.key)
+            return
+
+        # Related objects (such as the token's user) are not sharded.
+        return route(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        from .models import AuthToken
+        if get_shards() and isinstance(obj1, AuthToken) != isinstance(obj2, AuthToken):
+            return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if get_shards() and app_label == 'api' and model_name == 'authtoken':
+            return db in get_shards()
+
+
+def get_replicas():
+    return getattr(settings, 'AUTH_READ_REPLICAS', None) or []
+
+
+def get_pin_seconds():
+    return getattr(
+        settings,
+        'AUTH_REPLICA_PIN_SECONDS',
+        DEFAULT_AUTH_REPLICA_PIN_SECONDS,
+    )
+
+
+def get_pin_cache():
+    return caches[getattr(settings, 'AUTH_REPLICA_PIN_CACHE', 'default')]
+
+
+def reading_from_replicas():
+    return getattr(_state, 'replicas', None) is True
+
+
+@contextmanager
+def read_from_replicas(enabled=True):
+    """
+    Read users and tokens from replicas (if any) in this thread.
+
+    `read_from_replicas(False)` reads from the primary database, even where a
+    token would be read from replicas (see `read_token_from_replicas`).
+    """
+    previous = getattr(_state, 'replicas', None)
+    _state.replicas = enabled and bool(get_replicas())
+    try:
+        yield
+    finally:
+        _state.replicas = previous
+
+
+@contextmanager
+def primary_for_unsafe(request):
+    """Read from the primary database for unsafe requests, which may save their reads."""
+    if request.method in SAFE_METHODS:
+        yield
+        return
+    with read_from_replicas(False):
+        yield
+
+
+def make_pin_key(key):
+    prefix = keys.get_prefix(key)
+    return PIN_KEY_PREFIX + hashlib.sha256(prefix.encode()).hexdigest()
+
+
+def make_user_pin_key(user_id):
+    return PIN_KEY_PREFIX + 'user:{}'.format(user_id)
+
+
+def set_pin(pin_key):
+    """Read from the primary database for requests pinned by `pin_key` for a while."""
+    if get_replicas():
+        get_pin_cache().set(pin_key, True, get_pin_seconds())
+
+
+def has_pin(pin_key):
+    return get_pin_cache().get(pin_key) is not None
+
+
+def pin(key):
+    """Read from the primary database for requests with token `key` for a while."""
+    set_pin(make_pin_key(key))
+
+
+def is_pinned(key):
+    return has_pin(make_pin_key(key))
+
+
+def pin_user(user_id):
+    """Read from the primary database for requests with access tokens of a user."""
+    set_pin(make_user_pin_key(user_id))
+
+
+def read_token_from_replicas(key):
+    """
+    Read from replicas, unless token `key` is pinned to the primary database.
+
+    Inside `read_from_replicas()`, doesn't check the pin again.
+    """
+    decided = getattr(_state, 'replicas', None)
+    if decided is not None:
+        return read_from_replicas(decided)
+    return read_from_replicas(bool(get_replicas()) and not is_pinned(key))
+
+
+class ReplicaRouter(object):
+    """
+    Read users and tokens from a random replica inside `read_from_replicas()`.
+
+    Instances read from a replica are written to the primary database, and
+    tables aren't created on replicas. Sharded tokens are left to
+    `AuthTokenShardRouter`.
+    """
+    def is_routed(self, model):
+        from .models import AuthToken
+        if issubclass(model, AuthToken):
+            return not get_shards()
+        return issubclass(model, get_user_model())
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replicas() and self.is_routed(model):
+            return random.choice(get_replicas())
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in get_replicas():
+            return router.db_for_write(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if {obj1._state.db, obj2._state.db} <= databases and get_replicas():
+            return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas():
+            return False
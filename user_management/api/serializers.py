@@ -1,8 +1,18 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
-from rest_framework import serializers, validators
-
-from user_management.utils.validators import validate_password_strength
+from rest_framework import exceptions, serializers, validators
+from rest_framework.authtoken import serializers as authtoken_serializers
+
+from user_management.models.mixins import case_insensitive_filter
+from user_management.utils import hashing
+from user_management.utils.validators import (
+    validate_password_length,
+    validate_password_strength,
+)
+from . import routers
+from .authentication import TokenAuthentication
+from .models import AuthToken
 
 
 User = get_user_model()
@@ -11,6 +21,10 @@ User = get_user_model()
 class UniqueEmailValidator(validators.UniqueValidator):
     def filter_queryset(self, value, queryset):
         """Check lower-cased email is unique."""
+        if self.field_name in getattr(queryset.model, 'NORMALIZED_FIELDS', {}):
+            return queryset.filter(
+                **case_insensitive_filter(queryset.model, self.field_name, value)
+            )
         return super(UniqueEmailValidator, self).filter_queryset(
             value.lower(),
             queryset,
@@ -36,6 +50,16 @@ class EmailSerializerBase(serializers.Serializer):
         fields = ('email',)
 
 
+class AuthTokenSerializer(authtoken_serializers.AuthTokenSerializer):
+    """Rest framework's login serializer, rejecting overlong passwords unhashed."""
+    password = serializers.CharField(
+        label=_('Password'),
+        style={'input_type': 'password'},
+        trim_whitespace=False,
+        validators=[validate_password_length],
+    )
+
+
 class RegistrationSerializer(ValidateEmailMixin, serializers.ModelSerializer):
     email = serializers.EmailField(
         label=_('Email address'),
@@ -45,12 +69,13 @@ class RegistrationSerializer(ValidateEmailMixin, serializers.ModelSerializer):
         write_only=True,
         min_length=8,
         label=_('Password'),
-        validators=[validate_password_strength],
+        validators=[validate_password_length, validate_password_strength],
     )
     password2 = serializers.CharField(
         write_only=True,
         min_length=8,
         label=_('Repeat password'),
+        validators=[validate_password_length],
     )
 
     class Meta:
@@ -66,27 +91,47 @@ class RegistrationSerializer(ValidateEmailMixin, serializers.ModelSerializer):
 
     def create(self, validated_data):
         password = validated_data.pop('password')
-        user = self.Meta.model.objects.create(**validated_data)
-        user.set_password(password)
-        user.save()
+        user = self.Meta.model(**validated_data)
+        # Hashed first, so a busy hashing pool doesn't leave a user without password.
+        hashing.set_password(user, password)
+        user.save(force_insert=True)
         return user
 
 
-class PasswordChangeSerializer(serializers.ModelSerializer):
+class RevokeTokensMixin(object):
+    def revoke_tokens(self, user):
+        """
+        Delete `user`'s tokens if `settings.AUTH_TOKEN_REVOKE_ON_PASSWORD_CHANGE`.
+
+        The token authenticating the request, if any, is kept.
+        """
+        if not getattr(settings, 'AUTH_TOKEN_REVOKE_ON_PASSWORD_CHANGE', False):
+            return
+
+        tokens = AuthToken.objects.filter(user=user)
+        current = getattr(self.context.get('request'), 'auth', None)
+        if isinstance(current, AuthToken):
+            tokens = tokens.exclude(pk=current.pk)
+        tokens.delete()
+
+
+class PasswordChangeSerializer(RevokeTokensMixin, serializers.ModelSerializer):
     old_password = serializers.CharField(
         write_only=True,
         label=_('Old password'),
+        validators=[validate_password_length],
     )
     new_password = serializers.CharField(
         write_only=True,
         min_length=8,
         label=_('New password'),
-        validators=[validate_password_strength],
+        validators=[validate_password_length, validate_password_strength],
     )
     new_password2 = serializers.CharField(
         write_only=True,
         min_length=8,
         label=_('Repeat new password'),
+        validators=[validate_password_length],
     )
 
     class Meta:
@@ -95,12 +140,13 @@ class PasswordChangeSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         """Check the old password is valid and set the new password."""
-        if not instance.check_password(validated_data['old_password']):
+        if not hashing.check_password(instance, validated_data['old_password']):
             msg = _('Invalid password.')
             raise serializers.ValidationError({'old_password': msg})
 
-        instance.set_password(validated_data['new_password'])
+        hashing.set_password(instance, validated_data['new_password'])
         instance.save()
+        self.revoke_tokens(instance)
         return instance
 
     def validate(self, attrs):
@@ -113,17 +159,18 @@ class PasswordChangeSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class PasswordResetSerializer(serializers.ModelSerializer):
+class PasswordResetSerializer(RevokeTokensMixin, serializers.ModelSerializer):
     new_password = serializers.CharField(
         write_only=True,
         min_length=8,
         label=_('New password'),
-        validators=[validate_password_strength],
+        validators=[validate_password_length, validate_password_strength],
     )
     new_password2 = serializers.CharField(
         write_only=True,
         min_length=8,
         label=_('Repeat new password'),
+        validators=[validate_password_length],
     )
 
     class Meta:
@@ -132,8 +179,9 @@ class PasswordResetSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         """Set the new password for the user."""
-        instance.set_password(validated_data['new_password'])
+        hashing.set_password(instance, validated_data['new_password'])
         instance.save()
+        self.revoke_tokens(instance)
         return instance
 
     def validate(self, attrs):
@@ -196,3 +244,38 @@ class UserSerializerCreate(ValidateEmailMixin, UserSerializer):
 
     class Meta(UserSerializer.Meta):
         read_only_fields = ('date_joined',)
+
+
+class SessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AuthToken
+        fields = ('fingerprint', 'created', 'expires', 'last_used')
+        read_only_fields = fields
+
+
+class TokenIntrospectionSerializer(serializers.Serializer):
+    tokens = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    """Serializer defining the `token` (an `AuthToken` key) to refresh from."""
+    token = serializers.CharField(label=_('Token'))
+
+    def validate_token(self, key):
+        """
+        Validate the token like `TokenAuthentication`, extending its expiry.
+
+        `validate_token` will set `auth_token` and `user` attributes on the instance.
+        """
+        # Refreshing writes the token: read it from the primary database.
+        auth = TokenAuthentication()
+        with routers.read_from_replicas(False):
+            try:
+                self.user, self.auth_token = auth.authenticate_credentials(key)
+            except exceptions.AuthenticationFailed:
+                raise serializers.ValidationError(_('Invalid or expired token.'))
+        return key
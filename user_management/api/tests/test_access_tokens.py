@@ -0,0 +1,47 @@
+import datetime
+
+import mock
+from django.core import signing
+from django.test import override_settings, TestCase
+from django.utils import timezone
+
+from user_management.models.tests.factories import UserFactory
+from .. import access_tokens
+
+
+class TestAccessTokens(TestCase):
+    def setUp(self):
+        self.user = UserFactory.build(pk=42)
+
+    def test_get_max_age(self):
+        max_age = access_tokens.DEFAULT_AUTH_ACCESS_TOKEN_MAX_AGE
+        expected = datetime.timedelta(seconds=max_age)
+        self.assertEqual(access_tokens.get_max_age(), expected)
+
+    @override_settings(AUTH_ACCESS_TOKEN_MAX_AGE=60)
+    def test_make_access_token(self):
+        before = timezone.now()
+        token, expires = access_tokens.make_access_token(self.user)
+
+        self.assertGreaterEqual(expires, before + datetime.timedelta(seconds=60))
+        self.assertEqual(access_tokens.load_access_token(token), self.user.pk)
+
+    def test_load_access_token_tampered(self):
+        token, expires = access_tokens.make_access_token(self.user)
+
+        with self.assertRaises(signing.BadSignature):
+            access_tokens.load_access_token(token + 'x')
+
+    def test_load_access_token_other_salt(self):
+        token = signing.dumps({'user': self.user.pk, 'expires': 2 ** 40})
+
+        with self.assertRaises(signing.BadSignature):
+            access_tokens.load_access_token(token)
+
+    def test_load_access_token_expired(self):
+        token, expires = access_tokens.make_access_token(self.user)
+        later = expires + datetime.timedelta(seconds=1)
+
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            with self.assertRaises(access_tokens.ExpiredAccessToken):
+                access_tokens.load_access_token(token)
@@ -1,37 +1,140 @@
 import datetime
+import sys
+from unittest import skipIf
 
+import django
 import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.http import QueryDict
-from django.test import TestCase
+from django.test import override_settings, TestCase
 from django.utils import timezone
 from rest_framework import exceptions
 
 from user_management.models.tests.factories import AuthTokenFactory, UserFactory
-from ..authentication import FormTokenAuthentication, TokenAuthentication
+from .. import access_tokens, cache as token_cache
+from ..authentication import (
+    AccessTokenAuthentication,
+    FormTokenAuthentication,
+    LazyUser,
+    TokenAuthentication,
+)
+from ..models import AuthToken, expiry_buffer, last_used_buffer
+
+User = get_user_model()
+
+
+def run_async(func, *args):
+    """Wait for coroutine function `func` from synchronous tests."""
+    from asgiref.sync import async_to_sync
+    return async_to_sync(func)(*args)
+
+
+class TestLazyUser(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.lazy_user = LazyUser(self.user.pk, User.objects.all())
+
+    def test_not_loaded(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lazy_user.pk, self.user.pk)
+            self.assertTrue(self.lazy_user.is_authenticated)
+            self.assertFalse(self.lazy_user.is_anonymous)
+            self.assertTrue(self.lazy_user)
+
+    def test_loaded(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.lazy_user.email, self.user.email)
+            self.assertEqual(self.lazy_user.name, self.user.name)
+
+    def test_deleted(self):
+        self.user.delete()
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'deleted'):
+            self.lazy_user.email
 
 
 class TestFormTokenAuthentication(TestCase):
+    def make_request(self, key):
+        """Return a request posting `key` as the `token` form field."""
+        data = QueryDict('', mutable=True)
+        data.update({'token': key})
+        return mock.Mock(data=data)
+
     def test_no_token(self):
         request = mock.Mock(data=QueryDict(''))
         response = FormTokenAuthentication().authenticate(request)
         self.assertIsNone(response)
 
     def test_invalid_token(self):
-        data = QueryDict('', mutable=True)
-        data.update({'token': 'WOOT'})
-        request = mock.Mock(data=data)
+        request = self.make_request('WOOT')
+        response = FormTokenAuthentication().authenticate(request)
+        self.assertIsNone(response)
+
+    def test_token_not_string(self):
+        """JSON bodies can post other types than strings."""
+        request = mock.Mock(data={'token': 123})
         response = FormTokenAuthentication().authenticate(request)
         self.assertIsNone(response)
 
     def test_valid_token(self):
         token = AuthTokenFactory.create()
-        data = QueryDict('', mutable=True)
-        data.update({'token': token.key})
-        request = mock.Mock(data=data)
+        request = self.make_request(token.key)
         response = FormTokenAuthentication().authenticate(request)
         expected = (token.user, token)
         self.assertEqual(response, expected)
 
+    def test_valid_token_queries(self):
+        """The token and its user are fetched together."""
+        token = AuthTokenFactory.create()
+        request = self.make_request(token.key)
+
+        # Get the token with its user and write its new expiry.
+        with self.assertNumQueries(2):
+            user, authenticated = FormTokenAuthentication().authenticate(request)
+            self.assertEqual(user.email, token.user.email)
+
+        self.assertEqual(authenticated, token)
+
+    def test_expired_token(self):
+        token = AuthTokenFactory.create(expires=timezone.now())
+        request = self.make_request(token.key)
+
+        self.assertIsNone(FormTokenAuthentication().authenticate(request))
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_cached_token(self):
+        token = AuthTokenFactory.create()
+        token_cache.set_token(token)
+        request = self.make_request(token.key)
+
+        # Load the user and write the new expiry.
+        with self.assertNumQueries(2):
+            response = FormTokenAuthentication().authenticate(request)
+
+        self.assertEqual(response, (token.user, token))
+        cache.clear()
+
+    @override_settings(AUTH_TOKEN_LAZY_USER=True)
+    def test_lazy_user(self):
+        token = AuthTokenFactory.create()
+        request = self.make_request(token.key)
+
+        # Get the token and write its new expiry.
+        with self.assertNumQueries(2):
+            user, authenticated = FormTokenAuthentication().authenticate(request)
+            self.assertEqual(user.pk, token.user_id)
+
+        self.assertEqual(authenticated, token)
+
+    @override_settings(AUTH_TOKEN_LAZY_USER=True)
+    def test_lazy_user_inactive(self):
+        token = AuthTokenFactory.create(user__is_active=False)
+        request = self.make_request(token.key)
+
+        self.assertIsNone(FormTokenAuthentication().authenticate(request))
+
 
 class TestTokenAuthentication(TestCase):
     def setUp(self):
@@ -86,3 +189,409 @@ class TestTokenAuthentication(TestCase):
         # User's token has expired now
         with self.assertRaises(exceptions.AuthenticationFailed):
             self.auth.authenticate_credentials(self.key)
+
+    @override_settings(AUTH_TOKEN_EXPIRY_FLUSH_INTERVAL=60)
+    def test_token_expiry_pending_refresh(self):
+        """A refresh that hasn't been written yet keeps the token alive."""
+        yesterday = self.now - datetime.timedelta(days=self.days)
+        token = self._create_token(when=yesterday)
+        tomorrow = self.now + datetime.timedelta(days=self.days)
+
+        with mock.patch.dict(expiry_buffer.pending, {token.pk: {'expires': tomorrow}}):
+            user, token = self.auth.authenticate_credentials(self.key)
+
+        self.assertEqual(user, self.user)
+
+    @override_settings(AUTH_TOKEN_LAST_USED_INTERVAL=300)
+    def test_last_used_flushed(self):
+        """Recorded uses are written together when the buffer is flushed."""
+        token = self._create_token(when=self.now + datetime.timedelta(days=self.days))
+
+        self.auth.authenticate_credentials(self.key)
+        token.refresh_from_db()
+        self.assertIsNone(token.last_used)
+
+        last_used_buffer.flush()
+        token.refresh_from_db()
+        self.assertGreaterEqual(token.last_used, self.now)
+
+    def test_invalid_token(self):
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_inactive_user(self):
+        self._create_token(when=self.now + datetime.timedelta(days=self.days))
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.key)
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True)
+    def test_hashed_key(self):
+        token = AuthToken.objects.create(user=self.user)
+
+        user, authenticated = self.auth.authenticate_credentials(token.plain_key)
+
+        self.assertEqual(authenticated, token)
+        self.assertEqual(user, self.user)
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True)
+    def test_hashed_key_wrong_suffix(self):
+        """A key sharing the stored prefix doesn't match the digest."""
+        token = AuthToken.objects.create(user=self.user)
+        key = token.key + 'x' * (len(token.plain_key) - len(token.key))
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    @skipIf(django.VERSION < (3, 0), 'asgiref is installed with Django 3.0+.')
+    def test_async(self):
+        token_old = self._create_token(when=self.now + datetime.timedelta(days=self.days))
+
+        user, token = run_async(self.auth.aauthenticate_credentials, self.key)
+
+        self.assertEqual(token, token_old)
+        self.assertEqual(user, self.user)
+
+    @skipIf(django.VERSION < (3, 0), 'asgiref is installed with Django 3.0+.')
+    def test_async_invalid_token(self):
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            run_async(self.auth.aauthenticate_credentials, self.key)
+
+    def test_async_without_asgiref(self):
+        """The lookup runs through `sync_to_async`, faked for Django < 3.0."""
+        token_old = self._create_token(when=self.now + datetime.timedelta(days=self.days))
+
+        def sync_to_async(func, thread_sensitive):
+            async def call(*args):
+                return func(*args)
+            return call
+
+        sync = mock.Mock(sync_to_async=mock.Mock(side_effect=sync_to_async))
+        with mock.patch.dict(sys.modules, {'asgiref.sync': sync}):
+            # Nothing is awaited: run the coroutine to completion without a loop.
+            with self.assertRaises(StopIteration) as done:
+                self.auth.aauthenticate_credentials(self.key).send(None)
+        user, token = done.exception.value
+
+        self.assertEqual(token, token_old)
+        self.assertEqual(user, self.user)
+        sync.sync_to_async.assert_called_once_with(
+            self.auth.authenticate_credentials,
+            thread_sensitive=True,
+        )
+
+
+@override_settings(AUTH_TOKEN_LAZY_USER=True)
+class TestTokenAuthenticationLazyUser(TestCase):
+    def setUp(self):
+        self.tomorrow = timezone.now() + datetime.timedelta(days=1)
+        self.key = 'k$y'
+        self.user = UserFactory.create()
+        self.auth = TokenAuthentication()
+
+    def test_valid(self):
+        token = AuthTokenFactory.create(
+            key=self.key,
+            user=self.user,
+            expires=self.tomorrow,
+        )
+
+        # Get the token and write its new expiry.
+        with self.assertNumQueries(2):
+            user, authenticated = self.auth.authenticate_credentials(self.key)
+            self.assertEqual(user.pk, self.user.pk)
+
+        self.assertEqual(authenticated, token)
+        self.assertEqual(user.email, self.user.email)
+        self.assertEqual(user.get_deferred_fields(), {'password'})
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        AuthTokenFactory.create(key=self.key, user=self.user, expires=self.tomorrow)
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Invalid token.'):
+            self.auth.authenticate_credentials(self.key)
+
+    @override_settings(AUTH_TOKEN_SINGLE_QUERY=True)
+    def test_single_query(self):
+        AuthTokenFactory.create(key=self.key, user=self.user, expires=self.tomorrow)
+
+        # Update the expiry, then load the updated token (on PostgreSQL, one query).
+        with self.assertNumQueries(1 if connection.vendor == 'postgresql' else 2):
+            user, token = self.auth.authenticate_credentials(self.key)
+            self.assertEqual(user.pk, self.user.pk)
+
+        self.assertEqual(token.key, self.key)
+
+    @override_settings(AUTH_TOKEN_SINGLE_QUERY=True)
+    def test_single_query_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        AuthTokenFactory.create(key=self.key, user=self.user, expires=self.tomorrow)
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Invalid token.'):
+            self.auth.authenticate_credentials(self.key)
+
+    @override_settings(AUTH_TOKEN_SINGLE_QUERY=True)
+    def test_single_query_expired(self):
+        AuthTokenFactory.create(key=self.key, user=self.user, expires=timezone.now())
+
+        msg = 'Token has expired.'
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, msg):
+            self.auth.authenticate_credentials(self.key)
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_cached_token(self):
+        token = AuthTokenFactory.create(
+            key=self.key,
+            user=self.user,
+            expires=self.tomorrow,
+        )
+        token_cache.set_token(token)
+
+        # Write the new expiry.
+        with self.assertNumQueries(1):
+            user, authenticated = self.auth.authenticate_credentials(self.key)
+            self.assertEqual(user.pk, self.user.pk)
+
+        self.assertEqual(authenticated, token)
+        cache.clear()
+
+
+@override_settings(AUTH_TOKEN_SINGLE_QUERY=True)
+class TestTokenAuthenticationSingleQuery(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.key = 'k$y'
+        self.user = UserFactory.create()
+        self.auth = TokenAuthentication()
+
+    def test_valid(self):
+        tomorrow = self.now + datetime.timedelta(days=1)
+        AuthTokenFactory.create(key=self.key, user=self.user, expires=tomorrow)
+
+        user, token = self.auth.authenticate_credentials(self.key)
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(token.key, self.key)
+        self.assertEqual(token.user, self.user)
+        self.assertEqual(user.get_deferred_fields(), {'password'})
+
+    def test_refreshes_expiry(self):
+        soon = self.now + datetime.timedelta(minutes=1)
+        AuthTokenFactory.create(key=self.key, user=self.user, expires=soon)
+
+        user, token = self.auth.authenticate_credentials(self.key)
+
+        stored = AuthToken.objects.get(key=self.key)
+        self.assertGreater(stored.expires, soon)
+        self.assertEqual(token.expires, stored.expires)
+
+    def test_max_age(self):
+        """The refreshed expiry doesn't go past the token's maximum age."""
+        created = self.now - datetime.timedelta(days=1)
+        soon = self.now + datetime.timedelta(minutes=1)
+        AuthTokenFactory.create(
+            key=self.key,
+            user=self.user,
+            created=created,
+            expires=soon,
+        )
+
+        with self.settings(AUTH_TOKEN_MAX_AGE=24 * 60 * 60 + 60 * 60):
+            user, token = self.auth.authenticate_credentials(self.key)
+
+        expected = created + datetime.timedelta(days=1, hours=1)
+        self.assertEqual(token.expires, expected)
+
+    def test_expired(self):
+        yesterday = self.now - datetime.timedelta(days=1)
+        AuthTokenFactory.create(key=self.key, user=self.user, expires=yesterday)
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'expired'):
+            self.auth.authenticate_credentials(self.key)
+
+        stored = AuthToken.objects.get(key=self.key)
+        self.assertEqual(stored.expires, yesterday)
+
+    def test_invalid(self):
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Invalid'):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_inactive_user(self):
+        user = UserFactory.create(is_active=False)
+        AuthTokenFactory.create(key=self.key, user=user)
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'inactive'):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_deleted_user(self):
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'inactive'):
+            self.auth.get_user(user_id=0)
+
+
+@override_settings(AUTH_TOKEN_CACHE='default')
+class TestTokenAuthenticationCache(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.key = 'k$y'
+        self.user = UserFactory.create()
+        self.auth = TokenAuthentication()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_caches_token(self):
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+
+        self.auth.authenticate_credentials(self.key)
+
+        token.refresh_from_db()
+        expected = (self.key, self.user.pk, token.created, token.expires, None)
+        self.assertEqual(token_cache.get_token(self.key), expected)
+
+    def test_caches_token_single_query(self):
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+
+        with self.settings(AUTH_TOKEN_SINGLE_QUERY=True):
+            self.auth.authenticate_credentials(self.key)
+
+        token.refresh_from_db()
+        expected = (self.key, self.user.pk, token.created, token.expires, None)
+        self.assertEqual(token_cache.get_token(self.key), expected)
+
+    def test_cached_token(self):
+        """Cached tokens are not looked up in the database."""
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+        token_cache.set_token(token)
+
+        # Load the user and write the new expiry.
+        with self.assertNumQueries(2):
+            user, authenticated_token = self.auth.authenticate_credentials(self.key)
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(authenticated_token, token)
+        stored = AuthToken.objects.get(key=self.key)
+        self.assertEqual(stored.expires, authenticated_token.expires)
+        cached = (self.key, self.user.pk, stored.created, stored.expires, None)
+        self.assertEqual(token_cache.get_token(self.key), cached)
+
+    @override_settings(AUTH_TOKEN_LAST_USED_INTERVAL=300)
+    def test_cached_token_last_used(self):
+        """Use of a cached token is recorded without a database write."""
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+        token_cache.set_token(token)
+
+        with mock.patch.dict(last_used_buffer.pending, clear=True):
+            with self.assertNumQueries(2):
+                self.auth.authenticate_credentials(self.key)
+
+            last_used = last_used_buffer.pending[self.key]['last_used']
+
+        self.assertGreaterEqual(last_used, self.now)
+        self.assertIsNone(AuthToken.objects.get().last_used)
+
+    @override_settings(AUTH_TOKEN_EXPIRY_GRANULARITY=60)
+    def test_cached_token_within_granularity(self):
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+        token_cache.set_token(token)
+
+        with self.assertNumQueries(1):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_cached_token_expired(self):
+        yesterday = self.now - datetime.timedelta(days=1)
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+        cache.set(
+            token_cache.make_key(self.key),
+            (self.key, self.user.pk, token.created, yesterday, None),
+        )
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'expired'):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_cached_token_inactive_user(self):
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+        token_cache.set_token(token)
+        type(self.user).objects.filter(pk=self.user.pk).update(is_active=False)
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'inactive'):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_revoked_token(self):
+        token = AuthTokenFactory.create(key=self.key, user=self.user)
+        self.auth.authenticate_credentials(self.key)
+
+        token.delete()
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Invalid'):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_deactivated_user(self):
+        AuthTokenFactory.create(key=self.key, user=self.user)
+        self.auth.authenticate_credentials(self.key)
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(token_cache.get_token(self.key))
+
+
+class TestAccessTokenAuthentication(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.auth = AccessTokenAuthentication()
+
+    def test_valid(self):
+        access_token, expires = access_tokens.make_access_token(self.user)
+
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(access_token)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertTrue(user.is_authenticated)
+
+        self.assertIsInstance(user, LazyUser)
+        self.assertEqual(user.email, self.user.email)
+        self.assertEqual(token, access_token)
+
+    def test_header(self):
+        access_token, expires = access_tokens.make_access_token(self.user)
+        request = mock.Mock(META={'HTTP_AUTHORIZATION': 'Bearer ' + access_token})
+
+        user, token = self.auth.authenticate(request)
+
+        self.assertEqual(user, self.user)
+
+    def test_invalid(self):
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Invalid'):
+            self.auth.authenticate_credentials('not-signed')
+
+    def test_expired(self):
+        access_token, expires = access_tokens.make_access_token(self.user)
+        later = expires + datetime.timedelta(seconds=1)
+
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'expired'):
+                self.auth.authenticate_credentials(access_token)
+
+    def test_inactive_user(self):
+        """Deactivation isn't checked until the access token is refreshed."""
+        access_token, expires = access_tokens.make_access_token(self.user)
+        self.user.is_active = False
+        self.user.save()
+
+        user, token = self.auth.authenticate_credentials(access_token)
+
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_deleted_user(self):
+        access_token, expires = access_tokens.make_access_token(self.user)
+        self.user.delete()
+
+        user, token = self.auth.authenticate_credentials(access_token)
+
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'deleted'):
+            user.email
@@ -0,0 +1,134 @@
+import datetime
+
+import mock
+from django.db import connection
+from django.test import override_settings, TestCase
+from django.utils import timezone
+
+from user_management.models.tests.factories import AuthTokenFactory, UserFactory
+from ..buffers import bulk_update, WriteBuffer
+from ..models import AuthToken
+
+
+INTERVAL_SETTING = 'TEST_WRITE_BUFFER_INTERVAL'
+
+
+class TestBulkUpdate(TestCase):
+    def assertBulkUpdated(self, instances, field):
+        """Only the first two `instances` are saved."""
+        model = type(instances[0])
+        with self.assertNumQueries(1):
+            updated = bulk_update(model.objects.all(), instances[:2], [field])
+
+        self.assertEqual(updated, 2)
+        stored = model.objects.in_bulk([instance.pk for instance in instances])
+        values = [getattr(stored[instance.pk], field) for instance in instances]
+        expected = [getattr(instance, field) for instance in instances]
+        self.assertEqual(values[:2], expected[:2])
+        self.assertNotEqual(values[2], expected[2])
+
+    def test_bulk_update(self):
+        tokens = AuthTokenFactory.create_batch(3)
+        later = timezone.now() + datetime.timedelta(days=1)
+        for hours, token in enumerate(tokens):
+            token.expires = later + datetime.timedelta(hours=hours)
+
+        self.assertBulkUpdated(tokens, 'expires')
+
+    def test_bulk_update_casted(self):
+        """Some databases (e.g. PostgreSQL) need the values cast to the column type."""
+        users = UserFactory.create_batch(3)
+        for user, name in zip(users, ['One', 'Two', 'Three']):
+            user.name = name
+
+        with mock.patch.object(
+            connection.features,
+            'requires_casted_case_in_updates',
+            True,
+            create=True,
+        ):
+            self.assertBulkUpdated(users, 'name')
+
+
+class TestWriteBuffer(TestCase):
+    def setUp(self):
+        self.buffer = WriteBuffer(AuthToken, ['expires'], INTERVAL_SETTING)
+        self.token = AuthTokenFactory.create()
+        self.later = timezone.now() + datetime.timedelta(days=1)
+
+    def test_disabled(self):
+        self.assertFalse(self.buffer.enabled)
+
+    @override_settings(TEST_WRITE_BUFFER_INTERVAL=60)
+    def test_enabled(self):
+        self.assertTrue(self.buffer.enabled)
+
+    @override_settings(TEST_WRITE_BUFFER_INTERVAL=60)
+    def test_add(self):
+        """Values are kept in memory until the interval has passed."""
+        self.token.expires = self.later
+        self.buffer.add(self.token)
+
+        stored = AuthToken.objects.get(pk=self.token.pk)
+        self.assertNotEqual(stored.expires, self.later)
+        self.assertEqual(self.buffer.pending, {self.token.pk: {'expires': self.later}})
+
+    @override_settings(TEST_WRITE_BUFFER_INTERVAL=60)
+    def test_add_flushes(self):
+        """Adding a value after the interval has passed writes all pending values."""
+        other = AuthTokenFactory.create()
+        other.expires = self.later
+        self.buffer.add(other)
+
+        self.token.expires = self.later
+        with mock.patch('time.monotonic', return_value=self.buffer.last_flush + 60):
+            self.buffer.add(self.token)
+
+        self.assertEqual(self.buffer.pending, {})
+        for token in (self.token, other):
+            stored = AuthToken.objects.get(pk=token.pk)
+            self.assertEqual(stored.expires, self.later)
+
+    def test_apply(self):
+        self.buffer.pending = {self.token.pk: {'expires': self.later}}
+        token = AuthToken.objects.get(pk=self.token.pk)
+
+        self.buffer.apply(token)
+
+        self.assertEqual(token.expires, self.later)
+
+    def test_apply_nothing_pending(self):
+        token = AuthToken.objects.get(pk=self.token.pk)
+        expires = token.expires
+
+        self.buffer.apply(token)
+
+        self.assertEqual(token.expires, expires)
+
+    def test_flush_single_query(self):
+        tokens = AuthTokenFactory.create_batch(3)
+        self.buffer.pending = {
+            token.pk: {'expires': self.later}
+            for token in tokens
+        }
+
+        with self.assertNumQueries(1):
+            self.buffer.flush()
+
+        self.assertCountEqual(
+            AuthToken.objects.filter(expires=self.later),
+            tokens,
+        )
+
+    def test_flush_nothing_pending(self):
+        with self.assertNumQueries(0):
+            self.buffer.flush()
+
+    def test_flush_deleted(self):
+        """Rows deleted before a flush are not recreated."""
+        self.buffer.pending = {self.token.pk: {'expires': self.later}}
+        self.token.delete()
+
+        self.buffer.flush()
+
+        self.assertFalse(AuthToken.objects.exists())
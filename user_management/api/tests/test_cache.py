@@ -0,0 +1,208 @@
+import datetime
+import time
+
+import mock
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.test import override_settings, TestCase
+from django.utils import timezone
+
+from user_management.models.tests.factories import AuthTokenFactory
+from .. import cache as token_cache
+
+
+class TestTokenCacheDisabled(TestCase):
+    def test_get_cache(self):
+        self.assertIsNone(token_cache.get_cache())
+
+    def test_get_token(self):
+        self.assertIsNone(token_cache.get_token('key'))
+
+    def test_set_token(self):
+        token = AuthTokenFactory.build()
+        token_cache.set_token(token)
+        self.assertIsNone(cache.get(token_cache.make_key(token.key)))
+
+    def test_delete_tokens(self):
+        cache.set(token_cache.make_key('key'), 'value')
+        token_cache.delete_tokens(['key'])
+        token_cache.delete_tokens([])
+        self.assertEqual(cache.get(token_cache.make_key('key')), 'value')
+        cache.clear()
+
+
+@override_settings(AUTH_TOKEN_CACHE='default')
+class TestTokenCache(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_get_cache(self):
+        self.assertIs(token_cache.get_cache(), caches['default'])
+
+    def test_make_key(self):
+        """Token keys aren't stored in plain text."""
+        key = token_cache.make_key('secret')
+        self.assertTrue(key.startswith(token_cache.KEY_PREFIX))
+        self.assertNotIn('secret', key)
+
+    def test_set_get_token(self):
+        token = AuthTokenFactory.create()
+
+        token_cache.set_token(token)
+
+        expected = (token.key, token.user_id, token.created, token.expires, None)
+        self.assertEqual(token_cache.get_token(token.key), expected)
+
+    def test_get_token_missing(self):
+        self.assertIsNone(token_cache.get_token('key'))
+
+    def test_set_token_expired(self):
+        """Expired tokens are not cached."""
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        token = AuthTokenFactory.create(expires=yesterday)
+
+        token_cache.set_token(token)
+
+        self.assertIsNone(token_cache.get_token(token.key))
+
+    def test_delete_tokens(self):
+        tokens = AuthTokenFactory.create_batch(2)
+        for token in tokens:
+            token_cache.set_token(token)
+
+        token_cache.delete_tokens([tokens[0].key])
+
+        self.assertIsNone(token_cache.get_token(tokens[0].key))
+        self.assertIsNotNone(token_cache.get_token(tokens[1].key))
+
+
+@override_settings(AUTH_TOKEN_LOCAL_CACHE_SIZE=2, AUTH_TOKEN_LOCAL_CACHE_TTL=5)
+class TestLocalCache(TestCase):
+    def setUp(self):
+        self.cache = token_cache.LocalCache()
+
+    def test_enabled(self):
+        self.assertTrue(self.cache.enabled)
+        with self.settings(AUTH_TOKEN_LOCAL_CACHE_SIZE=None):
+            self.assertFalse(self.cache.enabled)
+
+    def test_ttl_default(self):
+        with self.settings():
+            del settings.AUTH_TOKEN_LOCAL_CACHE_TTL
+            expected = token_cache.DEFAULT_AUTH_TOKEN_LOCAL_CACHE_TTL
+            self.assertEqual(self.cache.ttl, expected)
+
+    def test_get_set(self):
+        self.cache.set('key', 'value', 60)
+
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.cache.get('other'), None)
+        expected = {'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+        self.assertEqual(self.cache.stats(), expected)
+
+    def test_timeout(self):
+        self.cache.set('key', 'value', 1)
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 1):
+            self.assertIsNone(self.cache.get('key'))
+
+        expected = {'size': 0, 'hits': 0, 'misses': 1, 'evictions': 0}
+        self.assertEqual(self.cache.stats(), expected)
+
+    def test_ttl(self):
+        """Entries aren't kept longer than `AUTH_TOKEN_LOCAL_CACHE_TTL`."""
+        self.cache.set('key', 'value', 60)
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 5):
+            self.assertIsNone(self.cache.get('key'))
+
+    def test_set_existing(self):
+        """Updating an entry doesn't extend how long it is kept."""
+        self.cache.set('key', 'value', 60)
+        later = time.monotonic() + 3
+
+        with mock.patch('time.monotonic', return_value=later):
+            self.cache.set('key', 'new value', 60)
+
+        with mock.patch('time.monotonic', return_value=later + 2):
+            self.assertIsNone(self.cache.get('key'))
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1, 60)
+        self.cache.set('b', 2, 60)
+        self.cache.get('a')
+
+        self.cache.set('c', 3, 60)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_delete_many(self):
+        self.cache.set('a', 1, 60)
+        self.cache.set('b', 2, 60)
+
+        self.cache.delete_many(['a', 'missing'])
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_clear(self):
+        self.cache.set('a', 1, 60)
+
+        self.cache.clear()
+
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+
+@override_settings(AUTH_TOKEN_LOCAL_CACHE_SIZE=10)
+class TestTokenLocalCache(TestCase):
+    def tearDown(self):
+        token_cache.local_cache.clear()
+        cache.clear()
+
+    def test_is_enabled(self):
+        self.assertTrue(token_cache.is_enabled())
+
+    def test_set_get_token(self):
+        token = AuthTokenFactory.create()
+
+        token_cache.set_token(token)
+
+        expected = (token.key, token.user_id, token.created, token.expires, None)
+        self.assertEqual(token_cache.get_token(token.key), expected)
+        self.assertIsNone(cache.get(token_cache.make_key(token.key)))
+
+    def test_get_token_missing(self):
+        self.assertIsNone(token_cache.get_token('key'))
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_get_token_shared(self):
+        """Tokens found in the shared cache are kept in memory."""
+        token = AuthTokenFactory.create()
+        value = (token.key, token.user_id, token.created, token.expires, None)
+        cache.set(token_cache.make_key(token.key), value)
+
+        self.assertEqual(token_cache.get_token(token.key), value)
+
+        cache.clear()
+        self.assertEqual(token_cache.get_token(token.key), value)
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_set_token_shared(self):
+        token = AuthTokenFactory.create()
+
+        token_cache.set_token(token)
+
+        expected = (token.key, token.user_id, token.created, token.expires, None)
+        self.assertEqual(cache.get(token_cache.make_key(token.key)), expected)
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_delete_tokens(self):
+        token = AuthTokenFactory.create()
+        token_cache.set_token(token)
+
+        token_cache.delete_tokens([token.key])
+
+        self.assertIsNone(token_cache.get_token(token.key))
@@ -1,7 +1,15 @@
 from django.test import TestCase
-from rest_framework.status import HTTP_400_BAD_REQUEST
+from rest_framework.status import (
+    HTTP_400_BAD_REQUEST,
+    HTTP_409_CONFLICT,
+    HTTP_503_SERVICE_UNAVAILABLE,
+)
 
-from ..exceptions import InvalidExpiredToken
+from ..exceptions import (
+    AmbiguousFingerprint,
+    InvalidExpiredToken,
+    PasswordHashingUnavailable,
+)
 
 
 class InvalidExpiredTokenTest(TestCase):
@@ -13,3 +21,21 @@ class InvalidExpiredTokenTest(TestCase):
         self.assertEqual(error.exception.status_code, HTTP_400_BAD_REQUEST)
         message = error.exception.detail.format()
         self.assertEqual(message, 'Invalid or expired token.')
+
+
+class AmbiguousFingerprintTest(TestCase):
+    def test_raise(self):
+        with self.assertRaises(AmbiguousFingerprint) as error:
+            raise AmbiguousFingerprint
+        self.assertEqual(error.exception.status_code, HTTP_409_CONFLICT)
+        message = error.exception.detail.format()
+        self.assertEqual(message, 'More than one session matches this fingerprint.')
+
+
+class PasswordHashingUnavailableTest(TestCase):
+    def test_raise(self):
+        with self.assertRaises(PasswordHashingUnavailable) as error:
+            raise PasswordHashingUnavailable
+        self.assertEqual(error.exception.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+        message = error.exception.detail.format()
+        self.assertEqual(message, 'The service is busy, please try again later.')
@@ -1,13 +1,27 @@
 import datetime
+from io import StringIO
 
+import factory
 import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test.utils import override_settings
 from django.utils import timezone
 
+from user_management.api import cache as token_cache, keys, partitions
 from user_management.api.models import AuthToken
 from user_management.models.tests import utils
-from user_management.models.tests.factories import AuthTokenFactory
-from ..management.commands import remove_expired_tokens
+from user_management.models.tests.factories import AuthTokenFactory, UserFactory
+from user_management.models.tests.models import NormalizedEmailUser
+from ..management.commands import (
+    hash_auth_tokens,
+    manage_token_partitions,
+    normalize_emails,
+    password_hasher_stats,
+    remove_expired_tokens,
+)
 
 
 class TestRemoveExpiredTokensManagementCommand(utils.APIRequestTestCase):
@@ -20,7 +34,7 @@ class TestRemoveExpiredTokensManagementCommand(utils.APIRequestTestCase):
         tomorrow = timezone.now() + datetime.timedelta(days=1)
         token = AuthTokenFactory.create(expires=tomorrow)
 
-        self.command.handle()
+        call_command(self.command)
 
         expected = AuthToken.objects.all()
         self.assertCountEqual(expected, [token])
@@ -36,7 +50,281 @@ class TestRemoveExpiredTokensManagementCommand(utils.APIRequestTestCase):
         long_ago = now - datetime.timedelta(days=33)
         AuthTokenFactory.create(expires=long_ago)
 
-        self.command.handle()
+        call_command(self.command)
         expected = AuthToken.objects.all()
 
         self.assertCountEqual(expected, [valid_token])
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_expired_tokens_evicted(self):
+        """Removed tokens are also removed from the token cache."""
+        long_ago = timezone.now() - datetime.timedelta(days=33)
+        token = AuthTokenFactory.create(expires=long_ago)
+        cache.set(token_cache.make_key(token.key), 'cached')
+
+        call_command(self.command)
+
+        self.assertIsNone(token_cache.get_token(token.key))
+
+    def test_batches(self):
+        """Expired tokens are removed in batches, skipping valid ones."""
+        now = timezone.now()
+        long_ago = now - datetime.timedelta(days=33)
+        tomorrow = now + datetime.timedelta(days=1)
+        AuthTokenFactory.create_batch(5, expires=long_ago)
+        valid_tokens = AuthTokenFactory.create_batch(2, expires=tomorrow)
+
+        with mock.patch('time.sleep') as sleep:
+            call_command(self.command, batch_size=2, sleep=0.5)
+
+        self.assertCountEqual(AuthToken.objects.all(), valid_tokens)
+        self.assertEqual(sleep.call_count, 2)
+        sleep.assert_called_with(0.5)
+        self.command.stdout.write.assert_any_call('Removed 4 expired tokens.')
+        self.command.stdout.write.assert_called_with('Done: removed 5 expired tokens.')
+
+    def test_batch_queries(self):
+        long_ago = timezone.now() - datetime.timedelta(days=33)
+        AuthTokenFactory.create_batch(3, expires=long_ago)
+
+        # Select and delete the full batch, then find no more tokens
+        with self.assertNumQueries(3):
+            call_command(self.command, batch_size=3)
+
+        self.assertFalse(AuthToken.objects.exists())
+
+    def test_max_runtime(self):
+        long_ago = timezone.now() - datetime.timedelta(days=33)
+        AuthTokenFactory.create_batch(3, expires=long_ago)
+
+        call_command(self.command, batch_size=2, max_runtime=0)
+
+        self.assertEqual(AuthToken.objects.count(), 1)
+        self.command.stdout.write.assert_any_call('Stopped after reaching --max-runtime.')
+
+    @override_settings(AUTH_TOKEN_PARTITIONED=True)
+    def test_partitioned(self):
+        """Expired partitions are dropped before deleting remaining tokens."""
+        long_ago = timezone.now() - datetime.timedelta(days=33)
+        AuthTokenFactory.create(expires=long_ago)
+
+        with mock.patch.object(partitions, 'remove_expired_partitions') as remove:
+            remove.return_value = ['api_authtoken_p202609']
+            call_command(self.command)
+
+        self.assertFalse(AuthToken.objects.exists())
+        self.command.stdout.write.assert_any_call('Dropped api_authtoken_p202609.')
+
+    def test_dry_run(self):
+        long_ago = timezone.now() - datetime.timedelta(days=33)
+        tokens = AuthTokenFactory.create_batch(2, expires=long_ago)
+
+        call_command(self.command, dry_run=True)
+
+        self.assertCountEqual(AuthToken.objects.all(), tokens)
+        self.command.stdout.write.assert_called_once_with(
+            'Would remove 2 expired tokens.',
+        )
+
+
+class TestHashAuthTokensManagementCommand(utils.APIRequestTestCase):
+    def setUp(self):
+        self.command = hash_auth_tokens.Command()
+        self.command.stdout = mock.MagicMock()
+
+    def test_hash_tokens(self):
+        plain_tokens = AuthTokenFactory.create_batch(3, key=factory.LazyFunction(
+            lambda: AuthToken().generate_key(),
+        ))
+        plain_keys = [token.key for token in plain_tokens]
+
+        stdout = StringIO()
+
+        call_command('hash_auth_tokens', batch_size=2, stdout=stdout)
+
+        self.assertFalse(AuthToken.objects.filter(digest__isnull=True).exists())
+        for key in plain_keys:
+            token = AuthToken.objects.get_by_key(key)
+            self.assertEqual(token.key, keys.get_prefix(key))
+        self.assertIn('Converted 3 tokens.', stdout.getvalue())
+
+    def test_keeps_last_used(self):
+        last_used = timezone.now() - datetime.timedelta(hours=1)
+        token = AuthTokenFactory.create(
+            key=AuthToken().generate_key(),
+            last_used=last_used,
+        )
+
+        self.command.handle(batch_size=10)
+
+        self.assertEqual(AuthToken.objects.get_by_key(token.key).last_used, last_used)
+
+    def test_revoked_tokens_not_converted(self):
+        """Tokens deleted after the batch was read are not stored again."""
+        tokens = AuthTokenFactory.create_batch(2, key=factory.LazyFunction(
+            lambda: AuthToken().generate_key(),
+        ))
+        revoked, kept = tokens
+        AuthToken.objects.filter(pk=revoked.pk).delete()
+
+        self.assertEqual(self.command.convert('default', tokens), 1)
+
+        self.assertEqual(AuthToken.objects.get().key, keys.get_prefix(kept.key))
+        with self.assertRaises(AuthToken.DoesNotExist):
+            AuthToken.objects.get_by_key(revoked.key)
+
+    def test_keeps_current_expiry(self):
+        """Tokens refreshed after the batch was read keep their new expiry."""
+        token = AuthTokenFactory.create(key=AuthToken().generate_key())
+        expires = token.expires + datetime.timedelta(hours=1)
+        AuthToken.objects.filter(pk=token.pk).update(expires=expires)
+
+        self.command.convert('default', [token])
+
+        self.assertEqual(AuthToken.objects.get_by_key(token.key).expires, expires)
+
+    def test_evicts_cached_tokens(self):
+        token = AuthTokenFactory.create(key=AuthToken().generate_key())
+
+        with mock.patch.object(token_cache, 'delete_tokens') as delete_tokens:
+            self.command.handle(batch_size=10)
+
+        delete_tokens.assert_called_once_with([token.key])
+
+    def test_short_keys_skipped(self):
+        token = AuthTokenFactory.create(key='short')
+
+        self.command.handle(batch_size=10)
+
+        self.assertEqual(AuthToken.objects.get(), token)
+
+    def test_hashed_tokens_skipped(self):
+        with self.settings(AUTH_TOKEN_HASH_KEYS=True):
+            token = AuthToken.objects.create(user=UserFactory.create())
+
+        with self.assertNumQueries(1):
+            self.command.handle(batch_size=10)
+
+        self.assertEqual(AuthToken.objects.get(), token)
+
+
+class TestManageTokenPartitionsManagementCommand(utils.APIRequestTestCase):
+    def setUp(self):
+        self.command = manage_token_partitions.Command()
+        self.command.stdout = mock.MagicMock()
+
+    def test_requires_postgresql(self):
+        with mock.patch.object(connection, 'vendor', 'sqlite'):
+            with self.assertRaises(CommandError):
+                call_command(self.command)
+
+    def test_manage_partitions(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch.object(connection, 'cursor') as cursor, \
+                mock.patch.object(partitions, 'create_partitions') as create, \
+                mock.patch.object(partitions, 'remove_expired_partitions') as remove:
+            create.return_value = ['api_authtoken_p202612']
+            remove.return_value = ['api_authtoken_p202609']
+
+            call_command(self.command, months_ahead=2, detach=True)
+
+        cursor = cursor.return_value.__enter__.return_value
+        create.assert_called_once_with(cursor, mock.ANY, 2)
+        remove.assert_called_once_with(cursor, mock.ANY, detach=True)
+        self.command.stdout.write.assert_any_call('Created api_authtoken_p202612.')
+        self.command.stdout.write.assert_any_call('Detached api_authtoken_p202609.')
+
+
+@override_settings(AUTH_USER_MODEL='tests.NormalizedEmailUser')
+class TestNormalizeEmailsManagementCommand(utils.APIRequestTestCase):
+    def setUp(self):
+        self.command = normalize_emails.Command()
+        self.command.stdout = mock.MagicMock()
+        self.command.stderr = mock.MagicMock()
+
+    def create_users(self, *emails):
+        """Create users saved before their email was normalized."""
+        users = []
+        for email in emails:
+            users.append(NormalizedEmailUser.objects.create(email=email, name='Test'))
+            NormalizedEmailUser.objects.update(email_normalized=None)
+        return users
+
+    def test_normalize(self):
+        self.create_users('One@example.com', 'TWO@example.com', 'three@example.com')
+
+        with mock.patch('time.sleep') as sleep:
+            call_command(self.command, batch_size=2, sleep=0.5)
+
+        normalized = NormalizedEmailUser.objects.order_by('pk').values_list(
+            'email_normalized',
+            flat=True,
+        )
+        self.assertEqual(
+            list(normalized),
+            ['one@example.com', 'two@example.com', 'three@example.com'],
+        )
+        sleep.assert_called_once_with(0.5)
+        self.command.stdout.write.assert_any_call('Normalized 2 emails.')
+        self.command.stdout.write.assert_any_call('Normalized 3 emails.')
+
+    def test_normalized_users_skipped(self):
+        NormalizedEmailUser.objects.create(email='One@example.com', name='Test')
+
+        with self.assertNumQueries(1):
+            call_command(self.command)
+
+        self.command.stdout.write.assert_not_called()
+
+    def test_duplicate_emails(self):
+        first, duplicate = self.create_users('one@example.com', 'ONE@example.com')
+
+        call_command(self.command)
+
+        first.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertEqual(first.email_normalized, 'one@example.com')
+        self.assertIsNone(duplicate.email_normalized)
+        self.command.stderr.write.assert_called_once_with(
+            'Duplicate email for user {}: ONE@example.com'.format(duplicate.pk),
+        )
+        self.command.stdout.write.assert_called_once_with('Normalized 1 emails.')
+
+    @override_settings(AUTH_USER_MODEL='tests.User')
+    def test_requires_normalized_email(self):
+        with self.assertRaises(CommandError):
+            call_command(self.command)
+
+
+class TestPasswordHasherStatsManagementCommand(utils.APIRequestTestCase):
+    def setUp(self):
+        self.command = password_hasher_stats.Command()
+        self.command.stdout = mock.MagicMock()
+
+    def test_stats(self):
+        UserFactory.create_batch(2, password='Password1')
+        UserFactory.create()  # Unusable password
+        sha1 = 'django.contrib.auth.hashers.SHA1PasswordHasher'
+        md5 = 'django.contrib.auth.hashers.MD5PasswordHasher'
+
+        with self.settings(PASSWORD_HASHERS=(sha1, md5)):
+            UserFactory.create(password='Password1')
+            with mock.patch('time.sleep') as sleep:
+                call_command(self.command, batch_size=3, sleep=0.5)
+
+        sleep.assert_called_once_with(0.5)
+        self.assertEqual(self.command.stdout.write.call_args_list, [
+            mock.call('Read 3 users.'),
+            mock.call('Read 4 users.'),
+            mock.call('md5: 2 users, 2 to rehash.'),
+            mock.call('unusable: 1 users, 0 to rehash.'),
+            mock.call('sha1: 1 users, 0 to rehash.'),
+            mock.call('Total: 4 users, 2 to rehash.'),
+        ])
+
+    def test_no_users(self):
+        call_command(self.command)
+
+        self.command.stdout.write.assert_called_once_with(
+            'Total: 0 users, 0 to rehash.',
+        )
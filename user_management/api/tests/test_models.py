@@ -1,5 +1,18 @@
+import datetime
+from unittest import skipIf
+
+import django
+import mock
+from django.contrib.auth import models as auth_models
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
 from user_management.models.tests import factories, utils
-from ..models import AuthToken
+from .. import cache as token_cache, keys
+from ..models import AuthToken, expiry_buffer, last_used_buffer, update_last_login
 
 
 class TestAuthToken(utils.APIRequestTestCase):
@@ -15,6 +28,8 @@ class TestAuthToken(utils.APIRequestTestCase):
             'created',
 
             'expires',
+            'digest',
+            'last_used',
         )
 
         self.assertCountEqual(fields, expected)
@@ -31,3 +46,386 @@ class TestAuthToken(utils.APIRequestTestCase):
         expected_tokens = self.model.objects.filter(user=user)
 
         self.assertCountEqual(tokens, expected_tokens)
+
+    def test_update_expiry(self):
+        token = factories.AuthTokenFactory.create(expires=timezone.now())
+
+        token.update_expiry()
+
+        stored = self.model.objects.get(pk=token.pk)
+        self.assertEqual(stored.expires, token.expires)
+
+    def test_update_expiry_no_commit(self):
+        now = timezone.now()
+        token = factories.AuthTokenFactory.create(expires=now)
+
+        with self.assertNumQueries(0):
+            token.update_expiry(commit=False)
+
+        self.assertGreater(token.expires, now)
+
+    @override_settings(AUTH_TOKEN_EXPIRY_GRANULARITY=60)
+    def test_update_expiry_within_granularity(self):
+        """No write happens when the expiry would barely move."""
+        token = factories.AuthTokenFactory.create()
+        expires = token.expires
+
+        with self.assertNumQueries(0):
+            token.update_expiry()
+
+        self.assertEqual(token.expires, expires)
+
+    @override_settings(AUTH_TOKEN_EXPIRY_GRANULARITY=60)
+    def test_update_expiry_beyond_granularity(self):
+        expires = timezone.now() - datetime.timedelta(minutes=5)
+        token = factories.AuthTokenFactory.create(expires=expires)
+
+        with self.assertNumQueries(1):
+            token.update_expiry()
+
+        self.assertGreater(token.expires, expires)
+
+    @override_settings(AUTH_TOKEN_EXPIRY_FLUSH_INTERVAL=60)
+    def test_update_expiry_buffered(self):
+        expires = timezone.now()
+        token = factories.AuthTokenFactory.create(expires=expires)
+
+        with mock.patch.object(expiry_buffer, 'add') as add:
+            with self.assertNumQueries(0):
+                token.update_expiry()
+
+        add.assert_called_once_with(token)
+
+    def test_record_use_disabled(self):
+        token = factories.AuthTokenFactory.create()
+
+        with mock.patch.object(last_used_buffer, 'add') as add:
+            token.record_use()
+
+        self.assertIsNone(token.last_used)
+        add.assert_not_called()
+
+    @override_settings(AUTH_TOKEN_LAST_USED_INTERVAL=300)
+    def test_record_use(self):
+        token = factories.AuthTokenFactory.create()
+
+        with mock.patch.object(last_used_buffer, 'add') as add:
+            with self.assertNumQueries(0):
+                token.record_use()
+
+        self.assertIsNotNone(token.last_used)
+        add.assert_called_once_with(token)
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_get_cached(self):
+        token = factories.AuthTokenFactory.create()
+        token_cache.set_token(token)
+
+        with self.assertNumQueries(0):
+            cached = self.model.objects.get_cached(token.key)
+
+        self.assertEqual(cached, token)
+        self.assertEqual(cached.user_id, token.user_id)
+        self.assertEqual(cached.created, token.created)
+        self.assertEqual(cached.expires, token.expires)
+        self.assertFalse(cached._state.adding)
+        cache.clear()
+
+    def test_get_cached_disabled(self):
+        token = factories.AuthTokenFactory.create()
+        self.assertIsNone(self.model.objects.get_cached(token.key))
+
+    def test_update_expiry_deleted(self):
+        """A token deleted in the meantime is not recreated."""
+        token = factories.AuthTokenFactory.create()
+        self.model.objects.filter(pk=token.pk).delete()
+
+        token.update_expiry()
+
+        self.assertFalse(self.model.objects.exists())
+
+    def test_update_expiry_unsaved(self):
+        user = factories.UserFactory.create()
+        token = factories.AuthTokenFactory.build(user=user)
+
+        token.update_expiry()
+
+        self.assertEqual(self.model.objects.get(), token)
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_delete(self):
+        token = factories.AuthTokenFactory.create()
+        key = token.key
+        token_cache.set_token(token)
+
+        token.delete()
+
+        self.assertIsNone(token_cache.get_token(key))
+
+    def test_save_plain_key(self):
+        token = self.model.objects.create(user=factories.UserFactory.create())
+
+        self.assertEqual(token.key, token.plain_key)
+        self.assertIsNone(token.digest)
+        self.assertTrue(token.check_key(token.plain_key))
+        self.assertFalse(token.check_key(token.plain_key[:-1]))
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True)
+    def test_save_hashed_key(self):
+        token = self.model.objects.create(user=factories.UserFactory.create())
+
+        self.assertEqual(token.key, keys.get_prefix(token.plain_key))
+        self.assertEqual(bytes(token.digest), keys.hash_key(token.plain_key))
+        self.assertTrue(token.check_key(token.plain_key))
+        self.assertFalse(token.check_key(token.key))
+
+        stored = self.model.objects.get_by_key(token.plain_key)
+        self.assertEqual(stored, token)
+        self.assertTrue(self.model.objects.filter_key(token.plain_key).exists())
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True)
+    def test_get_by_key_hashed_wrong_key(self):
+        token = self.model.objects.create(user=factories.UserFactory.create())
+        key = token.key + 'x' * (len(token.plain_key) - len(token.key))
+
+        with self.assertRaises(self.model.DoesNotExist):
+            self.model.objects.get_by_key(key)
+        self.assertFalse(self.model.objects.filter_key(key).exists())
+        with self.assertRaises(self.model.DoesNotExist):
+            self.model.objects.get_by_key(token.key)
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True, AUTH_TOKEN_CACHE='default')
+    def test_get_cached_hashed_wrong_key(self):
+        token = self.model.objects.create(user=factories.UserFactory.create())
+        token_cache.set_token(token)
+        key = token.key + 'x' * (len(token.plain_key) - len(token.key))
+
+        self.assertEqual(self.model.objects.get_cached(token.plain_key), token)
+        self.assertIsNone(self.model.objects.get_cached(key))
+        cache.clear()
+
+
+class TestAuthTokenQuerySet(utils.APIRequestTestCase):
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_delete(self):
+        tokens = factories.AuthTokenFactory.create_batch(2)
+        for token in tokens:
+            token_cache.set_token(token)
+
+        AuthToken.objects.all().delete()
+
+        self.assertFalse(AuthToken.objects.exists())
+        for token in tokens:
+            self.assertIsNone(token_cache.get_token(token.key))
+
+    def test_delete_cache_disabled(self):
+        factories.AuthTokenFactory.create_batch(2)
+
+        with self.assertNumQueries(1):
+            AuthToken.objects.all().delete()
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True)
+    def test_get_by_keys(self):
+        user = factories.UserFactory.create()
+        hashed = AuthToken.objects.create(user=user)
+        plain = factories.AuthTokenFactory.create()
+
+        with self.assertNumQueries(1):
+            tokens = AuthToken.objects.get_by_keys(
+                [hashed.plain_key, plain.key, 'unknown'],
+            )
+
+        self.assertEqual(tokens, {hashed.plain_key: hashed, plain.key: plain})
+
+    def test_trim_user_tokens(self):
+        now = timezone.now()
+        user = factories.UserFactory.create()
+        expired = factories.AuthTokenFactory.create(user=user, expires=now)
+        oldest, older, newest = [
+            factories.AuthTokenFactory.create(
+                user=user,
+                expires=now + datetime.timedelta(hours=hours),
+            )
+            for hours in (1, 2, 3)
+        ]
+        other = factories.AuthTokenFactory.create(expires=now)
+
+        AuthToken.objects.trim_user_tokens(user.pk, 2)
+
+        self.assertCountEqual(AuthToken.objects.all(), [older, newest, other])
+        removed = AuthToken.objects.filter(pk__in=[expired.pk, oldest.pk])
+        self.assertFalse(removed.exists())
+
+
+class TestAuthTokenManagerRefresh(utils.APIRequestTestCase):
+    """Both ways of refreshing a token, whichever database runs the tests."""
+    def setUp(self):
+        self.now = timezone.now()
+        self.max_inactivity = self.now + datetime.timedelta(days=1)
+        self.token = factories.AuthTokenFactory.create(
+            expires=self.now + datetime.timedelta(minutes=1),
+        )
+
+    def test_refresh_postgresql(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch.object(AuthToken.objects, '_refresh_returning') as refresh:
+            token = AuthToken.objects.refresh(self.token.key, active_users_only=True)
+
+        self.assertEqual(token, refresh.return_value)
+        args = refresh.call_args[0]
+        self.assertEqual(args[:2], (self.token.key, 'default'))
+        self.assertIs(args[4], True)
+
+    def test_refresh_update(self):
+        token = AuthToken.objects._refresh_update(
+            self.token.key,
+            'default',
+            self.now,
+            self.max_inactivity,
+            True,
+        )
+
+        self.assertEqual(token, self.token)
+        self.assertEqual(token.expires, self.max_inactivity)
+        self.token.refresh_from_db()
+        self.assertEqual(self.token.expires, self.max_inactivity)
+
+    def test_refresh_update_expired(self):
+        later = self.now + datetime.timedelta(hours=1)
+        token = AuthToken.objects._refresh_update(
+            self.token.key,
+            'default',
+            later,
+            later + datetime.timedelta(days=1),
+            False,
+        )
+
+        self.assertIsNone(token)
+
+    def refresh_returning(self, row, active_users_only=False):
+        with mock.patch.object(connection, 'cursor') as get_cursor:
+            cursor = get_cursor.return_value.__enter__.return_value
+            cursor.fetchone.return_value = row
+            token = AuthToken.objects._refresh_returning(
+                self.token.key,
+                'default',
+                self.now,
+                self.max_inactivity,
+                active_users_only,
+            )
+        sql, params = cursor.execute.call_args[0]
+        return token, sql, params
+
+    def test_refresh_returning(self):
+        token = self.token
+        row = (token.key, token.user_id, token.created, self.max_inactivity, None)
+
+        refreshed, sql, params = self.refresh_returning(row)
+
+        self.assertEqual(refreshed, token)
+        self.assertEqual(refreshed.expires, self.max_inactivity)
+        self.assertTrue(sql.startswith('UPDATE '))
+        self.assertIn(' RETURNING ', sql)
+        self.assertNotIn('is_active', sql)
+        self.assertEqual(params[0], self.max_inactivity)
+        self.assertEqual(params[2], token.key)
+        self.assertEqual(params[-1], self.now)
+
+    def test_refresh_returning_active_users_only(self):
+        refreshed, sql, params = self.refresh_returning(None, active_users_only=True)
+
+        self.assertIsNone(refreshed)
+        self.assertIn('is_active', sql)
+
+
+@skipIf(django.VERSION < (2, 1), 'QuerySet.explain() requires Django 2.1+.')
+class TestAuthTokenIndexes(utils.APIRequestTestCase):
+    """Check the query plans of common token queries use the model's indexes."""
+    def setUp(self):
+        factories.AuthTokenFactory.create_batch(10)
+        if connection.vendor == 'postgresql':
+            # Tables this small would otherwise be scanned sequentially
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(index, queryset.explain())
+
+    def test_expired(self):
+        tokens = AuthToken.objects.filter(expires__lte=timezone.now())
+        self.assertUsesIndex(tokens, 'api_authtoken_expires')
+
+    def test_user_unexpired(self):
+        user = factories.UserFactory.create()
+        tokens = AuthToken.objects.filter(user=user, expires__gt=timezone.now())
+        self.assertUsesIndex(tokens, 'api_authtoken_user_expires')
+
+
+@override_settings(AUTH_TOKEN_CACHE='default')
+class TestUserTokenEviction(utils.APIRequestTestCase):
+    def setUp(self):
+        self.token = factories.AuthTokenFactory.create()
+        token_cache.set_token(self.token)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_user_deactivated(self):
+        user = self.token.user
+        user.is_active = False
+        user.save()
+
+        self.assertIsNone(token_cache.get_token(self.token.key))
+
+    def test_user_saved(self):
+        self.token.user.save()
+
+        self.assertIsNotNone(token_cache.get_token(self.token.key))
+
+    def test_user_deleted(self):
+        self.token.user.delete()
+
+        self.assertIsNone(token_cache.get_token(self.token.key))
+
+    def test_cache_disabled(self):
+        user = self.token.user
+        user.is_active = False
+        with self.settings(AUTH_TOKEN_CACHE=None):
+            with self.assertNumQueries(1):
+                user.save()
+
+
+class TestUpdateLastLogin(utils.APIRequestTestCase):
+    def test_receiver(self):
+        """The receiver replaces django's one."""
+        receivers = user_logged_in._live_receivers(sender=None)
+        self.assertIn(update_last_login, receivers)
+        self.assertNotIn(auth_models.update_last_login, receivers)
+
+    def test_update(self):
+        user = factories.UserFactory.create()
+
+        update_last_login(None, user)
+
+        user.refresh_from_db()
+        self.assertIsNotNone(user.last_login)
+
+    @override_settings(AUTH_LAST_LOGIN_INTERVAL=60)
+    def test_within_interval(self):
+        last_login = timezone.now() - datetime.timedelta(seconds=30)
+        user = factories.UserFactory.create(last_login=last_login)
+
+        with self.assertNumQueries(0):
+            update_last_login(None, user)
+
+        self.assertEqual(user.last_login, last_login)
+
+    @override_settings(AUTH_LAST_LOGIN_INTERVAL=60)
+    def test_beyond_interval(self):
+        last_login = timezone.now() - datetime.timedelta(seconds=90)
+        user = factories.UserFactory.create(last_login=last_login)
+
+        update_last_login(None, user)
+
+        user.refresh_from_db()
+        self.assertGreater(user.last_login, last_login)
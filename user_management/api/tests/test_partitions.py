@@ -0,0 +1,209 @@
+import datetime
+from unittest import skipUnless
+
+import mock
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings, SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from user_management.models.tests.factories import AuthTokenFactory, UserFactory
+from .. import partitions, views
+from ..authentication import TokenAuthentication
+from ..models import AuthToken
+
+
+def make_cursor(names=()):
+    cursor = mock.MagicMock()
+    cursor.db.ops.quote_name = connection.ops.quote_name
+    cursor.fetchall.return_value = [(name,) for name in names]
+    return cursor
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=timezone.utc)
+
+
+class TestPartitions(SimpleTestCase):
+    def test_is_enabled(self):
+        self.assertFalse(partitions.is_enabled())
+        with self.settings(AUTH_TOKEN_PARTITIONED=True):
+            self.assertTrue(partitions.is_enabled())
+
+    def test_month_start(self):
+        offset = datetime.timezone(datetime.timedelta(hours=2))
+        when = datetime.datetime(2026, 11, 1, 1, 30, tzinfo=offset)
+        self.assertEqual(partitions.month_start(when), utc(2026, 10, 1))
+
+    def test_next_month(self):
+        self.assertEqual(partitions.next_month(utc(2026, 12, 1)), utc(2027, 1, 1))
+
+    def test_partition_name(self):
+        name = partitions.partition_name(utc(2026, 3, 1))
+        self.assertEqual(name, 'api_authtoken_p202603')
+
+    @override_settings(AUTH_TOKEN_MAX_AGE=60 * 24 * 60 * 60)
+    def test_months_to_cover(self):
+        months = partitions.months_to_cover(utc(2026, 10, 18))
+
+        self.assertEqual(months, [utc(2026, 10, 1), utc(2026, 11, 1), utc(2026, 12, 1)])
+
+    @override_settings(AUTH_TOKEN_MAX_AGE=0)
+    def test_months_to_cover_ahead(self):
+        months = partitions.months_to_cover(utc(2026, 10, 18), months_ahead=1)
+
+        self.assertEqual(months, [utc(2026, 10, 1), utc(2026, 11, 1)])
+
+    def test_get_partitions(self):
+        cursor = make_cursor(['api_authtoken_p202610', 'api_authtoken_archive'])
+
+        result = partitions.get_partitions(cursor)
+
+        self.assertEqual(result, {utc(2026, 10, 1): 'api_authtoken_p202610'})
+        self.assertEqual(cursor.execute.call_args[0][1], ['api_authtoken'])
+
+    @override_settings(AUTH_TOKEN_MAX_AGE=0)
+    def test_create_partitions(self):
+        cursor = make_cursor(['api_authtoken_p202610'])
+
+        created = partitions.create_partitions(cursor, utc(2026, 10, 18), 1)
+
+        self.assertEqual(created, ['api_authtoken_p202611'])
+        cursor.execute.assert_called_with(
+            'CREATE TABLE "api_authtoken_p202611" PARTITION OF "api_authtoken" '
+            'FOR VALUES FROM (%s) TO (%s)',
+            ['2026-11-01T00:00:00+00:00', '2026-12-01T00:00:00+00:00'],
+        )
+
+    def test_remove_expired_partitions(self):
+        cursor = make_cursor([
+            'api_authtoken_p202609',
+            'api_authtoken_p202608',
+            'api_authtoken_p202610',
+        ])
+
+        removed = partitions.remove_expired_partitions(cursor, utc(2026, 10, 1))
+
+        self.assertEqual(removed, ['api_authtoken_p202608', 'api_authtoken_p202609'])
+        cursor.execute.assert_called_with('DROP TABLE "api_authtoken_p202609"')
+
+    def test_detach_expired_partitions(self):
+        cursor = make_cursor(['api_authtoken_p202609'])
+
+        removed = partitions.remove_expired_partitions(
+            cursor,
+            utc(2026, 10, 18),
+            detach=True,
+        )
+
+        self.assertEqual(removed, ['api_authtoken_p202609'])
+        cursor.execute.assert_called_with(
+            'ALTER TABLE "api_authtoken" DETACH PARTITION "api_authtoken_p202609"',
+        )
+
+
+# The migration documented in docs/installation.md.
+PARTITION_TABLE = """
+    ALTER TABLE api_authtoken RENAME TO api_authtoken_old;
+    ALTER INDEX api_authtoken_pkey RENAME TO api_authtoken_old_pkey;
+    ALTER INDEX api_authtoken_expires RENAME TO api_authtoken_old_expires;
+    ALTER INDEX api_authtoken_user_expires RENAME TO api_authtoken_old_user_expires;
+    CREATE TABLE api_authtoken (LIKE api_authtoken_old INCLUDING DEFAULTS)
+        PARTITION BY RANGE (expires);
+    ALTER TABLE api_authtoken ADD PRIMARY KEY (key, expires);
+    ALTER TABLE api_authtoken ADD FOREIGN KEY (user_id) REFERENCES {users} ({user_pk})
+        DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX api_authtoken_expires ON api_authtoken (expires);
+    CREATE INDEX api_authtoken_user_expires ON api_authtoken (user_id, expires);
+    DROP TABLE api_authtoken_old;
+"""
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+@override_settings(AUTH_TOKEN_PARTITIONED=True)
+class TestPartitionedTable(TestCase):
+    """Tokens work on top of the partitioned table, keyed by `(key, expires)`."""
+    factory = APIRequestFactory()
+
+    def setUp(self):
+        if connection.pg_version < 110000:
+            self.skipTest('Partitioning the table requires PostgreSQL 11+.')
+
+        self.now = timezone.now()
+        users = get_user_model()._meta
+        with connection.cursor() as cursor:
+            cursor.execute(PARTITION_TABLE.format(
+                users=connection.ops.quote_name(users.db_table),
+                user_pk=connection.ops.quote_name(users.pk.column),
+            ))
+            past = self.now - datetime.timedelta(days=62)
+            partitions.create_partitions(cursor, past)
+            partitions.create_partitions(cursor, self.now, months_ahead=1)
+
+    def remove_expired_partitions(self, **kwargs):
+        with connection.cursor() as cursor:
+            # Partitions with pending foreign key checks can't be dropped.
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            return partitions.remove_expired_partitions(cursor, self.now, **kwargs)
+
+    def get_partitions(self):
+        with connection.cursor() as cursor:
+            return partitions.get_partitions(cursor)
+
+    def authenticate(self, key):
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Token ' + key)
+        view = views.ProfileDetail.as_view(authentication_classes=[TokenAuthentication])
+        return view(request)
+
+    def test_create_partitions(self):
+        current = partitions.month_start(self.now)
+        existing = self.get_partitions()
+
+        self.assertEqual(existing[current], partitions.partition_name(current))
+        months = partitions.months_to_cover(self.now, months_ahead=1)
+        self.assertLessEqual(set(months), set(existing))
+
+    def test_login_and_authenticate(self):
+        user = UserFactory.create(password='myepicstrongpassword')
+        request = self.factory.post('/', {
+            'username': user.email,
+            'password': 'myepicstrongpassword',
+        })
+        response = views.GetAuthToken.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+        key = response.data['token']
+
+        response = self.authenticate(key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+        # Twice: refreshing the expiry may move the token to another partition.
+        response = self.authenticate(key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+
+        self.assertEqual(AuthToken.objects.get_by_key(key).user, user)
+
+    def test_remove_expired_partitions(self):
+        expired = AuthTokenFactory.create(expires=self.now - datetime.timedelta(days=40))
+        token = AuthTokenFactory.create()
+        expired_month = partitions.month_start(expired.expires)
+
+        removed = self.remove_expired_partitions()
+
+        self.assertIn(partitions.partition_name(expired_month), removed)
+        self.assertNotIn(expired_month, self.get_partitions())
+        self.assertFalse(AuthToken.objects.filter(pk=expired.pk).exists())
+        response = self.authenticate(token.key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+
+    def test_detach_expired_partitions(self):
+        expired = AuthTokenFactory.create(expires=self.now - datetime.timedelta(days=40))
+        name = partitions.partition_name(partitions.month_start(expired.expires))
+
+        removed = self.remove_expired_partitions(detach=True)
+
+        self.assertIn(name, removed)
+        self.assertFalse(AuthToken.objects.filter(pk=expired.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT key FROM {}'.format(connection.ops.quote_name(name)))
+            self.assertEqual(cursor.fetchall(), [(expired.key,)])
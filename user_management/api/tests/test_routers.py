@@ -0,0 +1,436 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings, SimpleTestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from user_management.models.tests.factories import AuthTokenFactory, UserFactory
+from .. import access_tokens, keys, routers, views
+from ..authentication import AccessTokenAuthentication, TokenAuthentication
+from ..models import AuthToken
+
+
+SHARDS = ['default', 'tokens_1']
+
+
+class TestShardForKey(SimpleTestCase):
+    @override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+    def test_shard_for_key(self):
+        """Keys are spread over the shards."""
+        shards = {routers.shard_for_key(AuthToken().generate_key()) for _ in range(50)}
+
+        self.assertEqual(shards, set(SHARDS))
+
+    @override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+    def test_shard_for_prefix(self):
+        """A key and its stored prefix are on the same shard."""
+        key = AuthToken().generate_key()
+
+        shard = routers.shard_for_key(key)
+
+        self.assertEqual(routers.shard_for_key(keys.get_prefix(key)), shard)
+
+    def test_get_databases(self):
+        self.assertEqual(routers.get_databases(), ['default'])
+        with self.settings(AUTH_TOKEN_SHARDS=SHARDS):
+            self.assertEqual(routers.get_databases(), SHARDS)
+
+
+class TestAuthTokenShardRouter(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.AuthTokenShardRouter()
+        self.token = AuthTokenFactory.build(key=AuthToken().generate_key())
+
+    def test_not_sharded(self):
+        self.assertIsNone(self.router.db_for_write(AuthToken, instance=self.token))
+        self.assertIsNone(self.router.allow_migrate('tokens_1', 'api', 'authtoken'))
+
+    @override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+    def test_db_for_token(self):
+        shard = routers.shard_for_key(self.token.key)
+
+        self.assertEqual(self.router.db_for_read(AuthToken, instance=self.token), shard)
+        self.assertEqual(self.router.db_for_write(AuthToken, instance=self.token), shard)
+
+    @override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+    def test_db_for_token_without_key(self):
+        self.token.key = ''
+
+        self.assertIsNone(self.router.db_for_write(AuthToken, instance=self.token))
+
+    @override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+    def test_db_for_token_user(self):
+        """A token's user isn't looked up on the token's shard."""
+        User = get_user_model()
+
+        self.assertEqual(self.router.db_for_read(User, instance=self.token), 'default')
+
+    @override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+    def test_allow_relation(self):
+        user = self.token.user
+
+        self.assertTrue(self.router.allow_relation(self.token, user))
+        self.assertIsNone(self.router.allow_relation(user, user))
+
+    @override_settings(AUTH_TOKEN_SHARDS=['tokens_1'])
+    def test_allow_migrate(self):
+        self.assertFalse(self.router.allow_migrate('default', 'api', 'authtoken'))
+        self.assertTrue(self.router.allow_migrate('tokens_1', 'api', 'authtoken'))
+        self.assertIsNone(self.router.allow_migrate('tokens_1', 'tests', 'user'))
+
+
+@override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+class TestShardedAuthTokens(TransactionTestCase):
+    databases = set(SHARDS)
+    # Before Django 2.2, which reads `databases`.
+    multi_db = True
+
+    def setUp(self):
+        self.user = self.create_user()
+
+    def create_user(self):
+        """
+        Create a user, copied to the other shard to satisfy its foreign key
+        constraint in tests.
+        """
+        user = UserFactory.create()
+        get_user_model().objects.get(pk=user.pk).save(using='tokens_1', force_insert=True)
+        return user
+
+    def create_token(self, shard, **kwargs):
+        """Create a token of `self.user` stored on `shard`."""
+        key = AuthToken().generate_key()
+        while routers.shard_for_key(key) != shard:
+            key = AuthToken().generate_key()
+        kwargs.setdefault('user', self.user)
+        return AuthToken.objects.create(key=key, **kwargs)
+
+    def assertStoredOn(self, shard, token):
+        self.assertTrue(AuthToken.objects.using(shard).filter(pk=token.pk).exists())
+
+    def test_create(self):
+        token = AuthToken.objects.create(user=self.user)
+
+        shard = routers.shard_for_key(token.key)
+        self.assertStoredOn(shard, token)
+        other, = set(SHARDS) - {shard}
+        self.assertFalse(AuthToken.objects.using(other).exists())
+
+    def test_get_by_key(self):
+        token = self.create_token('tokens_1')
+
+        self.assertEqual(AuthToken.objects.get_by_key(token.key), token)
+
+    def test_get_by_keys(self):
+        tokens = [self.create_token(shard) for shard in SHARDS]
+
+        found = AuthToken.objects.get_by_keys([token.key for token in tokens])
+
+        self.assertEqual(found, {token.key: token for token in tokens})
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True)
+    def test_authenticate(self):
+        token = AuthToken.objects.create(user=self.user)
+
+        user, auth = TokenAuthentication().authenticate_credentials(token.plain_key)
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(auth, token)
+        self.assertStoredOn(routers.shard_for_key(token.plain_key), auth)
+
+    @override_settings(AUTH_TOKEN_LAZY_USER=True)
+    def test_lazy_user_unsupported(self):
+        self.assertFalse(TokenAuthentication().lazy_user)
+
+    def test_update_expiry(self):
+        token = self.create_token('tokens_1')
+        token.expires = timezone.now() - datetime.timedelta(hours=1)
+
+        token.update_expiry()
+
+        stored = AuthToken.objects.using('tokens_1').get(pk=token.pk)
+        self.assertEqual(stored.expires, token.expires)
+
+    def test_delete(self):
+        """Filtered tokens are deleted from every shard."""
+        for shard in SHARDS:
+            self.create_token(shard)
+
+        deleted, _ = AuthToken.objects.filter(user=self.user).delete()
+
+        self.assertEqual(deleted, 2)
+        for shard in SHARDS:
+            self.assertFalse(AuthToken.objects.using(shard).exists())
+
+    def test_trim_user_tokens(self):
+        now = timezone.now()
+        old = self.create_token('default', expires=now + datetime.timedelta(hours=1))
+        new = self.create_token('tokens_1', expires=now + datetime.timedelta(hours=2))
+
+        AuthToken.objects.trim_user_tokens(self.user.pk, 1)
+
+        self.assertFalse(AuthToken.objects.using('default').filter(pk=old.pk).exists())
+        self.assertStoredOn('tokens_1', new)
+
+    def test_user_delete(self):
+        """Deleting a user deletes their tokens on every shard."""
+        for shard in SHARDS:
+            self.create_token(shard)
+
+        self.user.delete()
+
+        for shard in SHARDS:
+            self.assertFalse(AuthToken.objects.using(shard).exists())
+
+    def test_remove_expired_tokens(self):
+        long_ago = timezone.now() - datetime.timedelta(days=33)
+        for shard in SHARDS:
+            self.create_token(shard, expires=long_ago)
+        token = self.create_token('tokens_1')
+        stdout = StringIO()
+
+        call_command('remove_expired_tokens', stdout=stdout)
+
+        self.assertIn('Done: removed 2 expired tokens.', stdout.getvalue())
+        self.assertEqual(list(AuthToken.objects.using('tokens_1')), [token])
+        self.assertFalse(AuthToken.objects.using('default').exists())
+
+
+@override_settings(AUTH_READ_REPLICAS=['replica'])
+class TestReplicaRouter(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.User = get_user_model()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_db_for_read(self):
+        """Users and tokens are only read from replicas when asked to."""
+        self.assertIsNone(self.router.db_for_read(self.User))
+
+        with routers.read_from_replicas():
+            self.assertEqual(self.router.db_for_read(self.User), 'replica')
+            self.assertEqual(self.router.db_for_read(AuthToken), 'replica')
+            self.assertIsNone(self.router.db_for_read(ContentType))
+
+        self.assertIsNone(self.router.db_for_read(self.User))
+
+    @override_settings(AUTH_READ_REPLICAS=None)
+    def test_db_for_read_without_replicas(self):
+        with routers.read_from_replicas():
+            self.assertIsNone(self.router.db_for_read(self.User))
+
+    @override_settings(AUTH_TOKEN_SHARDS=SHARDS)
+    def test_db_for_read_sharded(self):
+        with routers.read_from_replicas():
+            self.assertIsNone(self.router.db_for_read(AuthToken))
+
+    def test_db_for_write(self):
+        """Instances read from a replica are written to the primary database."""
+        user = UserFactory.build()
+        self.assertIsNone(self.router.db_for_write(self.User, instance=user))
+
+        user._state.db = 'replica'
+        self.assertEqual(self.router.db_for_write(self.User, instance=user), 'default')
+
+    def test_allow_relation(self):
+        token = AuthTokenFactory.build()
+        token._state.db = 'default'
+        token.user._state.db = 'replica'
+
+        self.assertTrue(self.router.allow_relation(token, token.user))
+
+        token._state.db = 'other'
+        self.assertIsNone(self.router.allow_relation(token, token.user))
+
+    def test_allow_migrate(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'tests'))
+        self.assertIsNone(self.router.allow_migrate('default', 'tests'))
+
+    def test_pin(self):
+        key = AuthToken().generate_key()
+        self.assertFalse(routers.is_pinned(key))
+
+        routers.pin(key)
+
+        self.assertTrue(routers.is_pinned(key))
+        self.assertTrue(routers.is_pinned(keys.get_prefix(key)))
+
+    @override_settings(AUTH_READ_REPLICAS=None)
+    def test_pin_without_replicas(self):
+        key = AuthToken().generate_key()
+
+        routers.pin(key)
+
+        self.assertFalse(routers.is_pinned(key))
+
+    def test_read_token_from_replicas(self):
+        key = AuthToken().generate_key()
+        with routers.read_token_from_replicas(key):
+            self.assertTrue(routers.reading_from_replicas())
+
+        routers.pin(key)
+        with routers.read_token_from_replicas(key):
+            self.assertFalse(routers.reading_from_replicas())
+
+    def test_read_token_from_primary(self):
+        """`read_from_replicas(False)` reads unpinned tokens from the primary."""
+        key = AuthToken().generate_key()
+        with routers.read_from_replicas(False):
+            with routers.read_token_from_replicas(key):
+                self.assertFalse(routers.reading_from_replicas())
+
+    def test_pin_user(self):
+        pin_key = routers.make_user_pin_key(42)
+        self.assertFalse(routers.has_pin(pin_key))
+
+        routers.pin_user(42)
+
+        self.assertTrue(routers.has_pin(pin_key))
+        self.assertFalse(routers.has_pin(routers.make_user_pin_key(43)))
+
+
+@override_settings(AUTH_READ_REPLICAS=['tokens_1'])
+class TestReplicaReads(TransactionTestCase):
+    """
+    `tokens_1` stands in for a replica, which hasn't caught up unless objects are
+    copied with `replicate`.
+    """
+    databases = {'default', 'tokens_1'}
+    # Before Django 2.2, which reads `databases`.
+    multi_db = True
+    factory = APIRequestFactory()
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.token = AuthTokenFactory.create(user=self.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    def replicate(self, *objs):
+        for obj in objs:
+            copy = type(obj).objects.get(pk=obj.pk)
+            copy.save(using='tokens_1', force_insert=True)
+
+    def request(self, view_class, method, key, **kwargs):
+        request = getattr(self.factory, method)(
+            '/',
+            format='json',
+            HTTP_AUTHORIZATION='Token ' + key,
+            **kwargs
+        )
+        view = view_class.as_view(authentication_classes=[TokenAuthentication])
+        return view(request)
+
+    def test_get(self):
+        """Tokens are looked up on replicas."""
+        response = self.request(views.ProfileDetail, 'get', self.token.key)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_get_pinned(self):
+        routers.pin(self.token.key)
+
+        response = self.request(views.ProfileDetail, 'get', self.token.key)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login(self):
+        """A new token is found before replicas catch up."""
+        user = UserFactory.create(password='myepicstrongpassword')
+        request = self.factory.post('/', {
+            'username': user.email,
+            'password': 'myepicstrongpassword',
+        })
+        response = views.GetAuthToken.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+
+        response = self.request(views.ProfileDetail, 'get', response.data['token'])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_read_your_writes(self):
+        """Writes read the token and user from the primary database."""
+        response = self.request(
+            views.ProfileDetail,
+            'patch',
+            self.token.key,
+            data={'name': 'New Name'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+        self.assertEqual(get_user_model().objects.get().name, 'New Name')
+
+        response = self.request(views.ProfileDetail, 'get', self.token.key)
+
+        self.assertEqual(response.data['name'], 'New Name')
+
+    def test_unsafe_without_mixin(self):
+        """Unsafe requests look tokens up on the primary database in any view."""
+        response = self.request(views.RevokeAuthTokens, 'delete', self.token.key)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_read_your_writes_access_token(self):
+        """Clients using access tokens are pinned by user."""
+        self.replicate(self.user)
+        access_token, _ = access_tokens.make_access_token(self.user)
+
+        def request(method, **kwargs):
+            request = getattr(self.factory, method)(
+                '/',
+                format='json',
+                HTTP_AUTHORIZATION='Bearer ' + access_token,
+                **kwargs
+            )
+            view = views.ProfileDetail.as_view(
+                authentication_classes=[AccessTokenAuthentication],
+            )
+            return view(request)
+
+        response = request('patch', data={'name': 'New Name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+
+        response = request('get')
+
+        self.assertEqual(response.data['name'], 'New Name')
+
+    def test_invalid_access_token(self):
+        """Clients with invalid access tokens aren't pinned."""
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer invalid')
+
+        self.assertIsNone(views.ProfileDetail().get_pin_key(request))
+
+    def test_refresh(self):
+        """Refreshing a token's expiry only uses the primary database."""
+        self.replicate(self.user, self.token)
+
+        with routers.read_from_replicas():
+            token = AuthToken.objects.refresh(self.token.key)
+
+        self.assertEqual(token._state.db, 'default')
+        stored = AuthToken.objects.get(pk=self.token.pk)
+        self.assertEqual(token.expires, stored.expires)
+        self.assertNotEqual(token.expires, self.token.expires)
+
+    @override_settings(AUTH_REPLICA_PIN_SECONDS=0)
+    def test_read_replica(self):
+        """Once the pin has expired, reads may be stale."""
+        self.replicate(self.user, self.token)
+        self.request(
+            views.ProfileDetail,
+            'patch',
+            self.token.key,
+            data={'name': 'New Name'},
+        )
+
+        response = self.request(views.ProfileDetail, 'get', self.token.key)
+
+        self.assertEqual(response.data['name'], self.user.name)
@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 import string
 
-from django.test import TestCase
+import mock
+from django.test import override_settings, TestCase
 from rest_framework.fields import Field
 from rest_framework.reverse import reverse
 from rest_framework.serializers import ValidationError
 
-from user_management.models.tests.factories import UserFactory
+from user_management.models.tests.factories import AuthTokenFactory, UserFactory
+from user_management.models.tests.models import NormalizedEmailUser
 from user_management.models.tests.utils import RequestTestCase
 from user_management.tests.utils import iso_8601
 from .. import serializers
+from ..models import AuthToken
 
 
 class ProfileSerializerTest(TestCase):
@@ -50,6 +53,29 @@ class PasswordChangeSerializerTest(TestCase):
         serializer.save()
         self.assertTrue(user.check_password(new_password))
 
+    @override_settings(AUTH_TOKEN_REVOKE_ON_PASSWORD_CHANGE=True)
+    def test_revoke_other_tokens(self):
+        """Changing the password deletes the user's other tokens."""
+        old_password = '0ld_passworD'
+        new_password = 'n3w_Password'
+        user = UserFactory.create(password=old_password)
+        current, other = AuthTokenFactory.create_batch(2, user=user)
+        other_user_token = AuthTokenFactory.create()
+
+        serializer = serializers.PasswordChangeSerializer(
+            user,
+            data={
+                'old_password': old_password,
+                'new_password': new_password,
+                'new_password2': new_password,
+            },
+            context={'request': mock.Mock(auth=current)},
+        )
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        self.assertCountEqual(AuthToken.objects.all(), [current, other_user_token])
+
     def test_deserialize_invalid_old_password(self):
         old_password = '0ld_passworD'
         new_password = 'n3w_Password'
@@ -123,6 +149,34 @@ class PasswordResetSerializerTest(TestCase):
         serializer.save()
         self.assertTrue(user.check_password(new_password))
 
+    def test_tokens_kept(self):
+        new_password = 'n3w_Password'
+        token = AuthTokenFactory.create()
+
+        serializer = serializers.PasswordResetSerializer(token.user, data={
+            'new_password': new_password,
+            'new_password2': new_password,
+        })
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        self.assertEqual(AuthToken.objects.get(), token)
+
+    @override_settings(AUTH_TOKEN_REVOKE_ON_PASSWORD_CHANGE=True)
+    def test_revoke_tokens(self):
+        """Resetting the password deletes all the user's tokens."""
+        new_password = 'n3w_Password'
+        token = AuthTokenFactory.create()
+
+        serializer = serializers.PasswordResetSerializer(token.user, data={
+            'new_password': new_password,
+            'new_password2': new_password,
+        })
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        self.assertFalse(AuthToken.objects.exists())
+
     def test_deserialize_invalid_new_password(self):
         new_password = '2Short'
         user = UserFactory.build()
@@ -186,6 +240,20 @@ class RegistrationSerializerTest(TestCase):
         self.assertIn('email', serializer.errors)
 
 
+class UniqueEmailValidatorTest(TestCase):
+    def test_normalized_email(self):
+        """Emails are matched on the normalized column when the model has one."""
+        NormalizedEmailUser.objects.create(email='Bobby.Tables@xkcd.com', name='Bobby')
+        validator = serializers.UniqueEmailValidator(
+            queryset=NormalizedEmailUser.objects.all(),
+        )
+        validator.field_name = 'email'
+        validator.instance = None
+
+        with self.assertRaises(ValidationError):
+            validator('bobby.tables@XKCD.com')
+
+
 class UserSerializerTest(RequestTestCase):
     def test_serialize(self):
         user = UserFactory.create()
@@ -357,6 +425,44 @@ class SerializerPasswordsTest(TestCase):
             data = {field: 'AAAaaa11'}
             self.assert_no_validation_error(serializer_class, field, data)
 
+    @override_settings(AUTH_PASSWORD_MAX_LENGTH=10)
+    def test_too_long(self):
+        """All password fields, hashed or compared, are limited in length."""
+        fields = self.serializers + (
+            (serializers.PasswordResetSerializer, 'new_password2'),
+            (serializers.PasswordChangeSerializer, 'old_password'),
+            (serializers.PasswordChangeSerializer, 'new_password2'),
+            (serializers.RegistrationSerializer, 'password2'),
+            (serializers.AuthTokenSerializer, 'password'),
+        )
+        for serializer_class, field in fields:
+            data = {field: 'AAAaaa11bbb'}
+            msg = 'Password must have at most 10 characters.'
+            self.assert_validation_error(serializer_class, field, data, msg)
+
+
+class AuthTokenSerializerTest(TestCase):
+    @override_settings(AUTH_PASSWORD_MAX_LENGTH=10)
+    def test_too_long_not_hashed(self):
+        user = UserFactory.create(password='Sup3RSecre7paSSw0rD')
+        data = {'username': user.email, 'password': 'Sup3RSecre7paSSw0rD'}
+
+        with mock.patch('user_management.utils.hashing.check_password') as check:
+            serializer = serializers.AuthTokenSerializer(data=data)
+            self.assertFalse(serializer.is_valid())
+
+        self.assertIn('password', serializer.errors)
+        check.assert_not_called()
+
+    def test_deserialize(self):
+        user = UserFactory.create(password='Sup3RSecre7paSSw0rD')
+        data = {'username': user.email, 'password': 'Sup3RSecre7paSSw0rD'}
+
+        serializer = serializers.AuthTokenSerializer(data=data)
+
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['user'], user)
+
 
 class ResendConfirmationEmailSerializerTest(TestCase):
     def test_serialize(self):
@@ -12,6 +12,24 @@ class TestURLs(URLTestCase):
             expected_url='/auth',
             url_name='user_management_api_core:auth')
 
+    def test_auth_refresh_url(self):
+        self.assert_url_matches_view(
+            view=views.RefreshAccessToken,
+            expected_url='/auth/refresh',
+            url_name='user_management_api_core:auth_refresh')
+
+    def test_auth_all_url(self):
+        self.assert_url_matches_view(
+            view=views.RevokeAuthTokens,
+            expected_url='/auth/all',
+            url_name='user_management_api_core:auth_all')
+
+    def test_auth_introspect_url(self):
+        self.assert_url_matches_view(
+            view=views.IntrospectTokens,
+            expected_url='/auth/introspect',
+            url_name='user_management_api_core:auth_introspect')
+
     def test_password_reset_confirm_url(self):
         self.assert_url_matches_view(
             view=views.PasswordReset,
@@ -37,6 +55,19 @@ class TestURLs(URLTestCase):
             expected_url='/profile/password',
             url_name='user_management_api_core:password_change')
 
+    def test_session_list_url(self):
+        self.assert_url_matches_view(
+            view=views.SessionList,
+            expected_url='/profile/sessions',
+            url_name='user_management_api_core:session_list')
+
+    def test_session_detail_url(self):
+        self.assert_url_matches_view(
+            view=views.SessionDetail,
+            expected_url='/profile/sessions/0123abcd',
+            url_name='user_management_api_core:session_detail',
+            url_kwargs={'fingerprint': '0123abcd'})
+
     def test_register_url(self):
         self.assert_url_matches_view(
             view=views.UserRegister,
@@ -8,21 +8,24 @@ from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.models import Site
 from django.core import mail
 from django.core.cache import cache
+from django.db import connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 from rest_framework import status
 from rest_framework.test import APIRequestFactory
 
-from user_management.api import models, views
+from user_management.api import access_tokens, cache as token_cache, models, views
 from user_management.api.tests.test_throttling import THROTTLE_RATE_PATH
 from user_management.models.tests.factories import AuthTokenFactory, UserFactory
 from user_management.models.tests.models import BasicUser
 from user_management.models.tests.utils import APIRequestTestCase
 from user_management.tests.utils import iso_8601
+from user_management.utils import hashing
 
 User = get_user_model()
 TEST_SERVER = 'http://testserver'
@@ -59,6 +62,72 @@ class GetAuthTokenTest(APIRequestTestCase):
         token = self.model.objects.get()
         self.assertEqual(response.data['token'], token.key)
 
+    @override_settings(AUTH_PASSWORD_MAX_LENGTH=10)
+    def test_post_password_too_long(self):
+        """Overlong passwords are rejected without being checked."""
+        UserFactory.create(email=self.username, password=self.password)
+
+        request = self.create_request('post', auth=False, data=self.data)
+        with patch.object(hashing, 'check_password') as check_password:
+            response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.data)
+        check_password.assert_not_called()
+        self.assertFalse(self.model.objects.exists())
+
+    @override_settings(AUTH_PASSWORD_HASHING_MAX_CONCURRENT=1)
+    def test_post_hashing_unavailable(self):
+        UserFactory.create(email=self.username, password=self.password)
+        slots = hashing.admission.get_slots()
+        slots.acquire()
+
+        request = self.create_request('post', auth=False, data=self.data)
+        response = self.view_class.as_view()(request)
+        slots.release()
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(self.model.objects.exists())
+
+    @override_settings(AUTH_TOKEN_HASH_KEYS=True)
+    def test_post_hashed_key(self):
+        """The whole key is returned but only its prefix is stored."""
+        user = UserFactory.create(email=self.username, password=self.password)
+
+        request = self.create_request('post', auth=False, data=self.data)
+        response = self.view_class.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        token = self.model.objects.get()
+        self.assertNotEqual(response.data['token'], token.key)
+        self.assertTrue(response.data['token'].startswith(token.key))
+
+        request = self.create_request(
+            'delete',
+            user=user,
+            HTTP_AUTHORIZATION='Token ' + response.data['token'],
+        )
+        response = self.view_class.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(self.model.objects.exists())
+
+    @override_settings(AUTH_TOKEN_MAX_PER_USER=2)
+    def test_post_max_tokens(self):
+        """Logging in evicts the least recently refreshed tokens."""
+        user = UserFactory.create(email=self.username, password=self.password)
+        soon = timezone.now() + datetime.timedelta(hours=1)
+        old_token = AuthTokenFactory.create(user=user, expires=soon)
+        AuthTokenFactory.create(user=user, expires=soon + datetime.timedelta(hours=1))
+
+        request = self.create_request('post', auth=False, data=self.data)
+        response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tokens = self.model.objects.filter(user=user)
+        self.assertEqual(tokens.count(), 2)
+        self.assertFalse(tokens.filter(pk=old_token.pk).exists())
+        self.assertTrue(tokens.filter(pk=response.data['token']).exists())
+
     def test_post_last_login_updates(self):
         """Authenticating updates the user's last_login."""
         user = UserFactory.create(
@@ -73,6 +142,28 @@ class GetAuthTokenTest(APIRequestTestCase):
         self.assertGreater(user.last_login, now)
         self.assertNotEqual(user.last_login, previous_last_login)
 
+    @override_settings(AUTH_LAST_LOGIN_INTERVAL=60)
+    def test_post_writes(self):
+        """Logging in again within the interval only writes the new token."""
+        UserFactory.create(
+            email=self.username,
+            password=self.password,
+            last_login=timezone.now(),
+        )
+        request = self.create_request('post', auth=False, data=self.data)
+        view = self.view_class.as_view()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [
+            query['sql'] for query in queries
+            if query['sql'].startswith(('INSERT', 'UPDATE'))
+        ]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('INSERT'))
+
     def test_post_non_existing_user(self):
         """Assert non existing raises an error."""
         request = self.create_request('post', auth=False, data=self.data)
@@ -201,6 +292,308 @@ class GetAuthTokenTest(APIRequestTestCase):
 
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    @override_settings(AUTH_ACCESS_TOKENS=True)
+    def test_post_access_token(self):
+        """An access token is returned along with the (refresh) token."""
+        user = UserFactory.create(email=self.username, password=self.password)
+
+        request = self.create_request('post', auth=False, data=self.data)
+        response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+        token = self.model.objects.get()
+        self.assertEqual(response.data['token'], token.key)
+        user_id = access_tokens.load_access_token(response.data['access_token'])
+        self.assertEqual(user_id, user.pk)
+        self.assertIn('access_token_expires', response.data)
+
+
+class TestRevokeAuthTokens(APIRequestTestCase):
+    model = models.AuthToken
+    view_class = views.RevokeAuthTokens
+
+    def test_delete(self):
+        user = UserFactory.create()
+        AuthTokenFactory.create_batch(3, user=user)
+        other_token = AuthTokenFactory.create()
+        request = self.create_request('delete', user=user)
+
+        with self.assertNumQueries(1):
+            response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.model.objects.get(), other_token)
+
+    def test_delete_logged_out_signal(self):
+        user = UserFactory.create()
+        request = self.create_request('delete', user=user)
+
+        with patch('django.contrib.auth.signals.user_logged_out.send') as send:
+            self.view_class.as_view()(request)
+
+        send.assert_called_once_with(self.view_class, user=user, request=ANY)
+
+    def test_unauthenticated(self):
+        request = self.create_request('delete', auth=False)
+        response = self.view_class.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestSessionList(APIRequestTestCase):
+    view_class = views.SessionList
+
+    def create_token(self, user, **kwargs):
+        return AuthTokenFactory.create(
+            key=models.AuthToken().generate_key(),
+            user=user,
+            **kwargs
+        )
+
+    def test_get(self):
+        user = UserFactory.create()
+        now = timezone.now()
+        later = self.create_token(user, expires=now + datetime.timedelta(hours=2))
+        sooner = self.create_token(user, expires=now + datetime.timedelta(hours=1))
+        self.create_token(user, expires=now)
+        AuthTokenFactory.create()
+        request = self.create_request(user=user)
+
+        response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = [
+            {
+                'fingerprint': token.key[:8],
+                'created': iso_8601(token.created),
+                'expires': iso_8601(token.expires),
+                'last_used': None,
+            }
+            for token in (later, sooner)
+        ]
+        self.assertEqual(response.data['results'], expected)
+        self.assertIsNone(response.data['next'])
+
+    def test_get_pages(self):
+        """Pages continue from the expiry of the previous page's last token."""
+        user = UserFactory.create()
+        now = timezone.now()
+        tokens = [
+            self.create_token(user, expires=now + datetime.timedelta(minutes=minutes))
+            for minutes in range(1, 26)
+        ]
+        request = self.create_request(user=user)
+        response = self.view_class.as_view()(request)
+        self.assertEqual(len(response.data['results']), 20)
+
+        cursor = re.search('cursor=([^&]+)', response.data['next']).group(1)
+        request = self.create_request(user=user, data={'cursor': cursor})
+        response = self.view_class.as_view()(request)
+
+        fingerprints = [session['fingerprint'] for session in response.data['results']]
+        expected = [token.fingerprint for token in reversed(tokens[:5])]
+        self.assertEqual(fingerprints, expected)
+        self.assertIsNone(response.data['next'])
+
+    def test_unauthenticated(self):
+        request = self.create_request(auth=False)
+        response = self.view_class.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestSessionDetail(APIRequestTestCase):
+    model = models.AuthToken
+    view_class = views.SessionDetail
+
+    def test_delete(self):
+        token = AuthTokenFactory.create(key=self.model().generate_key())
+        other_token = AuthTokenFactory.create(
+            key=self.model().generate_key(),
+            user=token.user,
+        )
+        request = self.create_request('delete', user=token.user)
+
+        response = self.view_class.as_view()(request, fingerprint=token.fingerprint)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.model.objects.get(), other_token)
+
+    def test_delete_ambiguous(self):
+        """Tokens sharing a fingerprint aren't deleted."""
+        token = AuthTokenFactory.create(key='abcdef01' + 'a' * 32)
+        AuthTokenFactory.create(key='abcdef01' + 'b' * 32, user=token.user)
+        request = self.create_request('delete', user=token.user)
+
+        response = self.view_class.as_view()(request, fingerprint=token.fingerprint)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.model.objects.count(), 2)
+
+    def test_delete_other_user(self):
+        token = AuthTokenFactory.create(key=self.model().generate_key())
+        request = self.create_request('delete', user=UserFactory.create())
+
+        response = self.view_class.as_view()(request, fingerprint=token.fingerprint)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(self.model.objects.exists())
+
+
+class TestIntrospectTokens(APIRequestTestCase):
+    model = models.AuthToken
+    view_class = views.IntrospectTokens
+
+    def setUp(self):
+        self.staff = UserFactory.create(is_staff=True)
+        self.now = timezone.now()
+
+    def tearDown(self):
+        cache.clear()
+
+    def introspect(self, token_keys):
+        request = self.create_request(
+            'post',
+            user=self.staff,
+            data={'tokens': token_keys},
+        )
+        return self.view_class.as_view()(request)
+
+    def test_post(self):
+        token = AuthTokenFactory.create(expires=self.now + datetime.timedelta(hours=1))
+        later = AuthTokenFactory.create(expires=self.now + datetime.timedelta(hours=2))
+        expired = AuthTokenFactory.create(expires=self.now)
+        inactive = AuthTokenFactory.create(user__is_active=False)
+
+        # Get all the tokens at once
+        with self.assertNumQueries(1):
+            response = self.introspect(
+                [later.key, token.key, expired.key, inactive.key, 'unknown'],
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+        inactive_data = {'active': False, 'user': None, 'expires': None}
+        self.assertEqual(response.data['tokens'], [
+            {'active': True, 'user': later.user_id, 'expires': later.expires},
+            {'active': True, 'user': token.user_id, 'expires': token.expires},
+            inactive_data,
+            inactive_data,
+            inactive_data,
+        ])
+        max_age = int(re.search('max-age=(\\d+)', response['Cache-Control']).group(1))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertGreater(max_age, 3500)
+        self.assertLessEqual(max_age, 3600)
+
+    @override_settings(AUTH_TOKEN_SHARDS=['default'])
+    def test_post_sharded(self):
+        """Users are checked with a separate query, as they aren't on token shards."""
+        token = AuthTokenFactory.create()
+        inactive = AuthTokenFactory.create(user__is_active=False)
+
+        with self.assertNumQueries(2):
+            response = self.introspect([token.key, inactive.key])
+
+        self.assertEqual(
+            [result['active'] for result in response.data['tokens']],
+            [True, False],
+        )
+
+    def test_post_inactive_only(self):
+        response = self.introspect(['unknown'])
+
+        self.assertEqual(response.data['tokens'], [
+            {'active': False, 'user': None, 'expires': None},
+        ])
+        self.assertIn('max-age=0', response['Cache-Control'])
+
+    @override_settings(AUTH_TOKEN_CACHE='default')
+    def test_post_cached(self):
+        token = AuthTokenFactory.create()
+        token_cache.set_token(token)
+        uncached = AuthTokenFactory.create()
+
+        with self.assertNumQueries(1):
+            response = self.introspect([token.key, uncached.key])
+
+        self.assertEqual(
+            [result['user'] for result in response.data['tokens']],
+            [token.user_id, uncached.user_id],
+        )
+        # The token found in the database is now cached
+        with self.assertNumQueries(0):
+            self.introspect([token.key, uncached.key])
+
+    def test_post_invalid(self):
+        response = self.introspect([])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_not_staff(self):
+        request = self.create_request(
+            'post',
+            user=UserFactory.create(),
+            data={'tokens': ['key']},
+        )
+        response = self.view_class.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestRefreshAccessToken(APIRequestTestCase):
+    model = models.AuthToken
+    view_class = views.RefreshAccessToken
+
+    def test_post(self):
+        soon = timezone.now() + datetime.timedelta(minutes=1)
+        token = AuthTokenFactory.create(expires=soon)
+        request = self.create_request('post', auth=False, data={'token': token.key})
+
+        response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+        user_id = access_tokens.load_access_token(response.data['access_token'])
+        self.assertEqual(user_id, token.user.pk)
+        self.assertIn('access_token_expires', response.data)
+
+        # The refresh token's expiry is extended
+        stored = self.model.objects.get(pk=token.pk)
+        self.assertGreater(stored.expires, token.expires)
+
+    def test_post_revoked(self):
+        request = self.create_request('post', auth=False, data={'token': 'deleted'})
+
+        response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('access_token', response.data)
+
+    def test_post_expired(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        token = AuthTokenFactory.create(expires=yesterday)
+        request = self.create_request('post', auth=False, data={'token': token.key})
+
+        response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_post_pending_refresh(self):
+        """Tokens are checked like by `TokenAuthentication`, with buffered expiries."""
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        token = AuthTokenFactory.create(expires=yesterday)
+        tomorrow = timezone.now() + datetime.timedelta(days=1)
+        request = self.create_request('post', auth=False, data={'token': token.key})
+
+        pending = {token.pk: {'expires': tomorrow}}
+        with patch.dict(models.expiry_buffer.pending, pending):
+            response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.data)
+
+    def test_post_inactive_user(self):
+        token = AuthTokenFactory.create(user__is_active=False)
+        request = self.create_request('post', auth=False, data={'token': token.key})
+
+        response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class TestRegisterView(APIRequestTestCase):
     view_class = views.UserRegister
@@ -300,6 +693,19 @@ class TestRegisterView(APIRequestTestCase):
 
         self.assertEqual(User.objects.count(), 1)
 
+    @override_settings(AUTH_PASSWORD_HASHING_WORKERS=1)
+    def test_password_hashing_unavailable(self):
+        """No user is created while the password hashing pool is busy."""
+        request = self.create_request('post', auth=False, data=self.data)
+
+        with patch.object(hashing.executor, 'submit') as submit:
+            submit.side_effect = hashing.HashingUnavailable
+            response = self.view_class.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(User.objects.count())
+
 
 class TestPasswordResetEmail(APIRequestTestCase):
     view_class = views.PasswordResetEmail
@@ -559,6 +965,29 @@ class TestPasswordChange(APIRequestTestCase):
         user = User.objects.get(pk=user.pk)
         self.assertTrue(user.check_password(new_password))
 
+    @override_settings(AUTH_PASSWORD_HASHING_MAX_CONCURRENT=1)
+    def test_update_hashing_unavailable(self):
+        old_password = '0ld_passworD'
+        new_password = 'n3w_Password'
+        user = UserFactory.create(password=old_password)
+        slots = hashing.admission.get_slots()
+        slots.acquire()
+
+        request = self.create_request(
+            'put',
+            user=user,
+            data={
+                'old_password': old_password,
+                'new_password': new_password,
+                'new_password2': new_password,
+            })
+        response = self.view_class.as_view()(request)
+        slots.release()
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        user = User.objects.get(pk=user.pk)
+        self.assertTrue(user.check_password(old_password))
+
     def test_update_anonymous(self):
         old_password = '0ld_passworD'
         new_password = 'n3w_Password'
@@ -9,4 +9,19 @@ urlpatterns = [
         view=views.GetAuthToken.as_view(),
         name='auth',
     ),
+    url(
+        regex=r'^auth/refresh/?$',
+        view=views.RefreshAccessToken.as_view(),
+        name='auth_refresh',
+    ),
+    url(
+        regex=r'^auth/all/?$',
+        view=views.RevokeAuthTokens.as_view(),
+        name='auth_all',
+    ),
+    url(
+        regex=r'^auth/introspect/?$',
+        view=views.IntrospectTokens.as_view(),
+        name='auth_introspect',
+    ),
 ]
@@ -14,4 +14,14 @@ urlpatterns = [
         view=views.PasswordChange.as_view(),
         name='password_change',
     ),
+    url(
+        regex=r'^profile/sessions/?$',
+        view=views.SessionList.as_view(),
+        name='session_list',
+    ),
+    url(
+        regex=r'^profile/sessions/(?P<fingerprint>[0-9a-f]{8})/?$',
+        view=views.SessionDetail.as_view(),
+        name='session_detail',
+    ),
 ]
@@ -1,5 +1,13 @@
+import itertools
+
+from django.conf import settings
 from django.contrib.auth import get_user_model, signals
 from django.contrib.auth.tokens import default_token_generator
+from django.core import signing
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.utils.encoding import force_text
 from django.utils.http import urlsafe_base64_decode
 from django.utils.translation import ugettext_lazy as _
@@ -7,15 +15,77 @@ from rest_framework import generics, response, status, views
 from rest_framework.authentication import get_authorization_header
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.exceptions import PermissionDenied
-from rest_framework.permissions import AllowAny, IsAuthenticated
-
+from rest_framework.permissions import (
+    AllowAny,
+    IsAdminUser,
+    IsAuthenticated,
+    SAFE_METHODS,
+)
+
+from user_management.utils import hashing
 from user_management.utils.views import VerifyAccountViewMixin
-from . import exceptions, models, permissions, serializers, throttling
+from . import (
+    access_tokens,
+    cache as token_cache,
+    exceptions,
+    models,
+    pagination,
+    permissions,
+    routers,
+    serializers,
+    throttling,
+)
 
 User = get_user_model()
 
 
-class GetAuthToken(ObtainAuthToken):
+class ReplicaReadsMixin(object):
+    """
+    Read users and tokens from `settings.AUTH_READ_REPLICAS` on safe requests.
+
+    Clients whose token was used to write (or was just issued) recently are
+    pinned to the primary database instead, see `user_management.api.routers`.
+    Clients using access tokens are pinned by user.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if not routers.get_replicas():
+            return super(ReplicaReadsMixin, self).dispatch(request, *args, **kwargs)
+
+        pin_key = self.get_pin_key(request)
+        safe = request.method in SAFE_METHODS
+        pinned = pin_key is not None and routers.has_pin(pin_key)
+        with routers.read_from_replicas(safe and not pinned):
+            resp = super(ReplicaReadsMixin, self).dispatch(request, *args, **kwargs)
+
+        if not safe and pin_key is not None and status.is_success(resp.status_code):
+            routers.set_pin(pin_key)
+        return resp
+
+    def get_pin_key(self, request):
+        """Pin clients by token, or by user for access tokens."""
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2:
+            return
+        keyword, key = auth[0].lower(), auth[1].decode('utf-8')
+        if keyword == b'token':
+            return routers.make_pin_key(key)
+        if keyword == b'bearer':
+            try:
+                user_id = access_tokens.load_access_token(key)
+            except (signing.BadSignature, access_tokens.ExpiredAccessToken):
+                return
+            return routers.make_user_pin_key(user_id)
+
+
+class PasswordHashingMixin(object):
+    """Respond with a 503 when too many passwords are being hashed."""
+    def handle_exception(self, exc):
+        if isinstance(exc, hashing.HashingUnavailable):
+            exc = exceptions.PasswordHashingUnavailable()
+        return super(PasswordHashingMixin, self).handle_exception(exc)
+
+
+class GetAuthToken(PasswordHashingMixin, ReplicaReadsMixin, ObtainAuthToken):
     """
     Obtain an authentication token.
 
@@ -23,9 +93,21 @@ class GetAuthToken(ObtainAuthToken):
     `password` and return a `token` if successful.
     The `token` remains valid until `settings.AUTH_TOKEN_MAX_AGE` time has passed.
 
+    If `settings.AUTH_ACCESS_TOKENS` is `True`, a short-lived signed `access_token`
+    and its `access_token_expires` datetime are also returned. `token` is then used
+    as a refresh token with `RefreshAccessToken`.
+
+    If `settings.AUTH_TOKEN_MAX_PER_USER` is set, logging in also deletes the user's
+    expired tokens and, beyond that number, their least recently refreshed ones.
+
+    With `settings.AUTH_READ_REPLICAS`, the new token (and the user, for access
+    tokens) is pinned to the primary database, so it is found while replicas
+    catch up.
+
     `DELETE` method removes the current `token` from the database.
     """
     model = models.AuthToken
+    serializer_class = serializers.AuthTokenSerializer
     throttle_classes = [
         throttling.UsernameLoginRateThrottle,
         throttling.LoginRateThrottle,
@@ -39,9 +121,19 @@ class GetAuthToken(ObtainAuthToken):
         if serializer.is_valid():
             user = serializer.validated_data['user']
             signals.user_logged_in.send(type(self), user=user, request=request)
-            token = self.model.objects.create(user=user)
-            token.update_expiry()
-            return response.Response({'token': token.key})
+            with transaction.atomic():
+                # The token is created with its expiry.
+                token = self.model.objects.create(user=user)
+                max_tokens = getattr(settings, 'AUTH_TOKEN_MAX_PER_USER', None)
+                if max_tokens:
+                    others = self.model.objects.exclude(pk=token.pk)
+                    others.trim_user_tokens(user.pk, max_tokens - 1)
+            routers.pin(token.key)
+            data = {'token': token.plain_key}
+            if getattr(settings, 'AUTH_ACCESS_TOKENS', False):
+                routers.pin_user(user.pk)
+                data.update(access_token_data(user))
+            return response.Response(data)
 
         return response.Response(
             serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -62,7 +154,7 @@ class GetAuthToken(ObtainAuthToken):
             return response.Response(msg, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = self.model.objects.get(key=auth[1].decode('utf-8'))
+            token = self.model.objects.get_by_key(auth[1].decode('utf-8'))
         except self.model.DoesNotExist:
             pass
         else:
@@ -75,7 +167,135 @@ class GetAuthToken(ObtainAuthToken):
         return response.Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class UserRegister(generics.CreateAPIView):
+class RefreshAccessToken(generics.GenericAPIView):
+    """
+    Obtain a new access token.
+
+    `POST` a `token` obtained from `GetAuthToken` to receive a new `access_token`
+    (see `AccessTokenAuthentication`). The `token` is checked, and its expiry
+    extended, by `TokenAuthentication` like on any authenticated request.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    serializer_class = serializers.RefreshTokenSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return response.Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return response.Response(access_token_data(serializer.user))
+
+
+class RevokeAuthTokens(views.APIView):
+    """
+    Log out everywhere.
+
+    `DELETE` removes all of the current user's tokens with a single query.
+    """
+    permission_classes = (IsAuthenticated,)
+    model = models.AuthToken
+
+    def delete(self, request, *args, **kwargs):
+        self.model.objects.filter(user=request.user).delete()
+        signals.user_logged_out.send(type(self), user=request.user, request=request)
+        return response.Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class IntrospectTokens(generics.GenericAPIView):
+    """
+    Check auth tokens for other services, e.g. an API gateway. Staff users only.
+
+    `POST` a list of up to 100 `tokens` to get, in the same order, whether each is
+    `active` and its `user` id and `expires` datetime. Tokens are found in the token
+    caches, or with a single query. Expiry is not extended.
+
+    The response may be cached until the first of its active tokens expires.
+    """
+    permission_classes = (IsAdminUser,)
+    serializer_class = serializers.TokenIntrospectionSerializer
+    model = models.AuthToken
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return response.Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        token_keys = serializer.validated_data['tokens']
+        tokens = self.get_tokens(token_keys)
+
+        now = timezone.now()
+        results = []
+        max_age = None
+        for key in token_keys:
+            token = tokens.get(key)
+            if token is None or token.expires <= now:
+                results.append({'active': False, 'user': None, 'expires': None})
+                continue
+
+            results.append({
+                'active': True,
+                'user': token.user_id,
+                'expires': token.expires,
+            })
+            remaining = int((token.expires - now).total_seconds())
+            max_age = remaining if max_age is None else min(max_age, remaining)
+
+        resp = response.Response({'tokens': results})
+        patch_cache_control(resp, private=True, max_age=max_age or 0)
+        return resp
+
+    def get_tokens(self, token_keys):
+        """Return the tokens of active users with `token_keys`, by key."""
+        tokens = {}
+        missing = []
+        for key in token_keys:
+            token = self.model.objects.get_cached(key)
+            if token is None:
+                missing.append(key)
+            else:
+                tokens[key] = token
+
+        if missing:
+            found = self.get_active_tokens(missing)
+            for token in found.values():
+                token_cache.set_token(token)
+            tokens.update(found)
+
+        # Take into account any refresh not yet written to the database
+        for token in tokens.values():
+            models.expiry_buffer.apply(token)
+        return tokens
+
+    def get_active_tokens(self, token_keys):
+        """Query the tokens of active users with `token_keys`, by key."""
+        if not routers.get_shards():
+            return self.model.objects.filter(user__is_active=True).get_by_keys(token_keys)
+
+        # Users aren't on the tokens' shards: check them with a separate query.
+        tokens = self.model.objects.get_by_keys(token_keys)
+        active = set(User._default_manager.filter(
+            pk__in={token.user_id for token in tokens.values()},
+            is_active=True,
+        ).values_list('pk', flat=True))
+        return {key: token for key, token in tokens.items() if token.user_id in active}
+
+
+def access_token_data(user):
+    access_token, expires = access_tokens.make_access_token(user)
+    return {
+        'access_token': access_token,
+        'access_token_expires': expires,
+    }
+
+
+class UserRegister(PasswordHashingMixin, ReplicaReadsMixin, generics.CreateAPIView):
     """
     Register a new `User`.
 
@@ -173,7 +393,7 @@ class OneTimeUseAPIMixin(object):
         )
 
 
-class PasswordReset(OneTimeUseAPIMixin, generics.UpdateAPIView):
+class PasswordReset(PasswordHashingMixin, OneTimeUseAPIMixin, generics.UpdateAPIView):
     """
     Reset a user's password.
 
@@ -193,7 +413,7 @@ class PasswordReset(OneTimeUseAPIMixin, generics.UpdateAPIView):
         return self.user
 
 
-class PasswordChange(generics.UpdateAPIView):
+class PasswordChange(PasswordHashingMixin, ReplicaReadsMixin, generics.UpdateAPIView):
     """
     Change a user's password.
 
@@ -226,7 +446,7 @@ class VerifyAccountView(VerifyAccountViewMixin, views.APIView):
         )
 
 
-class ProfileDetail(generics.RetrieveUpdateDestroyAPIView):
+class ProfileDetail(ReplicaReadsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Allow a user to view and edit their profile information.
 
@@ -240,7 +460,50 @@ class ProfileDetail(generics.RetrieveUpdateDestroyAPIView):
         return self.request.user
 
 
-class UserList(generics.ListCreateAPIView):
+class SessionList(generics.ListAPIView):
+    """
+    List the current user's unexpired tokens, latest expiry first.
+
+    Tokens are identified by their `fingerprint`, the start of their key.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = serializers.SessionSerializer
+    pagination_class = pagination.SessionPagination
+
+    def get_queryset(self):
+        return self.request.user.authtoken.filter(expires__gt=timezone.now())
+
+
+class SessionDetail(generics.GenericAPIView):
+    """
+    Revoke one of the current user's tokens.
+
+    `DELETE` the token with the `fingerprint` given in the url. If several of the
+    user's tokens have that fingerprint, none is deleted and the response is
+    `409 Conflict`.
+    """
+    permission_classes = (IsAuthenticated,)
+    model = models.AuthToken
+
+    def delete(self, request, *args, **kwargs):
+        tokens = self.model.objects.filter(
+            user=request.user,
+            key__startswith=kwargs['fingerprint'],
+        )
+        keys_by_shard = tokens.fan_out(
+            lambda tokens: list(tokens.values_list('key', flat=True)[:2]),
+        )
+        keys = list(itertools.chain(*keys_by_shard))
+        if not keys:
+            raise Http404()
+        if len(keys) > 1:
+            raise exceptions.AmbiguousFingerprint()
+
+        tokens.filter(key=keys[0]).for_key(keys[0]).delete()
+        return response.Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UserList(ReplicaReadsMixin, generics.ListCreateAPIView):
     """
     Return information about all users and allow creation of new users.
 
@@ -251,7 +514,7 @@ class UserList(generics.ListCreateAPIView):
     serializer_class = serializers.UserSerializerCreate
 
 
-class UserDetail(generics.RetrieveUpdateDestroyAPIView):
+class UserDetail(ReplicaReadsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Display information about a user.
 
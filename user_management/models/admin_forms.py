@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.utils.translation import ugettext_lazy as _
 
+from .mixins import case_insensitive_filter
+
 
 User = get_user_model()
 
@@ -37,7 +39,7 @@ class UserCreationForm(forms.ModelForm):
         """
         email = self.cleaned_data['email']
         try:
-            User._default_manager.get(email__iexact=email)
+            User._default_manager.get(**case_insensitive_filter(User, 'email', email))
         except User.DoesNotExist:
             return email.lower()
         raise forms.ValidationError(self.error_messages['duplicate_email'])
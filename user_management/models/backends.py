@@ -1,20 +1,28 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
 
+from user_management.utils import hashing
+from .mixins import case_insensitive_filter
+
 
 class CaseInsensitiveEmailBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
         UserModel = get_user_model()
         if username is None:
             username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            # Credentials for other backends, e.g. `authenticate(request, token=...)`.
+            return
 
-        username_field = UserModel.USERNAME_FIELD + '__iexact'
+        # Uses the unique index of citext or normalized columns.
+        lookup = case_insensitive_filter(UserModel, UserModel.USERNAME_FIELD, username)
         try:
-            user = UserModel.objects.get(**{username_field: username})
+            user = UserModel.objects.get(**lookup)
         except UserModel.DoesNotExist:
             # Run the default password hasher once to reduce the timing
             # difference between an existing and a non-existing user (#20760).
-            UserModel().set_password(password)
+            hashing.set_password(UserModel(), password)
         else:
-            if user.check_password(password) and self.user_can_authenticate(user):
+            is_correct = hashing.check_password(user, password)
+            if is_correct and self.user_can_authenticate(user):
                 return user
@@ -1,9 +1,9 @@
 from django.contrib.auth.models import BaseUserManager
 from django.contrib.auth.tokens import default_token_generator
-from django.contrib.postgres.fields import CIEmailField
 from django.contrib.sites.models import Site
 from django.core import checks, signing
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models, router
 from django.utils import timezone
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
@@ -11,6 +11,54 @@ from django.utils.translation import ugettext_lazy as _
 
 from user_management.utils import notifications
 
+try:
+    from django.contrib.postgres.fields import CIEmailField, CIText
+except ImportError:
+    # psycopg2 isn't installed. Only `EmailUserMixin` needs citext, so the other
+    # mixins (e.g. `NormalizedEmailUserMixin`) can still be used.
+    CIText = None
+
+    class CIEmailField(models.EmailField):
+        """Stand-in for citext emails, refusing to be used in concrete models."""
+        def contribute_to_class(self, cls, name, **kwargs):
+            if not cls._meta.abstract:
+                raise ImproperlyConfigured(
+                    '{} needs django.contrib.postgres (and psycopg2) for its '
+                    'case-insensitive email. Install psycopg2, or use '
+                    'NormalizedEmailUserMixin instead.'.format(cls.__name__),
+                )
+            super(CIEmailField, self).contribute_to_class(cls, name, **kwargs)
+
+
+def case_insensitive_lookup(model, field_name, using=None):
+    """
+    Return the lookup matching `model.field_name` case-insensitively.
+
+    On PostgreSQL, citext columns (e.g. `CIEmailField`) already compare
+    case-insensitively: an `exact` lookup can use their unique index, while
+    `iexact` compiles to `UPPER(...) = UPPER(...)`, which can't.
+    """
+    field = model._meta.get_field(field_name)
+    using = using or router.db_for_read(model)
+    citext = CIText is not None and isinstance(field, CIText)
+    if citext and connections[using].vendor == 'postgresql':
+        return field_name
+    return field_name + '__iexact'
+
+
+def case_insensitive_filter(model, field_name, value, using=None):
+    """
+    Return the filter arguments matching `value` in `model.field_name`
+    case-insensitively.
+
+    Fields listed in `model.NORMALIZED_FIELDS` are matched exactly against the
+    column storing their lowercased value (see `NormalizedEmailUserMixin`).
+    """
+    normalized_fields = getattr(model, 'NORMALIZED_FIELDS', {})
+    if field_name in normalized_fields:
+        return {normalized_fields[field_name]: value.lower()}
+    return {case_insensitive_lookup(model, field_name, using): value}
+
 
 class UserManager(BaseUserManager):
     """Django requires user managers to have create_user & create_superuser."""
@@ -42,7 +90,7 @@ class UserManager(BaseUserManager):
         `get_by_natural_key` is used to `authenticate` a user, see:
         https://github.com/django/django/blob/c5780adeecfbd85a80b5aa7130dd86e78b23e497/django/contrib/auth/backends.py#L16
         """
-        return self.get(email__iexact=email)
+        return self.get(**case_insensitive_filter(self.model, 'email', email, self.db))
 
 
 class DateJoinedUserMixin(models.Model):
@@ -72,6 +120,45 @@ class EmailUserMixin(models.Model):
         abstract = True
 
 
+class NormalizedEmailUserMixin(models.Model):
+    """
+    Like `EmailUserMixin`, for any database.
+
+    The lowercased email is kept in the unique `email_normalized` column, which
+    case-insensitive lookups match exactly. It is set when saving the user, not by
+    `QuerySet.update()` or `bulk_create()`. Run the `normalize_emails` command to
+    set it on existing users.
+    """
+    email = models.EmailField(
+        verbose_name=_('Email address'),
+        unique=True,
+        max_length=511,
+    )
+    # Nullable until existing users are backfilled.
+    email_normalized = models.EmailField(
+        unique=True,
+        null=True,
+        editable=False,
+        max_length=511,
+    )
+    email_verified = True
+
+    objects = UserManager()
+
+    USERNAME_FIELD = 'email'
+    NORMALIZED_FIELDS = {'email': 'email_normalized'}
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.email_normalized = self.email.lower()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'email_normalized'}
+        return super(NormalizedEmailUserMixin, self).save(*args, **kwargs)
+
+
 class IsStaffUserMixin(models.Model):
     is_staff = models.BooleanField(_('staff status'), default=False)
 
@@ -4,6 +4,7 @@ from django.db import models
 
 from .notifications import CustomPasswordResetNotification
 from ..mixins import (
+    ActiveUserMixin,
     AvatarMixin,
     BasicUserFieldsMixin,
     DateJoinedUserMixin,
@@ -11,6 +12,8 @@ from ..mixins import (
     EmailVerifyUserMixin,
     IsStaffUserMixin,
     NameUserMethodsMixin,
+    NameUserMixin,
+    NormalizedEmailUserMixin,
     VerifyEmailMixin,
 )
 
@@ -47,3 +50,8 @@ class CustomNameUser(
         AvatarMixin, EmailVerifyUserMixin, CustomBasicUserFieldsMixin,
         AbstractBaseUser):
     pass
+
+
+class NormalizedEmailUser(
+        NormalizedEmailUserMixin, NameUserMixin, ActiveUserMixin, AbstractBaseUser):
+    pass
@@ -1,6 +1,7 @@
-from django.test import TestCase
+from django.test import override_settings, TestCase
 
 from .factories import UserFactory
+from .models import NormalizedEmailUser
 from ..backends import CaseInsensitiveEmailBackend
 
 
@@ -61,3 +62,27 @@ class CaseInsensitveEmailBackendTest(TestCase):
         )
 
         self.assertIs(authenticated_user, None)
+
+    @override_settings(AUTH_USER_MODEL='tests.NormalizedEmailUser')
+    def test_authenticate_normalized_email(self):
+        password = 'arandomsuperstrongpassword'
+        user = NormalizedEmailUser(email='test-Email@example.com', name='Test')
+        user.set_password(password)
+        user.save()
+
+        backend = CaseInsensitiveEmailBackend()
+        authenticated_user = backend.authenticate(
+            self.request,
+            username='Test-email@example.com',
+            password=password,
+        )
+
+        self.assertEqual(user, authenticated_user)
+
+    @override_settings(AUTH_USER_MODEL='tests.NormalizedEmailUser')
+    def test_authenticate_other_credentials(self):
+        """Credentials meant for other backends are ignored."""
+        backend = CaseInsensitiveEmailBackend()
+        authenticated_user = backend.authenticate(self.request, token='a-token')
+
+        self.assertIs(authenticated_user, None)
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
+import importlib.util
+import sys
+from unittest import skipIf, skipUnless
 
+import django
 from django.contrib.sites.models import Site
 from django.core import checks
-from django.db.models import TextField
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import EmailField, TextField
 from django.db.utils import IntegrityError
 from django.test import TestCase
 from django.utils import timezone
@@ -167,6 +173,126 @@ class TestUserManager(TestCase):
         self.assertEqual(user, existing_user)
 
 
+class TestCaseInsensitiveLookup(TestCase):
+    def test_citext_postgresql(self):
+        """Citext columns are matched exactly on PostgreSQL."""
+        with patch.object(connection, 'vendor', 'postgresql'):
+            lookup = mixins.case_insensitive_lookup(models.User, 'email')
+
+        self.assertEqual(lookup, 'email')
+
+    def test_citext_other_database(self):
+        with patch.object(connection, 'vendor', 'sqlite'):
+            lookup = mixins.case_insensitive_lookup(models.User, 'email')
+
+        self.assertEqual(lookup, 'email__iexact')
+
+    def test_not_citext(self):
+        with patch.object(connection, 'vendor', 'postgresql'):
+            lookup = mixins.case_insensitive_lookup(models.User, 'name')
+
+        self.assertEqual(lookup, 'name__iexact')
+
+    @skipUnless(connection.vendor == 'postgresql', 'Citext requires PostgreSQL.')
+    @skipIf(django.VERSION < (2, 1), 'QuerySet.explain() requires Django 2.1+.')
+    def test_uses_unique_index(self):
+        """
+        Login lookups use the unique email index, instead of scanning every user.
+
+        Disabling sequential scans makes the planner choose the index whenever it
+        can, as it would on a table with millions of users.
+        """
+        UserFactory.create_batch(10)
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        lookup = mixins.case_insensitive_lookup(models.User, 'email')
+        users = models.User.objects.filter(**{lookup: 'EMAIL1@example.com'})
+
+        self.assertRegex(users.explain(), r'Index (Only )?Scan using \w*email')
+
+
+class TestNormalizedEmailUserMixin(TestCase):
+    model = models.NormalizedEmailUser
+
+    def test_save(self):
+        user = self.model.objects.create(email='WhatDid@You.Say', name='Test')
+
+        self.assertEqual(user.email, 'WhatDid@You.Say')
+        self.assertEqual(user.email_normalized, 'whatdid@you.say')
+
+    def test_save_update_fields(self):
+        user = self.model.objects.create(email='old@example.com', name='Test')
+        user.email = 'New@example.com'
+
+        user.save(update_fields=['email'])
+
+        user.refresh_from_db()
+        self.assertEqual(user.email_normalized, 'new@example.com')
+
+    def test_create_user(self):
+        user = self.model.objects.create_user('WhatDid@You.Say', name='Test')
+
+        self.assertEqual(user.email_normalized, 'whatdid@you.say')
+
+    def test_case_insensitive_uniqueness(self):
+        self.model.objects.create(email='WhatDid@You.Say', name='Test')
+
+        with self.assertRaises(IntegrityError):
+            self.model.objects.create(email='whatdid@you.say', name='Test')
+
+    def test_get_by_natural_key(self):
+        existing_user = self.model.objects.create(email='WhatDid@You.Say', name='Test')
+
+        user = self.model.objects.get_by_natural_key('WHATDID@YOU.SAY')
+
+        self.assertEqual(user, existing_user)
+
+    def test_case_insensitive_filter(self):
+        lookup = mixins.case_insensitive_filter(self.model, 'email', 'WhatDid@You.Say')
+
+        self.assertEqual(lookup, {'email_normalized': 'whatdid@you.say'})
+
+    @skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+    @skipIf(django.VERSION < (2, 1), 'QuerySet.explain() requires Django 2.1+.')
+    def test_uses_unique_index(self):
+        """Login lookups use the unique index of the normalized column."""
+        self.model.objects.create(email='WhatDid@You.Say', name='Test')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        lookup = mixins.case_insensitive_filter(self.model, 'email', 'WhatDid@You.Say')
+        users = self.model.objects.filter(**lookup)
+
+        self.assertRegex(users.explain(), r'Index (Only )?Scan using \w*email_normalized')
+
+
+class TestMixinsWithoutPsycopg2(TestCase):
+    def setUp(self):
+        spec = importlib.util.spec_from_file_location(
+            'user_management.models.mixins_without_psycopg2',
+            mixins.__file__,
+        )
+        self.module = importlib.util.module_from_spec(spec)
+        with patch.dict(sys.modules, {'django.contrib.postgres.fields': None}):
+            spec.loader.exec_module(self.module)
+
+    def test_import(self):
+        """Without citext, the mixins can still be imported."""
+        self.assertIsNone(self.module.CIText)
+        field = self.module.NormalizedEmailUserMixin._meta.get_field('email')
+        self.assertIs(type(field), EmailField)
+        lookup = self.module.case_insensitive_lookup(models.User, 'email')
+        self.assertEqual(lookup, 'email__iexact')
+
+    def test_email_user_mixin(self):
+        """Without citext, models can't use `EmailUserMixin`."""
+        with self.assertRaises(ImproperlyConfigured):
+            class User(self.module.EmailUserMixin):
+                class Meta:
+                    app_label = 'tests'
+
+
 class TestVerifyEmailMixin(TestCase):
     model = models.VerifyEmailUser
 
@@ -15,14 +15,22 @@ MIGRATION_MODULES = {
     'api': 'user_management.tests.testmigrations.api',
     'tests': 'user_management.tests.testmigrations.tests',
 }
+DATABASE = dj_database_url.config(
+    default='postgres://localhost/user_management_api',
+)
+# Second auth token shard, see `user_management.api.routers`.
+TOKENS_DATABASE = dict(DATABASE, NAME=DATABASE['NAME'] + '_tokens_1')
 
 
 settings.configure(
     DATABASES={
-        'default': dj_database_url.config(
-            default='postgres://localhost/user_management_api',
-        ),
+        'default': DATABASE,
+        'tokens_1': TOKENS_DATABASE,
     },
+    DATABASE_ROUTERS=[
+        'user_management.api.routers.AuthTokenShardRouter',
+        'user_management.api.routers.ReplicaRouter',
+    ],
     DEFAULT_FILE_STORAGE='inmemorystorage.InMemoryStorage',
     INSTALLED_APPS=(
         # Put contenttypes before auth to work around test issue.
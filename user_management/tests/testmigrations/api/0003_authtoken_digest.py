@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_authtoken_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authtoken',
+            name='digest',
+            field=models.BinaryField(editable=False, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_authtoken_digest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='authtoken',
+            index=models.Index(fields=['expires'], name='api_authtoken_expires'),
+        ),
+        migrations.AddIndex(
+            model_name='authtoken',
+            index=models.Index(fields=['user', 'expires'], name='api_authtoken_user_expires'),
+        ),
+    ]
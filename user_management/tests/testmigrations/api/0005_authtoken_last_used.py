@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_authtoken_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authtoken',
+            name='last_used',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.14 on 2026-10-18 05:19
+
+from django.db import migrations, models
+import user_management.models.mixins
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0002_case_insensitive_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NormalizedEmailUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('email', models.EmailField(max_length=511, unique=True, verbose_name='Email address')),
+                ('email_normalized', models.EmailField(editable=False, max_length=511, null=True, unique=True)),
+                ('name', models.CharField(max_length=255, verbose_name='Name')),
+                ('is_active', models.BooleanField(default=True, verbose_name='active')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(user_management.models.mixins.NameUserMethodsMixin, models.Model),
+        ),
+    ]
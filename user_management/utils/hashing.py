@@ -0,0 +1,345 @@
+"""
+Optional process pool to hash passwords off the request thread.
+
+Set `settings.AUTH_PASSWORD_HASHING_WORKERS` to a number of processes to hash
+and check passwords in, instead of running the (deliberately slow) hasher on
+the thread serving the request. At most `settings.AUTH_PASSWORD_HASHING_QUEUE_SIZE`
+calls wait for a free process: further calls are rejected straight away, and
+calls not done within `settings.AUTH_PASSWORD_HASHING_TIMEOUT` seconds give up.
+Both raise `HashingUnavailable`, which the API views respond to with a 503.
+
+Without the setting, passwords are hashed by the user model as usual.
+
+Either way, set `settings.AUTH_PASSWORD_HASHING_MAX_CONCURRENT` to limit how many
+passwords each process hashes at once. Further calls wait for up to
+`settings.AUTH_PASSWORD_HASHING_WAIT` seconds, then are shed with
+`HashingUnavailable`.
+
+Set `settings.AUTH_PASSWORD_REHASH_DEFERRED` to `True` to hash correct passwords
+stored with outdated hasher settings again in a background thread, after the
+login, instead of before responding.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_AUTH_PASSWORD_HASHING_QUEUE_SIZE = 16
+DEFAULT_AUTH_PASSWORD_HASHING_TIMEOUT = 5
+DEFAULT_AUTH_PASSWORD_HASHING_WAIT = 0
+DEFAULT_AUTH_PASSWORD_REHASH_QUEUE_SIZE = 1000
+
+
+class HashingUnavailable(Exception):
+    """Too many passwords are being hashed: try again later."""
+
+
+def _run(password_hashers, func, *args):
+    """Call `func` in a worker, which may not have django's settings (e.g. spawned)."""
+    if not settings.configured:
+        settings.configure(PASSWORD_HASHERS=password_hashers)
+    return func(*args)
+
+
+def _check_password(password, encoded):
+    """Return whether `password` matches `encoded`, and whether to rehash it."""
+    rehash = []
+    is_correct = hashers.check_password(password, encoded, setter=rehash.append)
+    return is_correct, bool(rehash)
+
+
+def password_status(encoded):
+    """
+    Return the algorithm of password hash `encoded`, and whether it's outdated.
+
+    Unusable passwords have no algorithm and aren't outdated: they can't be
+    rehashed. Unknown algorithms are outdated.
+    """
+    if not encoded or encoded.startswith(hashers.UNUSABLE_PASSWORD_PREFIX):
+        return None, False
+    preferred = hashers.get_hasher()
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return 'unknown', True
+    outdated = hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+    return hasher.algorithm, outdated
+
+
+class HashingExecutor(object):
+    """
+    A process pool admitting a bounded number of calls.
+
+    The pool is started on first use, and again in forked processes (e.g. web
+    server workers) or when the settings change.
+    """
+    def __init__(self):
+        self.pool = None
+        self.config = None
+        self.lock = threading.Lock()
+
+    @property
+    def workers(self):
+        return getattr(settings, 'AUTH_PASSWORD_HASHING_WORKERS', None)
+
+    @property
+    def queue_size(self):
+        return getattr(
+            settings,
+            'AUTH_PASSWORD_HASHING_QUEUE_SIZE',
+            DEFAULT_AUTH_PASSWORD_HASHING_QUEUE_SIZE,
+        )
+
+    @property
+    def timeout(self):
+        return getattr(
+            settings,
+            'AUTH_PASSWORD_HASHING_TIMEOUT',
+            DEFAULT_AUTH_PASSWORD_HASHING_TIMEOUT,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.workers)
+
+    def get_pool(self):
+        """Return the pool and the semaphore bounding its calls."""
+        config = (
+            os.getpid(),
+            self.workers,
+            self.queue_size,
+            tuple(settings.PASSWORD_HASHERS),
+        )
+        with self.lock:
+            if self.config != config:
+                if self.config is not None and self.config[0] == config[0]:
+                    self.pool[0].shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+                slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+                self.pool = (executor, slots)
+                self.config = config
+            return self.pool
+
+    def shutdown(self, wait=True):
+        """Stop the pool's processes. It's started again if needed."""
+        with self.lock:
+            if self.config is not None and self.config[0] == os.getpid():
+                self.pool[0].shutdown(wait=wait)
+            self.pool = None
+            self.config = None
+
+    def submit(self, func, *args):
+        """Schedule `func(*args)` in the pool, or raise if too many calls are pending."""
+        executor, slots = self.get_pool()
+        if not slots.acquire(blocking=False):
+            raise HashingUnavailable()
+
+        try:
+            future = executor.submit(_run, settings.PASSWORD_HASHERS, func, *args)
+        except Exception:
+            slots.release()
+            raise
+        # Calls that timed out keep their slot until their worker is done.
+        future.add_done_callback(lambda future: slots.release())
+        return future
+
+    def run(self, func, *args):
+        """Call `func(*args)` in the pool and return its result."""
+        future = self.submit(func, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingUnavailable()
+
+
+class HashingAdmission(object):
+    """
+    Admit a bounded number of concurrent hashing calls in this process.
+
+    The semaphore is replaced when the setting changes: calls admitted before
+    release the previous one.
+    """
+    def __init__(self):
+        self.slots = None
+        self.limit = None
+        self.lock = threading.Lock()
+
+    @property
+    def max_concurrent(self):
+        return getattr(settings, 'AUTH_PASSWORD_HASHING_MAX_CONCURRENT', None)
+
+    @property
+    def wait(self):
+        return getattr(
+            settings,
+            'AUTH_PASSWORD_HASHING_WAIT',
+            DEFAULT_AUTH_PASSWORD_HASHING_WAIT,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.max_concurrent)
+
+    def get_slots(self):
+        with self.lock:
+            if self.limit != self.max_concurrent:
+                self.slots = threading.BoundedSemaphore(self.max_concurrent)
+                self.limit = self.max_concurrent
+            return self.slots
+
+    @contextmanager
+    def admit(self):
+        """Hold a slot while hashing, waiting up to `self.wait` seconds for one."""
+        if not self.enabled:
+            yield
+            return
+
+        slots = self.get_slots()
+        if not slots.acquire(timeout=self.wait):
+            raise HashingUnavailable()
+        try:
+            yield
+        finally:
+            slots.release()
+
+
+class RehashQueue(object):
+    """
+    Hash passwords again in a background thread of this process.
+
+    Passwords are kept in memory until rehashed. Passwords queued beyond
+    `settings.AUTH_PASSWORD_REHASH_QUEUE_SIZE`, or that can't be hashed while
+    hashing is busy, are dropped: they're rehashed on a later login.
+    """
+    def __init__(self):
+        self.items = None
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'AUTH_PASSWORD_REHASH_DEFERRED', False)
+
+    @property
+    def maxsize(self):
+        return getattr(
+            settings,
+            'AUTH_PASSWORD_REHASH_QUEUE_SIZE',
+            DEFAULT_AUTH_PASSWORD_REHASH_QUEUE_SIZE,
+        )
+
+    def get_items(self):
+        """Return the queue, starting its thread (again in forked processes)."""
+        with self.lock:
+            if self.pid != os.getpid():
+                self.items = queue.Queue(self.maxsize)
+                self.pid = os.getpid()
+                self.thread = None
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.work,
+                    args=(self.items,),
+                    name='user_management-rehash',
+                    daemon=True,
+                )
+                self.thread.start()
+            return self.items
+
+    def put(self, user, password):
+        """Queue `user`'s correct `password` to be hashed again."""
+        item = (type(user), user.pk, user.password, password)
+        try:
+            self.get_items().put_nowait(item)
+        except queue.Full:
+            pass
+
+    def join(self):
+        """Wait until the queued passwords are rehashed."""
+        self.get_items().join()
+
+    def work(self, items):
+        while True:
+            item = items.get()
+            try:
+                self.rehash(*item)
+            except Exception:
+                logger.exception('Failed to rehash the password of user %s.', item[1])
+            finally:
+                if items.empty():
+                    # Connections are per thread.
+                    connections.close_all()
+                items.task_done()
+
+    def rehash(self, model, pk, encoded, password):
+        """
+        Replace `encoded` with a new hash of `password`.
+
+        Return whether it was replaced: not if the password changed meanwhile.
+        """
+        try:
+            new_encoded = make_password(password)
+        except HashingUnavailable:
+            return False
+        users = model._default_manager.filter(pk=pk, password=encoded)
+        return bool(users.update(password=new_encoded))
+
+
+executor = HashingExecutor()
+admission = HashingAdmission()
+rehash_queue = RehashQueue()
+
+
+def make_password(password):
+    """Hash `password` with the preferred hasher."""
+    with admission.admit():
+        if not executor.enabled:
+            return hashers.make_password(password)
+        return executor.run(hashers.make_password, password)
+
+
+def set_password(user, password):
+    """`user.set_password(password)`, hashing in the pool when enabled."""
+    if not executor.enabled:
+        with admission.admit():
+            user.set_password(password)
+        return
+    user.password = make_password(password)
+    # Lets `user.save()` notify password validators, as `set_password` does.
+    user._password = password
+
+
+def check_password(user, password):
+    """
+    `user.check_password(password)`, checking in the pool when enabled.
+
+    As django does, a correct password hashed with outdated settings is hashed
+    again and saved, or queued to be when `rehash_queue` is enabled.
+    """
+    if not executor.enabled and not rehash_queue.enabled:
+        with admission.admit():
+            return user.check_password(password)
+
+    with admission.admit():
+        if executor.enabled:
+            is_correct, rehash = executor.run(_check_password, password, user.password)
+        else:
+            is_correct, rehash = _check_password(password, user.password)
+    if is_correct and rehash:
+        if rehash_queue.enabled:
+            rehash_queue.put(user, password)
+        else:
+            set_password(user, password)
+            user._password = None
+            user.save(update_fields=['password'])
+    return is_correct
@@ -0,0 +1,331 @@
+import time
+
+import mock
+from django.contrib.auth import hashers
+from django.test import override_settings, TestCase
+
+from user_management.models.tests.factories import UserFactory
+from user_management.models.tests.models import User
+from .. import hashing
+
+
+MD5 = 'django.contrib.auth.hashers.MD5PasswordHasher'
+SHA1 = 'django.contrib.auth.hashers.SHA1PasswordHasher'
+
+
+def run_inline(func, *args):
+    """Stand-in for `HashingExecutor.run`, calling `func` in this process."""
+    return func(*args)
+
+
+class TestHashingDisabled(TestCase):
+    def test_make_password(self):
+        with mock.patch.object(hashing.executor, 'submit') as submit:
+            encoded = hashing.make_password('Password1')
+
+        self.assertTrue(hashers.check_password('Password1', encoded))
+        submit.assert_not_called()
+
+    def test_set_password(self):
+        user = UserFactory.build()
+
+        with mock.patch.object(hashing.executor, 'submit') as submit:
+            hashing.set_password(user, 'Password1')
+
+        self.assertTrue(user.check_password('Password1'))
+        submit.assert_not_called()
+
+    def test_check_password(self):
+        user = UserFactory.build(password='Password1')
+
+        with mock.patch.object(hashing.executor, 'submit') as submit:
+            self.assertTrue(hashing.check_password(user, 'Password1'))
+            self.assertFalse(hashing.check_password(user, 'Password2'))
+
+        submit.assert_not_called()
+
+
+@override_settings(AUTH_PASSWORD_HASHING_WORKERS=1)
+class TestHashingExecutor(TestCase):
+    def tearDown(self):
+        hashing.executor.shutdown()
+
+    def test_make_password(self):
+        encoded = hashing.make_password('Password1')
+
+        self.assertTrue(hashers.check_password('Password1', encoded))
+
+    def test_set_password(self):
+        user = UserFactory.build()
+
+        hashing.set_password(user, 'Password1')
+
+        self.assertTrue(user.check_password('Password1'))
+        self.assertEqual(user._password, 'Password1')
+
+    def test_check_password(self):
+        user = UserFactory.build(password='Password1')
+
+        self.assertTrue(hashing.check_password(user, 'Password1'))
+        self.assertFalse(hashing.check_password(user, 'Password2'))
+
+    def test_check_password_rehash(self):
+        """Passwords hashed with an outdated hasher are hashed again."""
+        user = UserFactory.create(password='Password1')
+
+        with self.settings(PASSWORD_HASHERS=(SHA1, MD5)), \
+                mock.patch.object(hashing.executor, 'run', run_inline):
+            self.assertTrue(hashing.check_password(user, 'Password1'))
+
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('sha1$'))
+        self.assertIsNone(user._password)
+
+    @override_settings(AUTH_PASSWORD_HASHING_QUEUE_SIZE=0)
+    def test_saturated(self):
+        executor, slots = hashing.executor.get_pool()
+        slots.acquire()
+
+        with self.assertRaises(hashing.HashingUnavailable):
+            hashing.make_password('Password1')
+
+        slots.release()
+
+    @override_settings(AUTH_PASSWORD_HASHING_TIMEOUT=0.01)
+    def test_timeout(self):
+        with self.assertRaises(hashing.HashingUnavailable):
+            hashing.executor.run(time.sleep, 0.2)
+
+    def test_submit_error(self):
+        """A call failing to be scheduled doesn't keep its slot."""
+        executor, slots = hashing.executor.get_pool()
+
+        with mock.patch.object(executor, 'submit', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                hashing.executor.submit(time.sleep, 0)
+
+        queue_size = hashing.DEFAULT_AUTH_PASSWORD_HASHING_QUEUE_SIZE
+        self.assertEqual(slots._value, 1 + queue_size)
+
+    def test_get_pool(self):
+        pool = hashing.executor.get_pool()
+        self.assertIs(hashing.executor.get_pool(), pool)
+
+        with self.settings(AUTH_PASSWORD_HASHING_WORKERS=2):
+            with mock.patch.object(pool[0], 'shutdown') as shutdown:
+                self.assertIsNot(hashing.executor.get_pool(), pool)
+
+        shutdown.assert_called_once_with(wait=False)
+
+    def test_get_pool_forked(self):
+        """Pools of the parent process aren't used or stopped in forked processes."""
+        pool = hashing.executor.get_pool()
+
+        with mock.patch('os.getpid', return_value=-1), \
+                mock.patch.object(pool[0], 'shutdown') as shutdown:
+            new_pool = hashing.executor.get_pool()
+            hashing.executor.shutdown()
+
+        self.assertIsNot(new_pool, pool)
+        shutdown.assert_not_called()
+        pool[0].shutdown()
+
+
+class TestWorkerFunctions(TestCase):
+    """Functions called in the pool's processes (where coverage isn't measured)."""
+    def test_run(self):
+        self.assertEqual(hashing._run([MD5], len, 'abc'), 3)
+
+    def test_run_spawned(self):
+        """Spawned processes are configured with the parent's hashers."""
+        with mock.patch.object(hashing, 'settings') as settings:
+            settings.configured = False
+            hashing._run([MD5], len, 'abc')
+
+        settings.configure.assert_called_once_with(PASSWORD_HASHERS=[MD5])
+
+    def test_check_password(self):
+        encoded = hashers.make_password('Password1')
+
+        self.assertEqual(hashing._check_password('Password1', encoded), (True, False))
+        self.assertEqual(hashing._check_password('Password2', encoded), (False, False))
+        with self.settings(PASSWORD_HASHERS=(SHA1, MD5)):
+            self.assertEqual(hashing._check_password('Password1', encoded), (True, True))
+
+
+@override_settings(AUTH_PASSWORD_HASHING_MAX_CONCURRENT=1)
+class TestHashingAdmission(TestCase):
+    def setUp(self):
+        self.slots = hashing.admission.get_slots()
+
+    def test_admit(self):
+        user = UserFactory.build(password='Password1')
+
+        hashing.set_password(user, 'Password2')
+
+        self.assertTrue(hashing.check_password(user, 'Password2'))
+        self.assertTrue(self.slots.acquire(blocking=False))
+        self.slots.release()
+
+    def test_shed(self):
+        user = UserFactory.build(password='Password1')
+        self.slots.acquire()
+
+        with self.assertRaises(hashing.HashingUnavailable):
+            hashing.make_password('Password1')
+        with self.assertRaises(hashing.HashingUnavailable):
+            hashing.set_password(user, 'Password2')
+        with self.assertRaises(hashing.HashingUnavailable):
+            hashing.check_password(user, 'Password1')
+
+        self.slots.release()
+
+    @override_settings(AUTH_PASSWORD_HASHING_WAIT=0.5)
+    def test_wait(self):
+        with mock.patch.object(self.slots, 'acquire', return_value=False) as acquire:
+            with self.assertRaises(hashing.HashingUnavailable):
+                hashing.make_password('Password1')
+
+        acquire.assert_called_once_with(timeout=0.5)
+
+    def test_setting_changed(self):
+        with self.settings(AUTH_PASSWORD_HASHING_MAX_CONCURRENT=2):
+            slots = hashing.admission.get_slots()
+
+        self.assertIsNot(slots, self.slots)
+        self.assertIs(hashing.admission.get_slots(), hashing.admission.get_slots())
+
+    @override_settings(AUTH_PASSWORD_HASHING_WORKERS=1)
+    def test_check_password_rehash(self):
+        """Rehashing a password doesn't wait for the slot used to check it."""
+        user = UserFactory.create(password='Password1')
+
+        with self.settings(PASSWORD_HASHERS=(SHA1, MD5)), \
+                mock.patch.object(hashing.executor, 'run', run_inline):
+            self.assertTrue(hashing.check_password(user, 'Password1'))
+
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('sha1$'))
+
+
+class TestPasswordStatus(TestCase):
+    def test_current(self):
+        encoded = hashers.make_password('Password1')
+
+        self.assertEqual(hashing.password_status(encoded), ('md5', False))
+
+    def test_outdated(self):
+        encoded = hashers.make_password('Password1')
+
+        with self.settings(PASSWORD_HASHERS=(SHA1, MD5)):
+            self.assertEqual(hashing.password_status(encoded), ('md5', True))
+
+    def test_unusable(self):
+        unusable = hashers.make_password(None)
+        self.assertEqual(hashing.password_status(unusable), (None, False))
+        self.assertEqual(hashing.password_status(''), (None, False))
+
+    def test_unknown(self):
+        self.assertEqual(hashing.password_status('foo$bar'), ('unknown', True))
+
+
+class TestRehashQueue(TestCase):
+    def setUp(self):
+        self.queue = hashing.RehashQueue()
+        self.user = UserFactory.create(password='Password1')
+
+    def test_put(self):
+        with mock.patch.object(self.queue, 'rehash') as rehash:
+            self.queue.put(self.user, 'Password1')
+            self.queue.join()
+
+        rehash.assert_called_once_with(
+            User,
+            self.user.pk,
+            self.user.password,
+            'Password1',
+        )
+
+    def test_error(self):
+        """The thread keeps rehashing after an error."""
+        rehash = mock.patch.object(self.queue, 'rehash', side_effect=[ValueError, True])
+        with rehash as rehash, mock.patch.object(hashing.logger, 'exception') as log:
+            self.queue.put(self.user, 'Password1')
+            self.queue.put(self.user, 'Password1')
+            self.queue.join()
+
+        self.assertEqual(rehash.call_count, 2)
+        log.assert_called_once_with(
+            'Failed to rehash the password of user %s.',
+            self.user.pk,
+        )
+
+    @override_settings(AUTH_PASSWORD_REHASH_QUEUE_SIZE=1)
+    def test_full(self):
+        """Passwords are dropped when the queue is full."""
+        with mock.patch.object(self.queue, 'work'):
+            self.queue.put(self.user, 'Password1')
+            self.queue.put(self.user, 'Password2')
+
+        self.assertEqual(self.queue.items.qsize(), 1)
+
+    def test_forked(self):
+        """Forked processes start their own queue and thread."""
+        with mock.patch.object(self.queue, 'work'):
+            items = self.queue.get_items()
+            with mock.patch('os.getpid', return_value=-1):
+                self.assertIsNot(self.queue.get_items(), items)
+
+    def test_rehash(self):
+        encoded = self.user.password
+        with self.settings(PASSWORD_HASHERS=(SHA1, MD5)):
+            rehashed = self.queue.rehash(User, self.user.pk, encoded, 'Password1')
+
+            self.assertTrue(rehashed)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith('sha1$'))
+            self.assertTrue(self.user.check_password('Password1'))
+
+    def test_rehash_password_changed(self):
+        encoded = self.user.password
+        self.user.set_password('Password2')
+        self.user.save()
+
+        self.assertFalse(self.queue.rehash(User, self.user.pk, encoded, 'Password1'))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('Password2'))
+
+    @override_settings(AUTH_PASSWORD_HASHING_MAX_CONCURRENT=1)
+    def test_rehash_busy(self):
+        slots = hashing.admission.get_slots()
+        slots.acquire()
+
+        rehashed = self.queue.rehash(User, self.user.pk, self.user.password, 'Password1')
+
+        slots.release()
+        self.assertFalse(rehashed)
+
+
+@override_settings(AUTH_PASSWORD_REHASH_DEFERRED=True, PASSWORD_HASHERS=(SHA1, MD5))
+class TestDeferredRehash(TestCase):
+    def setUp(self):
+        with self.settings(PASSWORD_HASHERS=(MD5,)):
+            self.user = UserFactory.create(password='Password1')
+        self.encoded = self.user.password
+
+    def test_check_password(self):
+        with mock.patch.object(hashing.rehash_queue, 'put') as put:
+            self.assertTrue(hashing.check_password(self.user, 'Password1'))
+            self.assertFalse(hashing.check_password(self.user, 'Password2'))
+
+        put.assert_called_once_with(self.user, 'Password1')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, self.encoded)
+
+    @override_settings(AUTH_PASSWORD_HASHING_WORKERS=1)
+    def test_check_password_pool(self):
+        with mock.patch.object(hashing.rehash_queue, 'put') as put, \
+                mock.patch.object(hashing.executor, 'run', run_inline):
+            self.assertTrue(hashing.check_password(self.user, 'Password1'))
+
+        put.assert_called_once_with(self.user, 'Password1')
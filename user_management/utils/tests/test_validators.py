@@ -2,9 +2,9 @@
 import string
 
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.test import override_settings, TestCase
 
-from ..validators import validate_password_strength
+from ..validators import validate_password_length, validate_password_strength
 
 
 class PasswordsTest(TestCase):
@@ -53,3 +53,22 @@ class PasswordsTest(TestCase):
     def test_ok(self):
         password = 'AAAaaa11'
         self.assertIsNone(validate_password_strength(password))
+
+
+class PasswordLengthTest(TestCase):
+    def test_default(self):
+        validate_password_length('a' * 4096)
+
+        with self.assertRaises(ValidationError) as error:
+            validate_password_length('a' * 4097)
+        self.assertEqual(
+            error.exception.message,
+            'Password must have at most 4096 characters.',
+        )
+
+    @override_settings(AUTH_PASSWORD_MAX_LENGTH=10)
+    def test_setting(self):
+        validate_password_length('a' * 10)
+
+        with self.assertRaises(ValidationError):
+            validate_password_length('a' * 11)
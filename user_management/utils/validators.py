@@ -6,9 +6,12 @@ from string import (
     punctuation
 )
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 
+DEFAULT_AUTH_PASSWORD_MAX_LENGTH = 4096
+
 
 too_simple = _(
     'Password must have at least ' +
@@ -52,3 +55,20 @@ def validate_password_strength(value):
     for required in required_sets:
         if not used_chars.intersection(required):
             raise ValidationError(too_simple)
+
+
+def validate_password_length(value):
+    """
+    Passwords must not be longer than `settings.AUTH_PASSWORD_MAX_LENGTH`.
+
+    Hashing time grows with the password's length, so overlong passwords are
+    rejected while validating the data, before any password is hashed.
+    """
+    max_length = getattr(
+        settings,
+        'AUTH_PASSWORD_MAX_LENGTH',
+        DEFAULT_AUTH_PASSWORD_MAX_LENGTH,
+    )
+    if len(value) > max_length:
+        msg = _('Password must have at most {max_length} characters.')
+        raise ValidationError(msg.format(max_length=max_length))